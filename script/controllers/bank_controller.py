@@ -1,14 +1,76 @@
+import hashlib
 import os
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import chain
 import pandas as pd
-from utils import extract_text_from_pdf, clean_bank_statement_text, process_batches
-from utils.ai_processor import AIProcessor
+from utils import clean_bank_statement_text, process_batches
+from utils.ai_processor import AIProcessor, prompt_cache_usage, PROMPT_VERSION
 import json
 import streamlit as st
 
 # Import functions from pdf_processor and batch_processor
 # Adjust the import paths if your project structure differs
-from utils.pdf_processor import extract_text_from_pdf, clean_bank_statement_text
-from utils.batch_processor import process_batches, get_batch_status
+from utils.pdf_processor import (
+    iter_pdf_pages,
+    iter_text_lines,
+    get_extraction_pool,
+    clean_bank_statement_text,
+    PARALLEL_MIN_PAGES,
+    STATEMENT_STOP_MARKERS
+)
+from utils.batch_processor import (
+    Batch,
+    process_batches,
+    get_batch_status,
+    merge_batch_results,
+    DEFAULT_MAX_INPUT_TOKENS,
+    DEFAULT_MAX_OUTPUT_TOKENS
+)
+from utils.pdf_cache import get_pdf_text_cache
+from utils.llm_cache import get_llm_response_cache
+from utils.merchant_memo import get_merchant_memo, merchant_memo_scope
+from utils.client_pool import get_client_pool, api_key_fingerprint
+from utils.model_backends import get_model_backend
+from utils.request_scheduler import (
+    get_request_scheduler,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE
+)
+from utils.icost_builder import (
+    BANK_CURRENCIES,
+    statement_year,
+    build_icost_row,
+    iter_classification_lines,
+    parse_classification_response,
+    assemble_icost_rows
+)
+from utils.reconciler import match_icost_rows, record_match_key, icost_row_match_key, DEFAULT_RECONCILE_RETRIES
+from utils.model_router import ModelRouter, ModelStats, is_valid_classification, is_valid_icost_row
+from utils.batch_jobs import (
+    BatchJob,
+    BATCH_RUNS_DIRNAME,
+    DEFAULT_BATCH_POLL_SECONDS,
+    DEFAULT_BATCH_TIMEOUT_SECONDS,
+    save_batch_run,
+    load_batch_runs,
+    remove_batch_run
+)
+from utils.token_utils import estimate_tokens
+
+
+# 流式模式下汇总进度并刷新界面的间隔（秒）
+PROGRESS_POLL_SECONDS = 0.2
+# 多文件流水线：同时调用模型的文件数，以及已提取、等待调用模型的文件数上限
+DEFAULT_FILE_CONCURRENCY = 2
+DEFAULT_MAX_PREPARED_FILES = 2
+# process_many 中同时等待模型响应的线程总数上限：每个文件最多 ai_concurrency 个批次线程，
+# 同时调用模型的文件数会被降低，使 文件数 × ai_concurrency 不超过该值（ai_concurrency 本身更大时除外）
+MAX_AI_THREADS = 16
 
 
 class BankStatementController:
@@ -16,22 +78,87 @@ class BankStatementController:
     业务逻辑控制器，负责整合PDF处理、批次处理、AI分析以及生成iCost格式Excel文件。
     参考模块: main_tk.py, batch_processor.py, pdf_processor.py
     """
-    def __init__(self, output_dir="~/Downloads", model="gpt-4o", temperature=0.3, batch_size=150):
+    def __init__(self, output_dir="~/Downloads", model="gpt-4o", temperature=0.3, batch_size=150, pdf_workers=1,
+                 pdf_backend="pdfplumber", pdf_cache_max_mb=200, pdf_max_rss_mb=None, ai_mode="classify",
+                 batch_max_input_tokens=DEFAULT_MAX_INPUT_TOKENS, batch_max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS,
+                 ai_concurrency=4, ai_cache_ttl_hours=None, ai_cache_max_mb=50, merchant_memo=False,
+                 ai_streaming=True, reconcile_retries=DEFAULT_RECONCILE_RETRIES,
+                 ai_requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, ai_tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 model_routes=None, file_concurrency=DEFAULT_FILE_CONCURRENCY):
         """
         初始化控制器
         :param output_dir: 输出Excel文件的目录
         :param model: 使用的AI模型名称
         :param temperature: AI模型温度参数
         :param batch_size: 批次处理时每批的行数
+        :param pdf_workers: PDF并行提取的进程数，1为串行，None为使用全部CPU
+        :param pdf_backend: PDF文本提取后端，"pdfplumber"、"pdfium"，或按银行类型选择的"auto"
+            （pdfium 需要显式开启：BANK_PDF_BACKENDS 中没有银行切换到 pdfium，"auto" 等同于 pdfplumber）
+        :param pdf_cache_max_mb: PDF提取文本缓存的容量上限（MB），0表示不使用缓存
+        :param pdf_max_rss_mb: PDF提取时的常驻内存上限（MB），按整个进程（含其他会话）计算，None表示不限制
+        :param ai_mode: AI处理模式，"classify"只让模型返回分类、其他字段本地组装，"full"让模型生成全部字段
+        :param batch_max_input_tokens: 每批输入 token 上限
+        :param batch_max_output_tokens: 每批预期输出 token 上限；两个上限都为 None 时按 batch_size 固定行数分批
+        :param ai_concurrency: 同时发送给AI模型的批次数上限，1为逐批串行
+        :param ai_cache_ttl_hours: AI响应缓存的有效期（小时），None表示不使用缓存
+        :param ai_cache_max_mb: AI响应缓存的容量上限（MB）
+        :param merchant_memo: 是否使用商户分类记忆（仅分类模式）：已知商户在本地分类，不发送给AI模型。
+            记忆按用户（API key 摘要）和银行隔离，保存在输出目录下，超过有效期后不再使用
+        :param ai_streaming: 是否以流式方式接收模型响应，逐行更新已处理条数
+        :param reconcile_retries: 模型漏掉记录时只补发缺失记录的最多次数，0 表示不补发
+        :param ai_requests_per_minute: 每分钟模型请求数上限，None 表示不限制
+        :param ai_tokens_per_minute: 每分钟模型 token 上限，None 表示不限制
+        :param model_routes: 各银行类型的模型路由 {银行类型: (模型, ...)}，None 使用默认路由（不路由），{} 表示不路由
+        :param file_concurrency: process_many 同时调用模型的文件数，与 ai_concurrency 的乘积最多为 MAX_AI_THREADS
         """
         self.output_dir = os.path.expanduser(output_dir)
+        # 已提交、尚未取回结果的批量任务记录
+        self.batch_runs_dir = os.path.join(self.output_dir, BATCH_RUNS_DIRNAME)
         self.model = model
         self.temperature = temperature
         self.batch_size = batch_size
+        self.pdf_workers = pdf_workers if pdf_workers is not None else (os.cpu_count() or 1)
+        # 并行提取使用进程内共享的进程池，不为每个文件重新启动子进程
+        self.pdf_pool = get_extraction_pool(self.pdf_workers) if self.pdf_workers > 1 else None
+        self.pdf_backend = pdf_backend
+        self.pdf_max_rss_mb = pdf_max_rss_mb
+        self.ai_mode = ai_mode
+        self.batch_max_input_tokens = batch_max_input_tokens
+        self.batch_max_output_tokens = batch_max_output_tokens
+        self.ai_concurrency = ai_concurrency
+        self.ai_streaming = ai_streaming
+        self.reconcile_retries = reconcile_retries
+        self.file_concurrency = file_concurrency
+        # 提取文本缓存存放在输出目录下，重复上传同一份账单时跳过PDF解析
+        self.pdf_cache = get_pdf_text_cache(
+            os.path.join(self.output_dir, "pdf_text_cache"),
+            max_bytes=pdf_cache_max_mb * 1024 * 1024
+        ) if pdf_cache_max_mb else None
         # 加载配置文件并初始化AI处理器
         # with open('../script/config.json', 'r') as f:
         #     self.config = json.load(f)
-        self.ai_processor = AIProcessor()
+        # AI响应缓存需要显式开启：同一份账单重复处理时直接复用之前的模型输出
+        self.ai_cache = get_llm_response_cache(
+            os.path.join(self.output_dir, "llm_response_cache"),
+            max_bytes=ai_cache_max_mb * 1024 * 1024,
+            ttl_seconds=ai_cache_ttl_hours * 3600
+        ) if ai_cache_ttl_hours else None
+        # 限流、重试和熔断状态在进程内共享，多个文件和页面重跑共用同一份限额
+        self.ai_scheduler = get_request_scheduler("openai", ai_requests_per_minute, ai_tokens_per_minute)
+        # AI 客户端从进程内共享的池中获取，页面重跑和多个会话复用同一个连接池
+        self.client_pool = get_client_pool()
+        # 配置了路由时批次先交给便宜的模型，未通过校验的记录再升级到更强的模型
+        self.model_router = ModelRouter(model_routes)
+        self.ai_processor = AIProcessor(
+            response_cache=self.ai_cache,
+            scheduler=self.ai_scheduler,
+            client_pool=self.client_pool,
+            router=self.model_router
+        )
+        # 商户分类记忆需要显式开启，保存在输出目录下，随同一用户处理的账单逐渐积累
+        self.merchant_memo = get_merchant_memo(
+            os.path.join(self.output_dir, "merchant_memo.sqlite3")
+        ) if merchant_memo else None
 
     def process_files(self, file, model=None, temperature=0.3, batch_size=150, callback=None):
         """
@@ -44,100 +171,947 @@ class BankStatementController:
         :return: 处理结果
         """
         try:
-            # 提取PDF中的文本
-            pdf_text = extract_text_from_pdf(file)
-            if not pdf_text or not pdf_text.strip():
-                print(f"无法从文件 {file.name} 中提取文本。")
-                if callback:
-                    callback(
-                        filename=file.name,
-                        total_transactions=0,
-                        bank_type="提取失败",
-                        account_type="提取失败"
-                    )
+            statement = self._prepare_statement(file, model, callback)
+            if statement is None:
                 return None
+            return self._convert_statement(statement, model, callback)
+        except Exception as e:
+            return self._report_failure(file, e, callback)
 
+    def process_many(self, files, model=None, callback=None, prepare_workers=None, file_concurrency=None,
+                     max_prepared=DEFAULT_MAX_PREPARED_FILES, stats=None):
+        """
+        以流水线方式处理多个银行账单：提取和清理与调用模型（网络）分成两个阶段，
+        中间用有界队列连接。后面文件的PDF解析与前面文件的模型调用同时进行，
+        已提取但尚未调用模型的文件最多 max_prepared 个，避免提取过快时占用过多内存。
+        pdf_workers 大于 1 时，流水线中每个文件的PDF解析不论页数都交给共享的提取进程池，
+        提取线程只等待结果和清理文本；pdf_workers 为 1 时解析在提取线程内进行，
+        pdfplumber 解析期间持有 GIL，提取与模型调用的重叠只来自等待网络响应的时间。
+        回调都在调用线程中执行，可以安全地更新界面
+        :param files: PDF文件列表
+        :param model: 使用的AI模型
+        :param callback: 回调函数，用于更新每个文件的进度，与 process_files 相同
+        :param prepare_workers: 提取和清理阶段的线程数（同时提取的文件数），None 使用 pdf_workers
+        :param file_concurrency: 同时调用模型的文件数，None 使用 self.file_concurrency；
+            与 ai_concurrency 的乘积超过 MAX_AI_THREADS 时降低
+        :param max_prepared: 已提取、等待调用模型的文件数上限
+        :param stats: 可选的字典，写入总耗时、各阶段耗时和吞吐量
+        :return: 与 files 顺序一致的处理结果列表，处理失败的文件为 None
+        """
+        results = [None] * len(files)
+        if not files:
+            return results
+        file_concurrency = max(1, file_concurrency or self.file_concurrency)
+        max_files = max(1, MAX_AI_THREADS // max(1, self.ai_concurrency))
+        if file_concurrency > max_files:
+            print(f"同时调用模型的文件数 {file_concurrency} × 批次并发数 {self.ai_concurrency} 超过 {MAX_AI_THREADS}，"
+                  f"降为 {max_files} 个文件")
+            file_concurrency = max_files
+        prepare_workers = max(1, min(prepare_workers or self.pdf_workers, len(files)))
+        # 有进程池时页数少的账单也交给进程池，避免在提取线程中解析而与模型调用争用 GIL
+        min_parallel_pages = 1 if self.pdf_pool is not None else PARALLEL_MIN_PAGES
+        started = time.perf_counter()
+        pending_files = queue.SimpleQueue()
+        for position, file in enumerate(files):
+            pending_files.put((position, file))
+        # 有界队列：模型调用阶段跟不上时，提取阶段在这里等待
+        prepared = queue.Queue(maxsize=max(1, max_prepared))
+        # 工作线程不直接更新界面，回调和完成通知都放入事件队列，由调用线程依次执行
+        events = queue.SimpleQueue()
+        stop = threading.Event()
+        stage_seconds = {'prepare': 0.0, 'convert': 0.0}
+        stage_lock = threading.Lock()
+        remaining_preparers = [prepare_workers]
 
-            # 清理文本，获取交易记录行和银行、账户类型
-            cleaned_lines, transaction_count, bank_type, account_type = clean_bank_statement_text(pdf_text)
-            if transaction_count == 0:
-                print(f"在文件 {file.name} 中未找到有效的交易记录。")
-                if callback:
-                    callback(
-                        filename=file.name,
-                        total_transactions=0,
-                        bank_type=bank_type,
-                        account_type=account_type
-                    )
-                return None
+        def deferred_callback(**kwargs):
+            events.put(('callback', kwargs))
 
-            print(cleaned_lines)
+        def add_stage_seconds(stage, seconds):
+            with stage_lock:
+                stage_seconds[stage] += seconds
 
-            # 使用批次处理，将清理后的文本分批
-            batches = process_batches(cleaned_lines, self.batch_size)
-            print(f"分割为 {len(batches)} 个批次")
+        def put_prepared(item):
+            while not stop.is_set():
+                try:
+                    prepared.put(item, timeout=PROGRESS_POLL_SECONDS)
+                    return
+                except queue.Full:
+                    continue
 
-            # 使用AI处理器处理每个批次
-            transaction_data = []
-            total_processed_count = 0
-            for batch in batches:
-                ai_response = self.ai_processor.process_text(
-                    file_name=file.name,
-                    clean_lines=batch.get_text(),
-                    model=model,
+        def prepare_stage():
+            try:
+                while not stop.is_set():
+                    try:
+                        position, file = pending_files.get_nowait()
+                    except queue.Empty:
+                        break
+                    stage_started = time.perf_counter()
+                    try:
+                        statement = self._prepare_statement(
+                            file, model, deferred_callback if callback else None, min_parallel_pages
+                        )
+                    except Exception as e:
+                        statement = None
+                        events.put(('failed', (position, file, e)))
+                    else:
+                        if statement is None:
+                            events.put(('done', (position, None)))
+                    add_stage_seconds('prepare', time.perf_counter() - stage_started)
+                    if statement is not None:
+                        put_prepared((position, statement))
+            finally:
+                # 最后一个结束的提取线程通知模型调用阶段没有更多文件
+                with stage_lock:
+                    remaining_preparers[0] -= 1
+                    last = remaining_preparers[0] == 0
+                if last:
+                    for _ in range(file_concurrency):
+                        put_prepared(None)
+
+        def convert_stage():
+            while not stop.is_set():
+                try:
+                    item = prepared.get(timeout=PROGRESS_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                position, statement = item
+                stage_started = time.perf_counter()
+                try:
+                    result = self._convert_statement(statement, model, deferred_callback if callback else None)
+                except Exception as e:
+                    events.put(('failed', (position, statement['file'], e)))
+                else:
+                    events.put(('done', (position, result)))
+                add_stage_seconds('convert', time.perf_counter() - stage_started)
+
+        threads = [
+            threading.Thread(target=prepare_stage, name=f"pdf-prepare-{index}", daemon=True)
+            for index in range(prepare_workers)
+        ] + [
+            threading.Thread(target=convert_stage, name=f"ai-file-{index}", daemon=True)
+            for index in range(file_concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        finished = 0
+        try:
+            while finished < len(files):
+                try:
+                    kind, payload = events.get(timeout=PROGRESS_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if kind == 'callback':
+                    callback(**payload)
+                elif kind == 'failed':
+                    position, file, error = payload
+                    self._report_failure(file, error, callback)
+                    finished += 1
+                else:
+                    position, result = payload
+                    results[position] = result
+                    finished += 1
+        finally:
+            # 调用线程提前退出（如页面重跑）时，工作线程在当前步骤完成后停止
+            stop.set()
+
+        seconds = time.perf_counter() - started
+        succeeded = [result for result in results if result is not None]
+        transactions = sum(result['total_processed_count'] for result in succeeded)
+        pipeline_stats = {
+            'files': len(files),
+            'succeeded': len(succeeded),
+            'transactions': transactions,
+            'seconds': seconds,
+            'prepare_seconds': stage_seconds['prepare'],
+            'convert_seconds': stage_seconds['convert'],
+            # 两个阶段耗时之和与总耗时之比，大于 1 说明提取和模型调用有重叠
+            'overlap': (stage_seconds['prepare'] + stage_seconds['convert']) / seconds if seconds else 0.0,
+            'files_per_minute': len(succeeded) * 60 / seconds if seconds else 0.0,
+            'transactions_per_second': transactions / seconds if seconds else 0.0,
+        }
+        print(f"流水线处理 {len(files)} 个文件（成功 {len(succeeded)} 个）共 {transactions} 条记录，耗时 {seconds:.2f} 秒，"
+              f"提取 {stage_seconds['prepare']:.2f} 秒，模型 {stage_seconds['convert']:.2f} 秒，"
+              f"{pipeline_stats['files_per_minute']:.1f} 文件/分钟，{pipeline_stats['transactions_per_second']:.1f} 条/秒")
+        if stats is not None:
+            stats.update(pipeline_stats)
+        return results
+
+    def process_files_bulk(self, files, model=None, callback=None, poll_seconds=DEFAULT_BATCH_POLL_SECONDS,
+                           timeout_seconds=DEFAULT_BATCH_TIMEOUT_SECONDS, on_status=None):
+        """
+        批量任务模式处理多个银行账单：提交批量任务并等待结果，超时后取消任务、改为逐个请求。
+        适合命令行等一次性运行；页面中使用 submit_files_bulk / collect_files_bulk，超时后可以稍后继续获取
+        :param files: PDF文件列表
+        :param model: 使用的AI模型
+        :param callback: 回调函数，用于更新每个文件的进度
+        :param poll_seconds: 轮询批量任务状态的间隔（秒）
+        :param timeout_seconds: 最多等待批量任务的秒数，超时后取消任务并逐个请求，None 表示一直等待
+        :param on_status: 可选回调 (BatchJob)，每次轮询批量任务后调用
+        :return: 与 files 顺序一致的处理结果列表，处理失败的文件为 None
+        """
+        statements = self._prepare_bulk_statements(files, model, callback)
+        run = self._submit_bulk(files, statements, model)
+        return self._collect_bulk(run, statements, model, callback, poll_seconds, timeout_seconds, on_status,
+                                  cancel_on_timeout=True)
+
+    def submit_files_bulk(self, files, model=None, callback=None):
+        """
+        批量任务模式的第一步：所有文件的批次编入批量任务提交，不等待结果。
+        任务记录（任务 ID、请求与批次的对应关系、文件内容摘要）保存在输出目录下，
+        页面刷新或重启后可以用 find_bulk_run 找回，再交给 collect_files_bulk 获取结果
+        :param files: PDF文件列表
+        :param model: 使用的AI模型，记录在任务记录中
+        :return: 任务记录字典
+        """
+        statements = self._prepare_bulk_statements(files, model, callback)
+        return self._submit_bulk(files, statements, model)
+
+    def collect_files_bulk(self, files, run, model=None, callback=None, poll_seconds=DEFAULT_BATCH_POLL_SECONDS,
+                           timeout_seconds=DEFAULT_BATCH_TIMEOUT_SECONDS, on_status=None, cancel_on_timeout=False):
+        """
+        批量任务模式的第二步：等待任务完成，把结果分发回各个文件并生成Excel数据。
+        任务中失败、缺失或未通过校验的记录按原有流程逐个补发
+        :param files: 提交时的同一组PDF文件（按内容摘要核对）
+        :param run: submit_files_bulk 或 find_bulk_run 返回的任务记录
+        :param timeout_seconds: 本次最多等待的秒数，None 表示一直等待
+        :param cancel_on_timeout: 超时后是否取消任务并逐个请求；默认保留任务，返回 None，稍后可以再次获取
+        :return: 与 files 顺序一致的处理结果列表，处理失败的文件为 None；任务仍在运行时返回 None
+        :raises ValueError: 文件、处理模式或模型与任务记录不一致
+        """
+        if not self._bulk_run_matches(run, self._file_digests(files), model):
+            raise ValueError(f"文件、处理模式或模型与批量任务 {run['run_id']} 提交时不一致")
+        statements = self._prepare_bulk_statements(files, model, callback)
+        return self._collect_bulk(run, statements, model, callback, poll_seconds, timeout_seconds, on_status,
+                                  cancel_on_timeout)
+
+    def find_bulk_run(self, files, model=None):
+        """
+        查找这组文件以相同处理模式和模型提交、尚未取回结果的批量任务
+        :param model: 使用的AI模型；换了模型时不沿用旧模型的任务
+        :return: 任务记录字典，没有时返回 None
+        """
+        digests = self._file_digests(files)
+        for run in reversed(load_batch_runs(self.batch_runs_dir)):
+            if self._bulk_run_matches(run, digests, model):
+                return run
+        return None
+
+    def _bulk_run_matches(self, run, digests, model):
+        """任务记录是否对应这组文件（内容摘要）、当前处理模式和模型"""
+        return (run.get('files') == digests and run.get('ai_mode') == self.ai_mode
+                and run.get('model') == (model or self.model))
+
+    def _prepare_bulk_statements(self, files, model, callback):
+        """提取并分批全部文件，返回 {文件序号: 账单信息}，失败或没有交易记录的文件不在其中"""
+        statements = {}
+        for position, file in enumerate(files):
+            try:
+                statement = self._prepare_statement(file, model, callback)
+            except Exception as e:
+                self._report_failure(file, e, callback)
+                continue
+            if statement is None:
+                continue
+            statements[position] = statement
+            if callback:
+                callback(
+                    filename=file.name,
+                    total_transactions=statement['transaction_count'],
+                    bank_type=statement['bank_type'],
+                    account_type=statement['account_type'],
+                    total_processed_count=0
                 )
-                parsed_transactions, parsed_count = self.parse_ai_response(ai_response)
-                print(f"Batch {batch.index + 1} AI处理结果: {parsed_transactions}")
-                print(f"Batch {batch.index + 1} AI处理总数: {parsed_count}")
-                if parsed_transactions:
-                    transaction_data.extend(parsed_transactions)
-                    total_processed_count += parsed_count
-
-            print(f"所有Batch AI处理结果总数: {total_processed_count}")
-            
-            # 保存处理结果
-            excel_data, output_file = self.save_to_excel(transaction_data, file.name, bank_type)
+        return statements
+
+    def _submit_bulk(self, files, statements, model=None):
+        """提交批量任务并保存任务记录"""
+        # 每个批次是任务中的一个请求；一个批量任务只能使用一个模型，按各账单路由的第一个模型分组
+        groups = {}
+        requests = {}
+        for position, statement in statements.items():
+            for batch in statement['batches']:
+                keys, prompts = self._batch_prompts(batch, statement['file'].name)
+                if not keys:
+                    continue
+                custom_id = f"file{position}-batch{batch.index}"
+                groups.setdefault(statement['models'][0], {})[custom_id] = prompts
+                requests[custom_id] = (position, batch.index, keys)
+        print(f"批量任务模式: {len(statements)} 个文件，{len(requests)} 个批次，"
+              f"{len(groups)} 个任务 ({', '.join(groups)})")
+
+        # 先提交全部任务再逐个等待，各任务在服务商一侧同时执行
+        jobs = []
+        for job_model, prompts in groups.items():
+            try:
+                jobs.append(self.ai_processor.submit_batch_job(prompts, job_model))
+            except Exception as e:
+                print(f"提交 {job_model} 批量任务失败，{len(prompts)} 个批次改为逐个请求: {e}")
+        run = {
+            'run_id': uuid.uuid4().hex,
+            'ai_mode': self.ai_mode,
+            'model': model or self.model,
+            'files': self._file_digests(files),
+            'file_names': [file.name for file in files],
+            'requests': requests,
+            'jobs': [job.to_dict() for job in jobs],
+        }
+        if any(job.job_id for job in jobs):
+            # 任务在服务商一侧计费运行，先保存记录，页面刷新后仍然可以取回结果
+            save_batch_run(self.batch_runs_dir, run)
+            print(f"批量任务记录 {run['run_id']} 已保存到 {self.batch_runs_dir}")
+        return run
+
+    def _collect_bulk(self, run, statements, model, callback, poll_seconds, timeout_seconds, on_status,
+                      cancel_on_timeout):
+        """等待任务记录中的批量任务，按请求与批次的对应关系分发结果并生成Excel数据"""
+        prefetched = {position: {} for position in statements}
+        for data in run['jobs']:
+            job = BatchJob.from_dict(data)
+            try:
+                responses = self.ai_processor.collect_batch_job(
+                    job, poll_seconds, timeout_seconds, on_status, cancel_on_timeout
+                )
+            except Exception as e:
+                print(f"获取批量任务 {job.job_id} 的结果失败，改为逐个请求: {e}")
+                continue
+            if responses is None:
+                return None
+            for custom_id, (content, usage) in responses.items():
+                position, batch_index, keys = run['requests'][custom_id]
+                if position in prefetched:
+                    prefetched[position][batch_index] = (list(keys), content, usage)
+        remove_batch_run(self.batch_runs_dir, run['run_id'])
+
+        results = [None] * len(run['files'])
+        for position, statement in statements.items():
+            try:
+                results[position] = self._convert_statement(statement, model, callback, prefetched[position])
+            except Exception as e:
+                self._report_failure(statement['file'], e, callback)
+        return results
+
+    @staticmethod
+    def _file_digests(files):
+        """各文件内容的 SHA-256，用于把保存的批量任务对应回重新上传的文件"""
+        digests = []
+        for file in files:
+            if hasattr(file, 'getvalue'):
+                data = file.getvalue()
+            else:
+                file.seek(0)
+                data = file.read()
+                file.seek(0)
+            digests.append(hashlib.sha256(data).hexdigest())
+        return digests
 
-            # 处理完成后调用回调函数
+    def _batch_prompts(self, batch, file_name):
+        """
+        批量任务中一个批次的请求：与逐个处理时第一次请求的内容一致
+        :return: tuple (请求的记录键, (系统提示词, 用户消息))；分类模式下全部记录都由商户记忆分类时键为空
+        """
+        if self.ai_mode == "classify":
+            keys = [row_id for row_id in range(1, batch.length + 1) if row_id not in batch.known]
+            request = Batch([batch.content[row_id - 1] for row_id in keys], batch.header)
+            return keys, self.ai_processor.classify_prompts(request.get_classification_text())
+        keys = list(range(batch.length))
+        request = Batch([batch.content[index] for index in keys], batch.header)
+        return keys, self.ai_processor.full_prompts(file_name, request.get_text())
+
+    def _prepare_statement(self, file, model=None, callback=None, min_parallel_pages=PARALLEL_MIN_PAGES):
+        """
+        提取并清理账单文本，分批并确定模型路由（处理账单的第一阶段，不调用模型）
+        :param min_parallel_pages: 使用提取进程池的最少页数
+        :return: 账单信息字典，交给 _convert_statement；没有可处理的交易记录时返回 None
+        """
+        # 逐页提取PDF中的文本，清理阶段按需消费，避免整份账单常驻内存
+        extraction_stats = {}
+        pdf_pages = iter_pdf_pages(
+            file,
+            workers=self.pdf_workers,
+            min_parallel_pages=min_parallel_pages,
+            pool=self.pdf_pool,
+            backend=self.pdf_backend,
+            cache=self.pdf_cache,
+            stop_markers=STATEMENT_STOP_MARKERS,
+            max_rss_mb=self.pdf_max_rss_mb,
+            stats=extraction_stats
+        )
+        first_page = next((page for page in pdf_pages if page.strip()), None)
+        if first_page is None:
+            print(f"无法从文件 {file.name} 中提取文本。")
             if callback:
                 callback(
                     filename=file.name,
-                    total_transactions=transaction_count,
-                    bank_type=bank_type,
-                    account_type=account_type,
-                    total_processed_count=total_processed_count,
-                    output_file=output_file,
-                    excel_data=excel_data,
-                    error_message=None
+                    total_transactions=0,
+                    bank_type="提取失败",
+                    account_type="提取失败"
                 )
-            
-            return {
-                'transaction_count': transaction_count,
-                'bank_type': bank_type,
-                'account_type': account_type,
-                'batches': len(batches),
-                'total_processed_count': total_processed_count,
-                'output_file': output_file,
-                'excel_data': excel_data,
-                'error_message': None
-            }
-            
-        except Exception as e:
-            print(f"处理文件 {file.name} 时出错: {str(e)}")
+            return None
+
+
+        # 清理文本，获取交易记录行和银行、账户类型
+        pdf_lines = iter_text_lines(chain([first_page], pdf_pages))
+        cleaned_lines, transaction_count, bank_type, account_type = clean_bank_statement_text(pdf_lines)
+        # 清理阶段可能在结束标记处提前停止，关闭生成器以释放PDF并保存已提取的页面
+        pdf_pages.close()
+        peak_rss_mb = extraction_stats.get('peak_rss_mb')
+        print(f"文件 {file.name} 提取 {extraction_stats.get('pages', 0)} 页"
+              + (f"，峰值内存 {peak_rss_mb:.1f} MB" if peak_rss_mb is not None else ""))
+        if self.pdf_cache:
+            print(f"PDF文本缓存统计: {self.pdf_cache.stats()}")
+        if transaction_count == 0:
+            print(f"在文件 {file.name} 中未找到有效的交易记录。")
             if callback:
                 callback(
                     filename=file.name,
                     total_transactions=0,
-                    bank_type="处理失败",
-                    account_type="处理失败",
-                    total_processed_count=0,
-                    output_file=None,
-                    excel_data=None,
-                    error_message=str(e)
+                    bank_type=bank_type,
+                    account_type=account_type
                 )
             return None
+
+        print(cleaned_lines)
+
+        # 使用批次处理，将清理后的文本分批：默认按 token 预算装箱，未设置预算时按固定行数
+        if self.batch_max_input_tokens is None and self.batch_max_output_tokens is None:
+            batches = process_batches(cleaned_lines, self.batch_size)
+        else:
+            batches = process_batches(
+                cleaned_lines,
+                max_input_tokens=self.batch_max_input_tokens,
+                max_output_tokens=self.batch_max_output_tokens,
+                ai_mode=self.ai_mode,
+                model=self.model
+            )
+
+        # 按银行类型确定依次使用的模型
+        models = self.model_router.route_for(bank_type, model or self.model)
+        print(f"模型路由: {' -> '.join(models)}")
+
+        # 商户记忆在分批后查找一次，批量任务的请求和之后的分类都使用这份结果
+        memo_scope = self._merchant_memo_scope(bank_type, models[0])
+        if memo_scope is not None:
+            for batch in batches:
+                batch.known = self.merchant_memo.lookup(batch.content, memo_scope)
+        return {
+            'file': file,
+            'transaction_count': transaction_count,
+            'bank_type': bank_type,
+            'account_type': account_type,
+            'batches': batches,
+            'models': models,
+            'year': statement_year(file.name),
+            'currency': BANK_CURRENCIES.get(bank_type, ""),
+            'extraction_stats': extraction_stats,
+            'memo_scope': memo_scope,
+        }
+
+    def _merchant_memo_scope(self, bank_type, model):
+        """
+        返回账单使用的商户记忆作用域：按模型后端的 API key 区分用户，再按银行区分
+        :return: 作用域字符串；未开启商户记忆、非分类模式或没有 API key 时返回 None
+        """
+        if not self.merchant_memo or self.ai_mode != "classify":
+            return None
+        api_key = self.ai_processor.api_key_for(get_model_backend(model))
+        if not api_key:
+            return None
+        return merchant_memo_scope(api_key_fingerprint(api_key), bank_type)
+
+    def _convert_statement(self, statement, model=None, callback=None, prefetched=None):
+        """
+        处理账单的第二阶段：把各批次交给模型，汇总结果并生成Excel数据
+        :param statement: _prepare_statement 返回的账单信息
+        :param prefetched: 可选的 {批次序号: (请求的记录键, 响应文本, token 用量)}，批量任务已经返回的第一轮结果
+        :return: 处理结果
+        """
+        file = statement['file']
+        transaction_count = statement['transaction_count']
+        bank_type = statement['bank_type']
+        account_type = statement['account_type']
+        batches = statement['batches']
+        models = statement['models']
+        year = statement['year']
+        currency = statement['currency']
+        extraction_stats = statement['extraction_stats']
+        batch_stats = {
+            'output_tokens': 0,
+            'full_output_tokens': 0,
+            'missing_rows': 0,
+            'duplicate_rows': 0,
+            'rerequested_rows': 0,
+            'escalated_rows': 0,
+            'invalid_rows': 0,
+            'input_tokens': 0,
+            'cached_input_tokens': 0,
+        }
+        total_processed_count = 0
+        # 尚未完成的批次已流式收到的行数，批次完成后以实际解析结果替换
+        streamed_counts = {}
+
+        def report_progress():
+            if callback:
+                callback(
+                    filename=file.name,
+                    total_transactions=transaction_count,
+                    bank_type=bank_type,
+                    account_type=account_type,
+                    total_processed_count=total_processed_count + sum(streamed_counts.values())
+                )
+
+        def on_rows(rows_by_batch):
+            for index, count in rows_by_batch.items():
+                streamed_counts[index] = streamed_counts.get(index, 0) + count
+            report_progress()
+
+        def on_batch_done(batch, parsed_count, stats):
+            nonlocal total_processed_count
+            streamed_counts.pop(batch.index, None)
+            total_processed_count += parsed_count
+            for key, value in (stats or {}).items():
+                batch_stats[key] += value
+            report_progress()
+
+        # 模型统计按文件记录；控制器的路由器同时累计所有文件
+        model_stats = ModelStats()
+        first_row_seconds = self.dispatch_batches(
+            batches, file.name, models, year, currency, on_batch_done, on_rows, prefetched, statement['memo_scope'],
+            model_stats
+        )
+        transaction_data = merge_batch_results(batches)
+        batch_status = get_batch_status(batches)
+
+        print(f"所有Batch AI处理结果总数: {total_processed_count}")
+        print(f"批次处理状态: {batch_status}")
+        if total_processed_count != transaction_count:
+            print(f"警告: 账单共 {transaction_count} 条交易记录，处理结果 {total_processed_count} 条")
+        # 没有收到模型响应的批次没有输出，按失败报告；模型漏掉而在本地补全的记录只提示
+        error_message = None
+        if batch_status['failed']:
+            error_message = (f"{batch_status['failed']}/{batch_status['total']} 个批次没有收到模型响应，"
+                             f"已处理 {total_processed_count}/{transaction_count} 条记录")
+        warnings = []
+        if batch_stats['missing_rows']:
+            warnings.append(f"模型未返回 {batch_stats['missing_rows']} 条记录，已在本地按金额正负推断类型")
+        if batch_stats['invalid_rows']:
+            warnings.append(f"{batch_stats['invalid_rows']} 条记录的类型或分类未通过校验，保留了模型的结果")
+        warning_message = "；".join(warnings) + "，请核对" if warnings else None
+        print(f"对账: 升级模型 {batch_stats['escalated_rows']} 条，补发 {batch_stats['rerequested_rows']} 条，"
+              f"丢弃重复 {batch_stats['duplicate_rows']} 条，本地补全 {batch_stats['missing_rows']} 条，"
+              f"未通过校验 {batch_stats['invalid_rows']} 条")
+        model_stats = model_stats.snapshot()
+        print(f"文件 {file.name} 模型统计: {model_stats}")
+        print(f"模型路由累计统计: {self.model_router.stats()}")
+        if self.ai_mode == "classify":
+            self._print_token_reduction("全部批次", batch_stats)
+        if batch_stats['input_tokens']:
+            print(f"输入 token {batch_stats['input_tokens']}，命中提示缓存 {batch_stats['cached_input_tokens']} "
+                  f"({batch_stats['cached_input_tokens'] / batch_stats['input_tokens']:.0%})")
+        if self.ai_cache:
+            print(f"AI响应缓存统计: {self.ai_cache.stats()}")
+        scheduler = self.ai_processor.scheduler_for(get_model_backend(model or self.model))
+        request_stats = scheduler.stats() if scheduler else {}
+        print(f"AI请求调度统计: {request_stats}")
+        print(f"AI客户端池统计: {self.client_pool.stats()}")
+        if self.merchant_memo and self.ai_mode == "classify":
+            print(f"商户分类记忆统计: {self.merchant_memo.stats()}")
         
+        # 保存处理结果
+        excel_data, output_file = self.save_to_excel(transaction_data, file.name, bank_type)
+
+        # 处理完成后调用回调函数
+        if callback:
+            callback(
+                filename=file.name,
+                total_transactions=transaction_count,
+                bank_type=bank_type,
+                account_type=account_type,
+                total_processed_count=total_processed_count,
+                output_file=output_file,
+                excel_data=excel_data,
+                error_message=error_message,
+                warning_message=warning_message
+            )
         
+        return {
+            'transaction_count': transaction_count,
+            'bank_type': bank_type,
+            'account_type': account_type,
+            'batches': len(batches),
+            'total_processed_count': total_processed_count,
+            'output_file': output_file,
+            'excel_data': excel_data,
+            'pdf_peak_rss_mb': extraction_stats.get('peak_rss_mb'),
+            'output_tokens': {
+                'output_tokens': batch_stats['output_tokens'],
+                'full_output_tokens': batch_stats['full_output_tokens'],
+            },
+            'missing_rows': batch_stats['missing_rows'],
+            'duplicate_rows': batch_stats['duplicate_rows'],
+            'rerequested_rows': batch_stats['rerequested_rows'],
+            'escalated_rows': batch_stats['escalated_rows'],
+            'invalid_rows': batch_stats['invalid_rows'],
+            'model_stats': model_stats,
+            'prompt_cache': {
+                'prompt_version': PROMPT_VERSION,
+                'input_tokens': batch_stats['input_tokens'],
+                'cached_input_tokens': batch_stats['cached_input_tokens'],
+            },
+            'failed_batches': batch_status['failed'],
+            'first_row_seconds': first_row_seconds,
+            'request_stats': request_stats,
+            'error_message': error_message,
+            'warning_message': warning_message
+        }
+
+    def _report_failure(self, file, error, callback=None):
+        """打印处理文件时的错误并通知界面"""
+        print(f"处理文件 {file.name} 时出错: {str(error)}")
+        if callback:
+            callback(
+                filename=file.name,
+                total_transactions=0,
+                bank_type="处理失败",
+                account_type="处理失败",
+                total_processed_count=0,
+                output_file=None,
+                excel_data=None,
+                error_message=str(error)
+            )
+        return None
+
+
+    def dispatch_batches(self, batches, file_name, models, year, currency, on_batch_done=None, on_rows=None,
+                         prefetched=None, memo_scope=None, model_stats=None):
+        """
+        用线程池并发处理批次，并发数不超过 ai_concurrency。
+        每个批次的结果写入 batch.result；单个批次失败只记录错误，不影响其他批次。
+        回调都在调用线程中执行，可以安全地更新界面
+        :param on_batch_done: 可选回调 (batch, parsed_count, batch_stats)，按完成顺序调用
+        :param on_rows: 可选回调 ({批次序号: 新收到的行数})，流式模式下每 PROGRESS_POLL_SECONDS 汇总调用一次
+        :param prefetched: 可选的 {批次序号: (请求的记录键, 响应文本, token 用量)}，这些批次的第一轮请求直接使用已有的响应
+        :param memo_scope: 商户记忆的作用域，模型给出的分类记录到其中；None 表示不记录
+        :param model_stats: 可选的 ModelStats，这些批次的模型调用同时计入其中（按文件统计）
+        :return: 从开始发送到收到第一条结果的秒数，没有结果时为 None
+        """
+        if not batches:
+            return None
+        started = time.perf_counter()
+        first_row_seconds = None
+        progress = queue.SimpleQueue()
+        workers = max(1, min(self.ai_concurrency, len(batches)))
+
+        def run(batch):
+            with self.model_router.collecting(model_stats):
+                return self.process_batch(
+                    batch, file_name, models, year, currency,
+                    (lambda count: progress.put((batch.index, count))) if self.ai_streaming else None,
+                    prefetched.get(batch.index) if prefetched else None,
+                    memo_scope
+                )
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-batch") as executor:
+            futures = {executor.submit(run, batch): batch for batch in batches}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=PROGRESS_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                # 先汇总流式进度，工作线程在批次完成前放入的行数都会在完成回调之前处理
+                rows_by_batch = {}
+                while not progress.empty():
+                    index, count = progress.get()
+                    rows_by_batch[index] = rows_by_batch.get(index, 0) + count
+                if rows_by_batch:
+                    if first_row_seconds is None:
+                        first_row_seconds = time.perf_counter() - started
+                    if on_rows:
+                        on_rows(rows_by_batch)
+                for future in sorted(done, key=lambda f: futures[f].index):
+                    batch = futures[future]
+                    try:
+                        parsed_transactions, parsed_count, batch_stats = future.result()
+                    except Exception as e:
+                        print(f"Batch {batch.index + 1} 处理失败: {e}")
+                        parsed_transactions, parsed_count, batch_stats = [], 0, None
+                    print(f"Batch {batch.index + 1} AI处理结果: {parsed_transactions}")
+                    print(f"Batch {batch.index + 1} AI处理总数: {parsed_count}")
+                    if parsed_count and first_row_seconds is None:
+                        first_row_seconds = time.perf_counter() - started
+                    batch.processed = True
+                    batch.result = parsed_transactions
+                    if on_batch_done:
+                        on_batch_done(batch, parsed_count, batch_stats)
+        if first_row_seconds is not None:
+            print(f"首条结果耗时 {first_row_seconds:.2f} 秒，全部批次耗时 {time.perf_counter() - started:.2f} 秒")
+        return first_row_seconds
+
+    def process_batch(self, batch, file_name, models, year, currency, on_rows=None, prefetched=None,
+                      memo_scope=None):
+        """
+        按 ai_mode 处理单个批次（在工作线程中运行）
+        :param models: 依次使用的模型，见 ModelRouter.route_for
+        :param on_rows: 可选回调 (行数)，流式接收响应时每得到一条有效结果调用一次（需线程安全）
+        :param prefetched: 可选的 (请求的记录键, 响应文本, token 用量)，批量任务中第一个模型返回的结果
+        :param memo_scope: 商户记忆的作用域（仅分类模式）
+        :return: tuple (交易记录列表, 记录数, 批次统计)
+        """
+        stats = {
+            'missing_rows': 0,
+            'duplicate_rows': 0,
+            'rerequested_rows': 0,
+            'escalated_rows': 0,
+            'invalid_rows': 0,
+            'input_tokens': 0,
+            'cached_input_tokens': 0,
+        }
+        if self.ai_mode == "classify":
+            stats.update(output_tokens=0, full_output_tokens=0)
+            parsed_transactions, parsed_count = self.classify_batch(
+                batch, models, year, currency, stats, on_rows, prefetched, memo_scope
+            )
+            return parsed_transactions, parsed_count, stats
+        on_line = self._row_counter(batch.content, on_rows)
+
+        # 按日期和金额把输出行对应回输入记录：重复的行丢弃，缺失或分类未通过校验的记录交给下一个模型
+        responded = False
+
+        def ask(model, indexes):
+            nonlocal responded, prefetched
+            request = Batch([batch.content[index] for index in indexes], batch.header)
+            if prefetched is not None and prefetched[0] == indexes:
+                _, ai_response, usage = prefetched
+                prefetched = None
+            else:
+                ai_response = self.ai_processor.process_text(
+                    file_name=file_name,
+                    clean_lines=request.get_text(),
+                    model=model,
+                    on_line=on_line,
+                )
+                usage = self.ai_processor.last_usage
+            if ai_response is None:
+                return None
+            self._add_prompt_usage(stats, usage)
+            responded = True
+            parsed_transactions, _ = self.parse_ai_response(ai_response)
+            request_matched, _, duplicates, unmatched = match_icost_rows(request.content, parsed_transactions)
+            stats['duplicate_rows'] += len(duplicates)
+            if duplicates:
+                print(f"Batch {batch.index + 1} 丢弃 {len(duplicates)} 条重复记录: {duplicates}")
+            if unmatched:
+                print(f"Batch {batch.index + 1} 丢弃 {len(unmatched)} 条日期金额对不上的记录: {unmatched}")
+            valid, invalid = {}, {}
+            for index, row in request_matched.items():
+                (valid if is_valid_icost_row(row) else invalid)[indexes[index]] = row
+            return valid, invalid
+
+        matched, fallback, pending = self._request_with_escalation(
+            batch, models, list(range(batch.length)), ask, stats
+        )
+        matched.update((index, fallback[index]) for index in pending if index in fallback)
+
+        # 仍然缺失的记录在本地组装，按金额正负推断类型，保证条数与账单一致
+        pending = [index for index in pending if index not in matched]
+        if pending and responded:
+            stats['missing_rows'] += len(pending)
+            print(f"Batch {batch.index + 1} 模型未返回 {len(pending)} 条记录，按金额正负推断类型")
+            for index in pending:
+                matched[index] = build_icost_row(batch.content[index], year, currency)
+        parsed_transactions = [matched[index] for index in sorted(matched)]
+        return parsed_transactions, len(parsed_transactions), stats
+
+    @staticmethod
+    def _row_counter(records, on_rows):
+        """
+        返回统计完整模式流式进度的 on_line；没有 on_rows 时返回 None
+        调度器重试、升级和补发会再次收到同一记录的结果：按日期和金额对应回记录，每条记录只计一次
+        """
+        if not on_rows:
+            return None
+        uncounted = Counter(record_match_key(record) for record in records)
+
+        def on_line(line):
+            parts = [part.strip() for part in line.split("|")]
+            key = icost_row_match_key(parts) if len(parts) == 10 else None
+            if key is not None and uncounted[key] > 0:
+                uncounted[key] -= 1
+                on_rows(1)
+        return on_line
+
+    def classify_batch(self, batch, models, year, currency, stats=None, on_rows=None, prefetched=None,
+                       memo_scope=None):
+        """
+        分类模式处理一个批次：模型只返回分类，日期、金额、账户和货币由本地组装
+        :param batch: Batch对象
+        :param models: 依次使用的模型，见 ModelRouter.route_for
+        :param year: 账单年份
+        :param currency: 货币
+        :param stats: 可选的字典，累加实际输出 token、完整模式的估算输出 token 和对账统计
+        :param on_rows: 可选回调 (行数)，本地分类和流式收到的每条分类都会报告
+        :param prefetched: 可选的 (请求的编号, 响应文本, token 用量)，批量任务中第一个模型返回的结果
+        :param memo_scope: 商户记忆的作用域，模型给出的有效分类记录到其中；None 表示不记录
+        :return: tuple (交易记录列表, 记录数)
+        :raises RuntimeError: 需要模型分类的记录没有收到任何模型响应，该批次按失败处理
+        """
+        # 已知商户（分批时已查找商户记忆）在本地分类，只把未知商户的记录发送给模型
+        classifications = dict(batch.known)
+        if prefetched is not None:
+            # 批量任务按提交时的商户记忆决定发送哪些记录，以任务中请求的编号为准
+            pending_ids = list(prefetched[0])
+            requested = set(pending_ids)
+            classifications = {
+                row_id: classification for row_id, classification in classifications.items()
+                if row_id not in requested
+            }
+        else:
+            pending_ids = [row_id for row_id in range(1, batch.length + 1) if row_id not in classifications]
+        if on_rows and classifications:
+            on_rows(len(classifications))
+        # 调度器重试、升级和补发会再次收到同一记录的分类，每条记录只计一次
+        counted = set(classifications)
+
+        def line_counter(row_ids):
+            """返回统计流式进度的 on_line，把请求中的编号对应回批次中的编号"""
+            if not on_rows:
+                return None
+
+            def on_line(line):
+                for request_id in parse_classification_response(line):
+                    if 0 < request_id <= len(row_ids) and row_ids[request_id - 1] not in counted:
+                        counted.add(row_ids[request_id - 1])
+                        on_rows(1)
+            return on_line
+
+        # 按编号对账：重复的编号只保留第一次的结果，缺失或分类未通过校验的编号交给下一个模型
+        batch_stats = {
+            'output_tokens': 0,
+            'missing_rows': 0,
+            'duplicate_rows': 0,
+            'rerequested_rows': 0,
+            'escalated_rows': 0,
+            'invalid_rows': 0,
+            'input_tokens': 0,
+            'cached_input_tokens': 0,
+        }
+
+        responded = False
+
+        def ask(model, row_ids):
+            nonlocal responded, prefetched
+            if prefetched is not None and prefetched[0] == row_ids:
+                _, ai_response, usage = prefetched
+                prefetched = None
+            else:
+                request = Batch([batch.content[row_id - 1] for row_id in row_ids], batch.header)
+                ai_response = self.ai_processor.classify_text(
+                    clean_lines=request.get_classification_text(),
+                    model=model,
+                    on_line=line_counter(row_ids),
+                )
+                usage = self.ai_processor.last_usage
+            if ai_response is None:
+                return None
+            responded = True
+            self._add_prompt_usage(batch_stats, usage)
+            batch_stats['output_tokens'] += (
+                getattr(usage, 'completion_tokens', None) or estimate_tokens(ai_response, model)
+            )
+            valid, invalid = {}, {}
+            for request_id, classification in iter_classification_lines(ai_response):
+                if not 0 < request_id <= len(row_ids):
+                    continue
+                row_id = row_ids[request_id - 1]
+                if row_id in valid or row_id in invalid:
+                    batch_stats['duplicate_rows'] += 1
+                    continue
+                (valid if is_valid_classification(classification) else invalid)[row_id] = classification
+            return valid, invalid
+
+        learned, fallback, pending = self._request_with_escalation(batch, models, pending_ids, ask, batch_stats)
+        if pending_ids and not responded:
+            # 没有任何模型响应时不在本地补全，否则整批记录都会以空分类"成功"输出
+            raise RuntimeError(f"{len(pending_ids)} 条记录没有收到任何模型响应")
+        classifications.update((row_id, fallback[row_id]) for row_id in pending if row_id in fallback)
+        classifications.update(learned)
+        if memo_scope is not None:
+            self.merchant_memo.remember(
+                ((batch.content[row_id - 1], classification)
+                 for row_id, classification in learned.items()
+                 if is_valid_classification(classification)),
+                memo_scope
+            )
+        if len(pending_ids) < batch.length:
+            print(f"Batch {batch.index + 1} 商户记忆本地分类 {batch.length - len(pending_ids)} 条，"
+                  f"发送模型 {len(pending_ids)} 条")
+        if batch_stats['duplicate_rows']:
+            print(f"Batch {batch.index + 1} 丢弃 {batch_stats['duplicate_rows']} 条重复的分类")
+        rows, missing_ids = assemble_icost_rows(batch.content, classifications, year, currency)
+        if missing_ids:
+            batch_stats['missing_rows'] = len(missing_ids)
+            print(f"Batch {batch.index + 1} 模型未返回 {len(missing_ids)} 条记录的分类，按金额正负推断类型: {missing_ids}")
+
+        # 输出 token：分类模式的实际用量，与模型生成完整 10 列时的估算用量对比
+        batch_stats['full_output_tokens'] = estimate_tokens("\n".join(" | ".join(row) for row in rows), models[-1])
+        self._print_token_reduction(f"Batch {batch.index + 1}", batch_stats)
+        if stats is not None:
+            for key, value in batch_stats.items():
+                stats[key] += value
+        return rows, len(rows)
+
+    def _request_with_escalation(self, batch, models, pending, ask, stats):
+        """
+        按模型路由请求记录：先交给第一个（最便宜的）模型，缺失或未通过校验的记录升级到下一个模型；
+        之后按 reconcile_retries 用最后一个模型补发仍然缺失或未通过校验的记录。
+        最终仍未通过校验的记录使用模型最后给出的结果，计入 stats['invalid_rows'] 以便提示核对
+        :param models: 依次使用的模型
+        :param pending: 需要请求的记录键（编号或下标）
+        :param ask: ask(model, keys) 请求这些记录，返回 ({键: 通过校验的结果}, {键: 未通过校验的结果})，请求失败时返回 None
+        :param stats: 累加 escalated_rows、rerequested_rows 和 invalid_rows 的字典
+        :return: tuple (accepted, fallback, pending)：接受的结果、未通过校验但可作为备用的结果、仍然缺失的键
+        """
+        accepted = {}
+        fallback = {}
+        schedule = list(models) + [models[-1]] * self.reconcile_retries
+        for attempt, model in enumerate(schedule):
+            if not pending:
+                break
+            if attempt and attempt < len(models):
+                print(f"Batch {batch.index + 1} {len(pending)} 条记录缺失或未通过校验，升级到 {model}")
+                stats['escalated_rows'] += len(pending)
+                self.model_router.record_escalation(schedule[attempt - 1], model, len(pending))
+            elif attempt:
+                print(f"Batch {batch.index + 1} {len(pending)} 条记录缺失或未通过校验，补发请求")
+                stats['rerequested_rows'] += len(pending)
+            result = ask(model, pending)
+            if result is None:
+                if attempt >= len(models) - 1:
+                    break
+                continue
+            valid, invalid = result
+            self.model_router.record_rows(model, len(pending), len(valid))
+            accepted.update(valid)
+            fallback.update(invalid)
+            pending = [key for key in pending if key not in valid]
+        invalid_keys = [key for key in pending if key in fallback]
+        if invalid_keys:
+            stats['invalid_rows'] += len(invalid_keys)
+            print(f"Batch {batch.index + 1} {len(invalid_keys)} 条记录的类型或分类未通过校验，使用模型最后给出的结果")
+        return accepted, fallback, pending
+
+    @staticmethod
+    def _add_prompt_usage(stats, usage):
+        """累加一次请求的输入 token 和其中命中服务商提示缓存的部分"""
+        prompt_tokens, cached_tokens = prompt_cache_usage(usage)
+        stats['input_tokens'] += prompt_tokens
+        stats['cached_input_tokens'] += cached_tokens
+
+    def _print_token_reduction(self, label, token_stats):
+        """打印分类模式相对完整模式的输出 token 减少比例"""
+        full = token_stats['full_output_tokens']
+        reduction = 1 - token_stats['output_tokens'] / full if full else 0.0
+        print(f"{label} 输出 token: {token_stats['output_tokens']}，"
+              f"完整模式约 {full}，减少 {reduction:.0%}")
 
     def parse_ai_response(self, response_text):
         """
@@ -146,7 +1120,7 @@ class BankStatementController:
         :return: 交易记录的列表，每条记录为包含10个字段的列表
         """
         transactions = []
-        lines = response_text.split("\n")
+        lines = (response_text or "").split("\n")
         for line in lines:
             line = line.strip()
             if not line:
@@ -1,15 +1,40 @@
 # script/main.py
 from views import BankStatementView
 from controllers import BankStatementController
+from utils.model_router import parse_model_routes
 import os
 
 def main():
     # 初始化控制器和视图
     output_dir = os.environ.get("OUTPUT_DIR", "/tmp")
+    pdf_workers = int(os.environ.get("PDF_WORKERS", "1"))
+    pdf_max_rss_mb = os.environ.get("PDF_MAX_RSS_MB")
+    ai_mode = os.environ.get("AI_MODE", "classify")
+    ai_concurrency = int(os.environ.get("AI_CONCURRENCY", "4"))
+    ai_cache_ttl_hours = os.environ.get("AI_CACHE_TTL_HOURS")
+    merchant_memo = os.environ.get("MERCHANT_MEMO", "0") == "1"
+    ai_streaming = os.environ.get("AI_STREAMING", "1") != "0"
+    reconcile_retries = int(os.environ.get("RECONCILE_RETRIES", "1"))
+    ai_rpm = int(os.environ.get("AI_RPM", "500"))
+    ai_tpm = int(os.environ.get("AI_TPM", "30000"))
+    model_routes = parse_model_routes(os.environ.get("AI_ROUTES"))
+    file_concurrency = int(os.environ.get("FILE_CONCURRENCY", "2"))
     controller = BankStatementController(
         output_dir=output_dir,
         model="gpt-4o",
-        temperature=0.3
+        temperature=0.3,
+        pdf_workers=pdf_workers,
+        pdf_max_rss_mb=float(pdf_max_rss_mb) if pdf_max_rss_mb else None,
+        ai_mode=ai_mode,
+        ai_concurrency=ai_concurrency,
+        ai_cache_ttl_hours=float(ai_cache_ttl_hours) if ai_cache_ttl_hours else None,
+        merchant_memo=merchant_memo,
+        ai_streaming=ai_streaming,
+        reconcile_retries=reconcile_retries,
+        ai_requests_per_minute=ai_rpm or None,
+        ai_tokens_per_minute=ai_tpm or None,
+        model_routes=model_routes,
+        file_concurrency=file_concurrency
     )
     
     # 初始化并显示视图
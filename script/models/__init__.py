@@ -0,0 +1,7 @@
+from .transaction import Transaction, parse_cents, format_cents
+
+__all__ = [
+    "Transaction",
+    "parse_cents",
+    "format_cents",
+]
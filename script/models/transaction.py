@@ -0,0 +1,64 @@
+class Transaction:
+    """清理后的一条交易记录
+
+    日期保留账单上的原始写法（如 "01/02"），金额和余额以分为单位的整数保存，
+    raw 保留清理得到的原始文本行，便于回溯和调试。
+    """
+    __slots__ = ('date', 'amount_cents', 'balance_cents', 'description', 'account', 'raw')
+
+    def __init__(self, date, amount_cents, description, account=None, balance_cents=None, raw=None):
+        """
+        :param date: 账单上的交易日期文本
+        :param amount_cents: 交易金额（分），支出为负数
+        :param description: 交易描述
+        :param account: 账户标签，如 "Chase Checking Account(1234)"
+        :param balance_cents: 交易后余额（分），账单没有余额列时为 None
+        :param raw: 清理得到的原始文本行
+        """
+        self.date = date
+        self.amount_cents = amount_cents
+        self.balance_cents = balance_cents
+        self.description = description
+        self.account = account
+        self.raw = raw
+
+    @property
+    def amount(self):
+        """交易金额（元）"""
+        return self.amount_cents / 100
+
+    def append_description(self, text):
+        """把跨行的描述补充到当前记录"""
+        self.description = f"{self.description} {text}" if self.description else text
+        self.raw = f"{self.raw} {text}" if self.raw else text
+
+    def to_compact(self):
+        """序列化为紧凑的单行文本：日期|金额|描述[|余额]"""
+        fields = [self.date or "", format_cents(self.amount_cents), self.description]
+        if self.balance_cents is not None:
+            fields.append(format_cents(self.balance_cents))
+        return "|".join(fields)
+
+    def __str__(self):
+        return self.raw if self.raw is not None else self.to_compact()
+
+    def __repr__(self):
+        return f"Transaction({self.to_compact()!r}, account={self.account!r})"
+
+
+def parse_cents(text):
+    """
+    把金额文本转换为以分为单位的整数
+    例如 "-$1,234.56" -> -123456，"+500.00" -> 50000，".50" -> 50
+    """
+    text = text.replace('$', '').replace(',', '').strip()
+    sign = -1 if text.startswith('-') else 1
+    whole, _, fraction = text.lstrip('+-').partition('.')
+    return sign * (int(whole or 0) * 100 + int((fraction + "00")[:2]))
+
+
+def format_cents(cents):
+    """把以分为单位的整数格式化为两位小数的金额文本"""
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
@@ -1,7 +1,11 @@
 from .batch_processor import process_batches, get_batch_status
 from .ai_processor import AIProcessor
+from .bank_detector import detect_bank, register_bank_detector
 from .pdf_processor import (
     extract_text_from_pdf,
+    iter_pdf_pages,
+    iter_pdf_lines,
+    benchmark_pdf_backends,
     clean_bank_statement_text,
     clean_chase_creditcard_statement
 )
@@ -10,8 +14,13 @@ __all__ = [
     "process_batches",
     "get_batch_status",
     "extract_text_from_pdf",
+    "iter_pdf_pages",
+    "iter_pdf_lines",
+    "benchmark_pdf_backends",
     "clean_bank_statement_text",
     "clean_chase_creditcard_statement",
+    "detect_bank",
+    "register_bank_detector",
     "process_with_claude_api",
     "process_with_gpt4omini_api",
     "process_with_gpt4o_api",
@@ -1,21 +1,166 @@
 from openai import OpenAI
 import json
 import os
+import threading
+import time
 import streamlit as st
+from .token_utils import estimate_tokens
+from .model_backends import get_model_backend
+from .request_scheduler import get_request_scheduler
+from .batch_jobs import (
+    BatchJob,
+    BATCH_ENDPOINT,
+    BATCH_COMPLETION_WINDOW,
+    BATCH_TERMINAL_STATUSES,
+    DEFAULT_BATCH_POLL_SECONDS,
+    DEFAULT_BATCH_TIMEOUT_SECONDS,
+    build_batch_jsonl,
+    parse_batch_output,
+    wait_for_batch_job
+)
+
+# 支出和收入的一级分类选项
+EXPENSE_CATEGORIES = ["水电", "银行服务", "转账", "提现", "出行", "家居", "付款", "住宿", "珠宝", "外汇", "银行转账", "汇款费", "ATM 取款", "其他", "押金", "电汇费", "现金支取", "日用品", "杂货", "手机支付", "杂项", "P2P", "零售", "软件服务", "电子支付", "房贷", "财务费用", "转账支出", "餐饮", "购物", "服饰", "日用", "数码", "美妆", "护肤", "应用软件", "住房", "交通", "娱乐", "医疗", "通讯", "汽车", "学习", "办公", "运动", "社交", "人情", "育儿", "宠物", "旅行", "度假", "烟酒", "彩票", "健康", "费用", "现金", "际汇款手续费", "国内汇款手续费", "电汇手续费", "账单支付", "账单"]
+INCOME_CATEGORIES = ["工资", "奖金", "加班", "福利", "公积金", "红包", "兼职", "副业", "退税", "投资", "意外收入", "其他", "收入", "餐饮", "现金", "汇款", "利息", "转账", "退款", "银行转账", "利息收入", "汇款收入", "ATM 存款", "购物退款", "支付"]
+EXPENSE_OPTIONS = json.dumps(EXPENSE_CATEGORIES, ensure_ascii=False)
+INCOME_OPTIONS = json.dumps(INCOME_CATEGORIES, ensure_ascii=False)
+
+# 提示词模板版本，修改下面的固定提示词时递增
+PROMPT_VERSION = 2
+
+# 提示词按 "固定说明在前、批次数据在后" 排列：所有请求共享同一段很长的固定前缀，
+# 服务商的提示缓存可以命中这段前缀；文件名和交易文本只出现在最后的用户消息中
+FULL_SYSTEM_PROMPT = f"""你是一个专业的银行账单分析助手。你的任务是：
+1. 准确识别和提取银行账单中的交易记录
+2. 正确分类每笔交易（收入/支出）
+3. 理解交易描述并进行合适的分类
+4. 确保金额和日期的准确性
+5. 遵循指定的输出格式
+请保持专业、准确，并确保不遗漏任何交易记录。
+
+用户消息第一行给出账单文件名，之后是账单文本。请仔细分析账单文本，提取所有交易记录并按照指定格式输出。
+
+重要说明：
+1. 请从文件名中提取年份信息。
+2. 所有交易记录必须使用该年份，不要使用其他年份。
+3. 必须处理所有交易记录，绝对不能遗漏任何一条！
+4. 如果内容太长，请确保处理完所有内容再返回！
+5. 交易记录中即使内容相似，也必须逐条完整保留，不能合并或省略。每条记录可通过余额变化等细节进行区分。
+
+账单文本格式：每个账户以 "=== 账户 ===" 开头，之后每行一条交易，字段为 日期|金额|描述|余额，没有余额列时省略余额。
+
+输出要求：
+1. 格式：日期 | 类型 | 金额 | 一级分类 | 二级分类 | 账户1 | 账户2 | 备注 | 货币 | 标签
+2. 每行一条交易记录
+3. 所有字段用竖线符"|"分隔
+4. 无内容的栏目保持留空
+4. 保留Description字段到备注列中
+5. 从上下文与交易记录的备注中获取对应的银行账户后四位
+6. 不要遗漏任何一条交易信息
+
+处理规则：
+1. 账户信息：
+- 在账户1和账户2字段中包含账户最后四位数字，用括号括起。
+- 账户格式示例：Chase Checking(1234)。
+
+2. 金额处理：
+- ***保持原始金额的正负值。不要作任何修改***
+- 金额必须包含小数点和两位小数。
+
+3. 日期格式：
+- 必须使用从文件名中提取的年份。
+- 格式：YYYY-MM-DD。
+- 示例：如果文件名中年份是2022，则日期应为2022-01-15。
+
+4. 注意！！！分类规则：
+- 类型栏可填入[转账, 收入, 支出]，金额为负值标记为支出，金额为正，或"+"标记为收入。***转账则标记为转账。***。
+- ***若类型栏为转账，则一级分类与二级分类留空。金额为正时当前账户信息填入[账户2]栏中，金额为负时当前账户信息填入[账户1]栏中***
+- 若类型栏为"支出"，一级分类交易类型选项为 {EXPENSE_OPTIONS}
+- 若为网络订阅内容，则标注为：订阅，二级分类填入具体公司名称
+- 若类型栏为"收入"，一级分类交易类型选项为 {INCOME_OPTIONS}
+- 根据交易描述推断一级分类，二级分类可留空。
+- 还款统一标记为信用卡还款。
+- 特别注意Zelle的支出，请将其标注为支出，勿将其视为转账或将Zelle填入账户1或账户2。
+
+5. 交易独立性处理：
+- 即使交易内容相似，必须完整保留每条记录。
+- 可通过余额变化（最后一列数字）来识别和区分每条交易的独立性。
+- 不要省略任何记录，即使内容重复。
+
+6. 其他要求：
+- 根据对账单银行标注货币：若为CHASE/BOFA/AMEX等美国的银行，标注为USD；若为中国的银行，则标注为CNY。
+- 根据交易描述推断标签。
+
+重要提醒：
+- 必须处理所有交易记录，绝对不能遗漏！
+- 如果内容太长，请确保处理完所有内容再返回！
+- 所有日期必须使用从文件名中提取的年份！"""
+
+CLASSIFY_SYSTEM_PROMPT = f"""你是一个专业的银行账单分类助手。你的任务是根据交易描述和金额判断交易类型和分类，
+只输出要求的字段，不要输出任何解释。
+
+用户消息中是银行账单中的交易记录。每个账户以 "=== 账户 ===" 开头，之后每行一条交易，字段为 编号|日期|金额|描述。
+
+输出要求：
+1. 每条交易输出一行，格式：编号|类型|一级分类|二级分类|标签
+2. 编号与输入一致，必须覆盖所有编号，不要合并或省略
+3. 无内容的栏目保持留空，不要输出表头或其他内容
+
+分类规则：
+- 类型栏可填入[转账, 收入, 支出]，金额为负值标记为支出，金额为正标记为收入。***转账则标记为转账，一级分类与二级分类留空***
+- 若类型为"支出"，一级分类选项为 {EXPENSE_OPTIONS}
+- 若为网络订阅内容，则一级分类标注为：订阅，二级分类填入具体公司名称
+- 若类型为"收入"，一级分类选项为 {INCOME_OPTIONS}
+- 根据交易描述推断一级分类，二级分类可留空。
+- 还款统一标记为信用卡还款。
+- 特别注意Zelle的支出，请将其标注为支出，勿将其视为转账。
+- 根据交易描述推断标签。"""
+
+def prompt_cache_usage(usage):
+    """
+    从 API 返回的 token 用量中读取输入 token 数和其中命中提示缓存的 token 数
+    :return: tuple (prompt_tokens, cached_tokens)，没有用量信息时为 (0, 0)
+    """
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return prompt_tokens, getattr(details, 'cached_tokens', None) or 0
+
 
 class AIProcessor:
     """
     AI处理器，负责调用不同的AI模型处理文本
-    支持的模型：GPT-4o-mini, GPT-4o, DeepSeek, Claude-3
+    模型通过 model_backends 中注册的 OpenAI 兼容后端调用：GPT-4o, GPT-4o-mini, DeepSeek, 本地替身服务器
     """
-    def __init__(self):
+    def __init__(self, response_cache=None, scheduler=None, client_pool=None, router=None):
         """
         初始化AI处理器
         :param config_path: 配置文件路径
+        :param response_cache: 可选的 LLMResponseCache，相同模型、温度和提示词的请求直接返回缓存的响应
+        :param scheduler: 可选的 RequestScheduler，负责限流、重试和熔断
+        :param client_pool: 可选的 ClientPool，从进程内共享的池中获取客户端以复用连接
+        :param router: 可选的 ModelRouter，记录每个模型的调用延迟和 token 用量
         """
         #self.config = self._load_config(config_path)
+        self.scheduler = scheduler
+        self.client_pool = client_pool
+        self.router = router
+        # 页面输入的 API key 在创建时（页面脚本线程中）读取：提取和模型调用的工作线程没有
+        # ScriptRunContext，在那里读取 st.session_state 得到的是空的替身，读不到 key
+        self.session_api_key = getattr(st.session_state, 'api_key', None)
         self.clients = self._initialize_clients()
+        self.response_cache = response_cache
+        # 最近一次请求的 token 用量按线程保存，并发处理批次时互不覆盖
+        self._local = threading.local()
         
+    @property
+    def last_usage(self):
+        """当前线程最近一次请求的 token 用量"""
+        return getattr(self._local, 'usage', None)
+
+    @last_usage.setter
+    def last_usage(self, usage):
+        self._local.usage = usage
+
     def _load_config(self, config_path):
         """加载配置文件"""
         if not os.path.exists(config_path):
@@ -28,17 +173,13 @@ class AIProcessor:
         clients = {}
         try:
             # OpenAI客户端
-            if hasattr(st.session_state, 'api_key') and st.session_state.api_key:
-                clients['openai'] = OpenAI(api_key=st.session_state.api_key)
+            if self.session_api_key:
+                clients['openai'] = self._create_client(get_model_backend("gpt-4o"), self.session_api_key)
             else:
                 print("Warning: OpenAI API key not found in session state")
             
             #clients['openai'] = OpenAI(api_key=self.config['openai_api_key'])
-            # DeepSeek客户端
-            # clients['deepseek'] = OpenAI(
-            #     api_key=self.config['deepseek_api_key'],
-            #     base_url="https://api.deepseek.com"
-            # )
+            # 其他 OpenAI 兼容的后端（DeepSeek、本地服务器等）在第一次使用时创建，见 _client_for
             # # Anthropic客户端
             # if 'anthropic_api_key' in self.config:
             #     clients['anthropic'] = anthropic.Anthropic(
@@ -50,6 +191,42 @@ class AIProcessor:
 
         return clients
 
+    def _create_client(self, backend, api_key):
+        """创建后端的客户端，设置了客户端池时从池中获取"""
+        # 使用调度器时由调度器负责重试，关闭 SDK 自带的重试
+        options = {'max_retries': 0} if self.scheduler else {}
+        if self.client_pool is not None:
+            return self.client_pool.get(api_key, backend.name, backend.base_url, **options)
+        return OpenAI(api_key=api_key, base_url=backend.base_url, **options)
+
+    def api_key_for(self, backend):
+        """
+        返回后端使用的 API key：后端注册的 key、环境变量，最后是创建时读取的页面输入的 key；都没有时返回 None
+        可以在工作线程中调用
+        """
+        return (
+            backend.api_key
+            or (backend.api_key_env and os.environ.get(backend.api_key_env))
+            or self.session_api_key
+        )
+
+    def _client_for(self, backend):
+        """返回后端的客户端，第一次使用时创建"""
+        client = self.clients.get(backend.name)
+        if client is None:
+            api_key = self.api_key_for(backend)
+            if not api_key:
+                raise ValueError(f"{backend.name} API key not configured")
+            client = self._create_client(backend, api_key)
+            self.clients[backend.name] = client
+        return client
+
+    def scheduler_for(self, backend):
+        """返回后端的请求调度器：OpenAI 使用控制器配置的限额，其他后端使用各自注册的限额"""
+        if self.scheduler is None or backend.name == self.scheduler.provider:
+            return self.scheduler
+        return get_request_scheduler(backend.name, backend.requests_per_minute, backend.tokens_per_minute)
+
     # def count_tokens(self, text):
     #     """计算文本的token数量"""
     #     try:
@@ -59,149 +236,295 @@ class AIProcessor:
     #         print(f"Error counting tokens: {e}")
     #         return 0
 
-    def process_text(self,file_name, clean_lines, model="gpt-4o", temperature=0.3):
+    def process_text(self,file_name, clean_lines, model="gpt-4o", temperature=0.3, on_line=None):
         """
         处理文本，根据指定的模型调用相应的API
         :param text: 要处理的文本
         :param model: 使用的模型名称
         :param temperature: 温度参数
+        :param on_line: 可选回调，以流式方式接收响应，每收到一整行调用一次
         :return: 处理结果
         """
-        system_prompt = """你是一个专业的银行账单分析助手。你的任务是：
-            1. 准确识别和提取银行账单中的交易记录
-            2. 正确分类每笔交易（收入/支出）
-            3. 理解交易描述并进行合适的分类
-            4. 确保金额和日期的准确性
-            5. 遵循指定的输出格式
-            请保持专业、准确，并确保不遗漏任何交易记录。"""
-
-        user_prompt = f"""
-        请仔细分析以下银行账单文本，提取所有交易记录并按照指定格式输出。
-
-        重要说明：
-        1. 请从文件名 "{file_name}" 中提取年份信息。
-        2. 所有交易记录必须使用该年份，不要使用其他年份。
-        3. 必须处理所有交易记录，绝对不能遗漏任何一条！
-        4. 如果内容太长，请确保处理完所有内容再返回！
-        5. 交易记录中即使内容相似，也必须逐条完整保留，不能合并或省略。每条记录可通过余额变化等细节进行区分。
-
-
-        文本内容：
-        {clean_lines}
-
-        输出要求：
-        1. 格式：日期 | 类型 | 金额 | 一级分类 | 二级分类 | 账户1 | 账户2 | 备注 | 货币 | 标签
-        2. 每行一条交易记录
-        3. 所有字段用竖线符"|"分隔
-        4. 无内容的栏目保持留空
-        4. 保留Description字段到备注列中
-        5. 从上下文与交易记录的备注中获取对应的银行账户后四位
-        6. 不要遗漏任何一条交易信息
-
-        处理规则：
-        1. 账户信息：
-        - 在账户1和账户2字段中包含账户最后四位数字，用括号括起。
-        - 账户格式示例：Chase Checking(1234)。
-        
-        2. 金额处理：
-        - ***保持原始金额的正负值。不要作任何修改***
-        - 金额必须包含小数点和两位小数。
-        
-        3. 日期格式：
-        - 必须使用从文件名中提取的年份。
-        - 格式：YYYY-MM-DD。
-        - 示例：如果文件名中年份是2022，则日期应为2022-01-15。
-        
-        4. 注意！！！分类规则：
-        - 类型栏可填入[转账, 收入, 支出]，金额为负值标记为支出，金额为正，或"+"标记为收入。***转账则标记为转账。***。
-        - ***若类型栏为转账，则一级分类与二级分类留空。金额为正时当前账户信息填入[账户2]栏中，金额为负时当前账户信息填入[账户1]栏中***
-        - 若类型栏为"支出"，一级分类交易类型选项为 ["水电", "银行服务", "转账", "提现", "出行", "家居", "付款", "住宿", "珠宝", "外汇", "银行转账", "汇款费", "ATM 取款", "其他", "押金", "电汇费", "现金支取", "日用品", "杂货", "手机支付", "杂项", "P2P", "零售", "软件服务", "电子支付", "房贷", "财务费用", "转账支出", "餐饮", "购物", "服饰", "日用", "数码", "美妆", "护肤", "应用软件", "住房", "交通", "娱乐", "医疗", "通讯", "汽车", "学习", "办公", "运动", "社交", "人情", "育儿", "宠物", "旅行", "度假", "烟酒", "彩票", "健康", "费用", "现金", "际汇款手续费", "国内汇款手续费", "电汇手续费", "账单支付", "账单"]
-        - 若为网络订阅内容，则标注为：订阅，二级分类填入具体公司名称
-        - 若类型栏为"收入"，一级分类交易类型选项为 ["工资", "奖金", "加班", "福利", "公积金", "红包", "兼职", "副业", "退税", "投资", "意外收入", "其他", "收入", "餐饮", "现金", "汇款", "利息", "转账", "退款", "银行转账", "利息收入", "汇款收入", "ATM 存款", "购物退款", "支付"] 
-        - 根据交易描述推断一级分类，二级分类可留空。
-        - 还款统一标记为信用卡还款。
-        - 特别注意Zelle的支出，请将其标注为支出，勿将其视为转账或将Zelle填入账户1或账户2。
-        
-        5. 交易独立性处理：
-        - 即使交易内容相似，必须完整保留每条记录。
-        - 可通过余额变化（最后一列数字）来识别和区分每条交易的独立性。
-        - 不要省略任何记录，即使内容重复。
-        
-        6. 其他要求：
-        - 根据对账单银行标注货币：若为CHASE/BOFA/AMEX等美国的银行，标注为USD；若为中国的银行，则标注为CNY。
-        - 根据交易描述推断标签。
-
-        重要提醒：
-        - 必须处理所有交易记录，绝对不能遗漏！
-        - 如果内容太长，请确保处理完所有内容再返回！
-        - 所有日期必须使用从文件名中提取的年份！
+        system_prompt, user_prompt = self.full_prompts(file_name, clean_lines)
+        return self._complete(system_prompt, user_prompt, model, temperature, on_line)
+
+    def classify_text(self, clean_lines, model="gpt-4o", temperature=0.3, on_line=None):
+        """
+        分类模式：模型只返回每条交易的类型、分类和标签，
+        日期、金额、账户和货币由本地根据解析结果组装
+        :param clean_lines: 每行 "编号|日期|金额|描述" 的批次文本
+        :param model: 使用的模型名称
+        :param temperature: 温度参数
+        :param on_line: 可选回调，以流式方式接收响应，每收到一整行调用一次
+        :return: 每行 "编号|类型|一级分类|二级分类|标签" 的文本
         """
+        system_prompt, user_prompt = self.classify_prompts(clean_lines)
+        return self._complete(system_prompt, user_prompt, model, temperature, on_line)
+
+    @staticmethod
+    def full_prompts(file_name, clean_lines):
+        """完整模式的提示词：返回 (系统提示词, 用户消息)，逐个请求和批量任务使用同样的提示词"""
+        user_prompt = f"""文件名：{file_name}
+
+账单文本：
+{clean_lines}"""
+        return FULL_SYSTEM_PROMPT, user_prompt
+
+    @staticmethod
+    def classify_prompts(clean_lines):
+        """分类模式的提示词：返回 (系统提示词, 用户消息)"""
+        user_prompt = f"""交易记录：
+{clean_lines}"""
+        return CLASSIFY_SYSTEM_PROMPT, user_prompt
 
+    def _complete(self, system_prompt, user_prompt, model, temperature, on_line=None):
+        """根据模型名称调用相应的API，启用响应缓存时先查缓存，成功的响应写入缓存"""
+        if self.response_cache is None:
+            return self._call_model(system_prompt, user_prompt, model, temperature, on_line)
+
+        cache_key = self.response_cache.make_key(model.lower(), temperature, system_prompt, user_prompt)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            print(f"命中AI响应缓存 ({model})")
+            self.last_usage = None
+            if on_line:
+                for line in cached.split("\n"):
+                    if line.strip():
+                        on_line(line)
+            return cached
+        content = self._call_model(system_prompt, user_prompt, model, temperature, on_line)
+        if content:
+            try:
+                self.response_cache.put(cache_key, content, model=model.lower())
+            except OSError as e:
+                print(f"写入AI响应缓存失败: {e}")
+        return content
+
+    def _call_model(self, system_prompt, user_prompt, model, temperature, on_line=None):
+        """根据模型名称查找后端并调用相应的API"""
+        started = time.perf_counter()
+        content = None
+        self.last_usage = None
         try:
-            # if model.lower() == "gpt-4o-mini":
-            #     return self._process_with_gpt4omini(system_prompt, user_prompt, temperature)
-            if model.lower() == "gpt-4o":
-                return self._process_with_gpt4o(system_prompt, user_prompt, temperature)
-            # elif model.lower() == "deepseek-v3":
-            #     return self._process_with_deepseek(system_prompt, user_prompt, temperature)
-            # elif model.lower() == "claude-3":
-            #     return self._process_with_claude()
-            else:
-                raise ValueError(f"Unsupported model: {model}")
+            backend = get_model_backend(model)
+            content = self._process_with_backend(backend, system_prompt, user_prompt, temperature, on_line)
         except Exception as e:
             print(f"Error processing text with {model}: {e}")
-            return None
+        if self.router is not None:
+            self.router.record_call(model, time.perf_counter() - started, self.last_usage, content is not None)
+        return content
 
-    # def _process_with_gpt4omini(self, system_prompt, user_prompt, temperature):
-    #     """使用GPT-4o-mini处理文本"""
-    #     print(f"使用GPT-4o-mini处理文本")
-    #     try:
-    #         response = self.clients['openai'].chat.completions.create(
-    #             messages=[
-    #                 {"role": "system", "content": system_prompt},
-    #                 {"role": "user", "content": user_prompt}
-    #             ],
-    #             model="gpt-4o-mini",
-    #             temperature=temperature
-    #         )
-    #         return response.choices[0].message.content.strip()
-    #     except Exception as e:
-    #         print(f"Error with GPT-4o-mini: {e}")
-    #         return None
+    def _process_with_backend(self, backend, system_prompt, user_prompt, temperature, on_line=None):
+        """使用 OpenAI 兼容后端处理文本，提供 on_line 时以流式方式接收响应；设置了调度器时经调度器限流和重试
 
-    def _process_with_gpt4o(self, system_prompt, user_prompt, temperature):
-        """使用GPT-4o处理文本"""
-        print(f"使用GPT-4o处理文本")
-        try:
-            response = self.clients['openai'].chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                model="gpt-4o",
+        调度器重试时会重新流式接收整个响应，失败前已交给 on_line 的行会再次出现，调用方需要按记录去重
+        """
+        print(f"使用{backend.model}处理文本 ({backend.name})")
+        client = self._client_for(backend)
+        scheduler = self.scheduler_for(backend)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+        def request():
+            if on_line is not None:
+                stream = client.chat.completions.create(
+                    messages=messages,
+                    model=backend.model,
+                    temperature=temperature,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                return self._consume_stream(stream, on_line)
+            response = client.chat.completions.create(
+                messages=messages,
+                model=backend.model,
                 temperature=temperature
             )
+            self.last_usage = getattr(response, 'usage', None)
             return response.choices[0].message.content.strip()
+
+        self.last_usage = None
+        try:
+            if scheduler is None:
+                content = request()
+                self._print_prompt_cache_usage()
+                return content
+            # 按输入 token 预约限额，完成后按实际总用量修正
+            estimated_tokens = estimate_tokens(system_prompt + user_prompt, backend.model)
+            content = scheduler.run(request, estimated_tokens)
+            scheduler.record_usage(estimated_tokens, getattr(self.last_usage, 'total_tokens', None))
+            self._print_prompt_cache_usage()
+            return content
         except Exception as e:
-            print(f"Error with GPT-4o: {e}")
+            print(f"Error with {backend.model}: {e}")
             return None
 
-    # def _process_with_deepseek(self, system_prompt, user_prompt, temperature):
-    #     """使用DeepSeek处理文本"""
-    #     print(f"使用DeepSeek-V3处理文本")
-    #     try:
-    #         response = self.clients['deepseek'].chat.completions.create(
-    #             model="deepseek-chat",
-    #             messages=[
-    #                 {"role": "system", "content": system_prompt},
-    #                 {"role": "user", "content": user_prompt}
-    #             ],
-    #             temperature=temperature
-    #         )
-    #         return response.choices[0].message.content.strip()
-    #     except Exception as e:
-    #         print(f"Error with DeepSeek: {e}")
-    #         return None
+    def submit_batch_job(self, prompts, model="gpt-4o", temperature=0.3):
+        """
+        把多个请求编成一个 JSONL 文件，上传后以批量任务提交（不等待完成）
+        启用响应缓存时，命中缓存的请求不再提交
+        :param prompts: {custom_id: (系统提示词, 用户消息)}
+        :param model: 模型别名，一个批量任务只能使用一个模型
+        :return: BatchJob，交给 collect_batch_job 等待结果
+        :raises Exception: 上传或创建任务失败
+        """
+        job = BatchJob(model, temperature, prompts)
+        pending = dict(prompts)
+        if self.response_cache is not None:
+            for custom_id, (system_prompt, user_prompt) in prompts.items():
+                cached = self.response_cache.get(
+                    self.response_cache.make_key(model.lower(), temperature, system_prompt, user_prompt)
+                )
+                if cached is not None:
+                    job.results[custom_id] = (cached, None)
+                    del pending[custom_id]
+            if job.results:
+                print(f"批量任务命中AI响应缓存 {len(job.results)} 条请求")
+        if not pending:
+            job.status = "completed"
+            return job
+
+        backend = get_model_backend(model)
+        client = self._client_for(backend)
+        scheduler = self.scheduler_for(backend)
+        data = build_batch_jsonl(backend.model, temperature, pending)
+        input_file = self._run_request(scheduler, lambda: client.files.create(
+            file=("icost-batch.jsonl", data),
+            purpose="batch"
+        ))
+        created = self._run_request(scheduler, lambda: client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata={"prompt_version": str(PROMPT_VERSION)}
+        ))
+        job.job_id = created.id
+        job.status = created.status
+        job.submitted_at = time.time()
+        print(f"已提交批量任务 {job.job_id} ({backend.model})：{len(pending)} 条请求，输入文件 {len(data) / 1024:.0f} KB")
+        return job
+
+    def collect_batch_job(self, job, poll_seconds=DEFAULT_BATCH_POLL_SECONDS,
+                          timeout_seconds=DEFAULT_BATCH_TIMEOUT_SECONDS, on_status=None, cancel_on_timeout=True):
+        """
+        轮询批量任务直到完成，下载结果并写入响应缓存
+        失败或缺失的请求不出现在结果中，由调用方逐个补发
+        :param job: submit_batch_job 返回的 BatchJob
+        :param timeout_seconds: 本次最多等待的秒数，None 表示一直等到任务结束
+        :param on_status: 可选回调 (BatchJob)，每次轮询后调用
+        :param cancel_on_timeout: 超时后是否取消任务；不取消时任务继续运行，之后可以再次调用本方法获取结果
+        :return: {custom_id: (响应文本, token 用量)}；超时且不取消任务时返回 None
+        """
+        results = dict(job.results)
+        if job.job_id is None:
+            return results
+        backend = get_model_backend(job.model)
+        client = self._client_for(backend)
+        scheduler = self.scheduler_for(backend)
+
+        def retrieve(job_id):
+            return self._run_request(scheduler, lambda: client.batches.retrieve(job_id))
+
+        def report(state):
+            job.status = state.status
+            job.request_counts = state.request_counts
+            counts = state.request_counts
+            progress = f"，完成 {counts.completed}/{counts.total}，失败 {counts.failed}" if counts else ""
+            print(f"批量任务 {job.job_id} 状态 {state.status}{progress}")
+            if on_status:
+                on_status(job)
+
+        state = wait_for_batch_job(retrieve, job.job_id, poll_seconds, timeout_seconds, report)
+        if state.status not in BATCH_TERMINAL_STATUSES:
+            if not cancel_on_timeout:
+                print(f"批量任务 {job.job_id} 等待超时，任务仍在运行，稍后继续获取结果")
+                return None
+            print(f"批量任务 {job.job_id} 等待超时，取消任务")
+            try:
+                self._run_request(scheduler, lambda: client.batches.cancel(job.job_id))
+            except Exception as e:
+                print(f"取消批量任务 {job.job_id} 失败: {e}")
+            return results
+
+        completions, errors = {}, {}
+        for file_id in (state.output_file_id, state.error_file_id):
+            if file_id:
+                text = self._run_request(scheduler, lambda: client.files.content(file_id).text)
+                file_completions, file_errors = parse_batch_output(text)
+                completions.update(file_completions)
+                errors.update(file_errors)
+        # 批量任务中每个请求的延迟就是整个任务的耗时
+        seconds = time.time() - job.submitted_at
+        for custom_id, completion in completions.items():
+            content = completion.choices[0].message.content if completion.choices else None
+            if custom_id not in job.prompts or not content:
+                continue
+            content = content.strip()
+            results[custom_id] = (content, completion.usage)
+            if self.router is not None:
+                self.router.record_call(job.model, seconds, completion.usage, True)
+            if self.response_cache is not None:
+                system_prompt, user_prompt = job.prompts[custom_id]
+                try:
+                    self.response_cache.put(
+                        self.response_cache.make_key(job.model.lower(), job.temperature, system_prompt, user_prompt),
+                        content,
+                        model=job.model.lower()
+                    )
+                except OSError as e:
+                    print(f"写入AI响应缓存失败: {e}")
+        failed = [custom_id for custom_id in job.prompts if custom_id not in results]
+        if self.router is not None:
+            for _ in failed:
+                self.router.record_call(job.model, seconds, None, False)
+        print(f"批量任务 {job.job_id} {state.status}：返回 {len(results)} 条结果，失败或缺失 {len(failed)} 条，"
+              f"耗时 {seconds:.1f} 秒")
+        if errors:
+            print(f"批量任务 {job.job_id} 的错误: {dict(list(errors.items())[:5])}")
+        return results
+
+    @staticmethod
+    def _run_request(scheduler, request):
+        """执行一次非对话类的 API 调用（上传文件、查询任务），设置了调度器时经调度器重试"""
+        if scheduler is None:
+            return request()
+        return scheduler.run(request)
+
+    def _print_prompt_cache_usage(self):
+        """打印最近一次请求的输入 token 中命中服务商提示缓存的部分"""
+        prompt_tokens, cached_tokens = prompt_cache_usage(self.last_usage)
+        if prompt_tokens:
+            print(f"输入 token {prompt_tokens}，命中提示缓存 {cached_tokens} "
+                  f"({cached_tokens / prompt_tokens:.0%}，提示词版本 {PROMPT_VERSION})")
+
+    def _consume_stream(self, stream, on_line):
+        """
+        消费流式响应：每收到一个换行就把完整的一行交给 on_line，结束后记录 token 用量
+        :return: 完整的响应文本
+        """
+        parts = []
+        pending = ""
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            pending += delta
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                if line.strip():
+                    on_line(line)
+        if pending.strip():
+            on_line(pending)
+        self.last_usage = usage
+        return "".join(parts).strip()
 
     # def _process_with_claude(self,system_prompt, user_prompt):
     #     """使用Claude-3处理文本"""
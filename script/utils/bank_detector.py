@@ -0,0 +1,78 @@
+# 识别银行类型时只查看账单开头的文本（银行名称、网址和账户摘要都在首页），
+# 检测耗时与账单长度无关
+DETECTION_WINDOW_CHARS = 16 * 1024
+
+# 只匹配到银行关键词、或同时匹配到账户类型关键词时的置信度
+BANK_MATCH_CONFIDENCE = 0.6
+ACCOUNT_MATCH_CONFIDENCE = 0.9
+
+_detectors = []
+
+
+def register_bank_detector(bank_type):
+    """
+    注册银行检测器的装饰器，新增银行只需注册检测器，不需要修改识别流程。
+    检测器接收账单开头窗口内已转为大写的文本，返回 (账户类型, 置信度) 或 None；
+    注册顺序决定置信度相同时的优先级
+    :param bank_type: 检测器识别的银行类型，如 "CHASE"
+    """
+    def decorator(detector):
+        _detectors.append((bank_type, detector))
+        return detector
+    return decorator
+
+
+def detect_bank(text, window=DETECTION_WINDOW_CHARS):
+    """
+    识别账单的银行和账户类型
+    :param text: 账单文本（只使用开头 window 个字符）
+    :param window: 检测窗口大小
+    :return: tuple (bank_type, account_type, confidence)，无法识别时为 ("UNKNOWN", "UNKNOWN", 0.0)
+    """
+    head = text[:window].upper()
+    best = ("UNKNOWN", "UNKNOWN", 0.0)
+    for bank_type, detector in _detectors:
+        result = detector(head)
+        if result and result[1] > best[2]:
+            best = (bank_type, result[0], result[1])
+    return best
+
+
+def _match_account(head, bank_keyword, account_keywords):
+    """通用检测逻辑：银行关键词命中后，按顺序匹配第一个账户类型关键词"""
+    if bank_keyword not in head:
+        return None
+    for keyword, account_type in account_keywords:
+        if keyword in head:
+            return account_type, ACCOUNT_MATCH_CONFIDENCE
+    return "UNKNOWN", BANK_MATCH_CONFIDENCE
+
+
+@register_bank_detector("BOFA")
+def detect_bofa(head):
+    """Bank of America"""
+    return _match_account(head, "BANK OF AMERICA", (
+        ("SAVINGS", "SAVINGS"),
+        ("CHECKING", "CHECKING"),
+        ("CREDIT CARD", "CREDITCARD"),
+    ))
+
+
+@register_bank_detector("CHASE")
+def detect_chase(head):
+    """Chase"""
+    return _match_account(head, "CHASE.COM", (
+        ("CREDIT CARD", "CREDITCARD"),
+        ("CHASE SAVINGS", "SAVINGS"),
+        ("CHASE TOTAL CHECKING", "CHECKING"),
+    ))
+
+
+@register_bank_detector("AMEX")
+def detect_amex(head):
+    """American Express"""
+    return _match_account(head, "AMERICAN EXPRESS", (
+        ("CREDIT CARD", "CREDITCARD"),
+        ("SAVINGS", "SAVINGS"),
+        ("CHECKING", "CHECKING"),
+    ))
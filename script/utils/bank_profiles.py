@@ -0,0 +1,473 @@
+import re
+from models.transaction import Transaction, parse_cents
+
+# 清理配置：每家银行/账户类型用一份声明式配置描述账单结构，由 compile_profile 编译为
+# StatementCleaner。逐行处理的顺序固定为：
+#   账户规则 -> skip_markers -> stop_markers -> start_markers -> end_markers -> 交易明细
+# 配置字段：
+#   case_sensitive:       关键词是否区分大小写（否则与大写后的行比较）
+#   account_rules:        账户规则组列表，每组内按顺序只应用第一个命中的规则（if/elif）
+#       marker:               触发关键词
+#       var:                  保存账户号的变量名
+#       capture:              提取账户号的正则；capture_mode 为 "findall"（取最后一个）或 "search"（取分组 1）
+#       emit:                 账户标题的输出方式："always" 总是输出，"captured" 本行提取到账户号时输出，
+#                             "var" 变量有值时输出 header，否则输出 header_without_value
+#       header:               账户标签模板，{value} 为账户号；之后的交易记录都归属该账户
+#       once:                 只输出一次标题
+#       consume:              命中后不再处理本行
+#       log:                  命中时打印的日志模板
+#   skip_markers:         任何状态下都跳过的行
+#   stop_markers:         遇到后停止清理（账单正文结束）
+#   start_markers:        进入交易明细段落
+#   end_markers:          离开交易明细段落并结束当前交易
+#   detail_stop_markers:  交易明细段落内遇到后停止清理
+#   detail_skip_markers:  交易明细段落内跳过的行
+#   transforms:           交易明细段落内的文本替换 {marker, pattern, replace}
+#   date_pattern / amount_pattern: 新交易行必须同时匹配的日期和金额
+#   invert_amount:        把金额取相反数（信用卡账单的消费为正数）
+#   row_rewrite:          新交易行的改写函数
+#   balance_column:       金额之后的下一个金额是交易后余额
+#   continuation_min_words: 非交易行至少有多少个单词时作为描述补充，None 表示不拼接
+#   flush_unmatched:      非交易、非补充的行是否结束当前交易
+#   summary:              清理完成后打印的统计模板
+
+AMEX_INTEREST_ROW = re.compile(
+    r'^(Purchases|Cash Advances)\s+'
+    r'(\d{1,2}/\d{1,2}(?:/\d{2,4})?)\s+'
+    r'([-+]?\d+(?:\.\d+)?%)\s+'
+    r'(?:\([^)]+\)\s+)?'
+    r'\$?([\d,]+\.\d{2})\s+'
+    r'\$?([\d,]+\.\d{2})'
+)
+
+def format_inverted_amount(amount):
+    """格式化取反后的金额：正数带 + 号，保留两位小数"""
+    return f"+{amount:.2f}" if amount > 0 else f"{amount:.2f}"
+
+
+def rewrite_amex_interest_row(line):
+    """
+    把利率行改写为交易格式：
+    "Purchases 10/18/2023 29.99% (v) $0.00 $0.00" -> "10/18/2023  Purchases Interest Rate  -0.00"
+    """
+    if not re.match(r'^(Purchases|Cash Advances)\b', line.strip()):
+        return line
+    match = AMEX_INTEREST_ROW.match(line.strip())
+    if not match:
+        return line
+    txn_type = match.group(1)
+    date_str = match.group(2)
+    # 使用第二个金额（分组 5）作为最终金额
+    raw_amount = match.group(5).replace(',', '')
+    try:
+        amount_value = float(raw_amount)
+    except ValueError:
+        amount_value = 0.00
+    return f"{date_str}  {txn_type} Interest Rate  {format_inverted_amount(-amount_value)}"
+
+
+BOFA_PROFILE = {
+    'case_sensitive': True,
+    'account_rules': [
+        [{
+            'marker': "Account number:",
+            'var': 'account',
+            'capture': r'\d{4}',
+            'capture_mode': "findall",
+            'emit': "always",
+            'header': "Bank of America Savings Account({value})",
+            'log': "找到账户后四位: {value}",
+        }],
+    ],
+    'start_markers': ["Deposits and other additions", "ATM and debit card subtractions", "Other subtractions"],
+    'end_markers': ["Total ", "Braille and Large Print Request"],
+    'date_pattern': r'\d{2}/\d{2}/\d{2}',
+    'amount_pattern': r'[-]?\$?\d+,?\d*\.\d{2}',
+    'continuation_min_words': 4,
+    'flush_unmatched': True,
+    'summary': "\n共找到 {count} 条交易记录",
+}
+
+CHASE_PROFILE = {
+    'account_rules': [
+        [
+            {'marker': "CHASE TOTAL CHECKING", 'var': 'checking', 'capture': r'(\d{4})\b', 'capture_mode': "search"},
+            {'marker': "CHASE SAVINGS", 'var': 'savings', 'capture': r'(\d{4})\b', 'capture_mode': "search"},
+        ],
+        [
+            {
+                'marker': "CHECKING SUMMARY",
+                'var': 'checking',
+                'emit': "var",
+                'header': "Chase Checking Account({value})",
+                'header_without_value': "Chase Checking Account",
+                'consume': True,
+            },
+            {
+                'marker': "SAVINGS SUMMARY",
+                'var': 'savings',
+                'emit': "var",
+                'header': "Chase Savings Account({value})",
+                'header_without_value': "Chase Savings Account",
+                'consume': True,
+            },
+        ],
+    ],
+    'skip_markers': ["BEGINNING BALANCE", "ENDING BALANCE"],
+    'stop_markers': ["*start*dre portrait disclosure message area"],
+    'start_markers': ["TRANSACTION DETAIL"],
+    'detail_stop_markers': ["*start*post overdraft and returned"],
+    'transforms': [
+        # 处理CHASE SAVING 和 CHASE CHECKING 中 *end*transacXtion detail 标记，替换为其中包含的数字
+        {'marker': "*end*transac", 'pattern': r'\*end\*transac(\d)tion detail', 'replace': r'\1'},
+    ],
+    'date_pattern': r'\d{2}/\d{2}',
+    'amount_pattern': r'[-]?\$?\d+,?\d*\.\d{2}',
+    'balance_column': True,
+    'continuation_min_words': 3,
+    'flush_unmatched': True,
+    'summary': "\n共找到 {count} 条交易记录",
+}
+
+CHASE_CREDITCARD_PROFILE = {
+    'account_rules': [
+        [{
+            'marker': "ACCOUNT NUMBER:",
+            'var': 'account',
+            'capture': r'\d{4}',
+            'capture_mode': "findall",
+            'emit': "captured",
+            'header': "Chase Credit Card({value})",
+            'log': "找到账户后四位: {value}",
+        }],
+    ],
+    'start_markers': ["PAYMENTS AND OTHER CREDITS", "PURCHASE", "ACCOUNT ACTIVITY  (CONTINUED)"],
+    'end_markers': ["ACCOUNT SUMMARY", "IMPORTANT NOTICES", "PAGE"],
+    'detail_skip_markers': [
+        "Date of",
+        "Transaction Merchant Name or Transaction Description",
+        "$ Amount",
+        "PAYMENTS AND OTHER CREDITS",
+        "PURCHASE",
+        "FEES CHARGED",
+        "ACCOUNT ACTIVITY",
+        "ACCOUNT ACTIVITY (CONTINUED)",
+    ],
+    'date_pattern': r'\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b',
+    'amount_pattern': r'[-]?\$?(?:\d{1,3}(?:,\d{3})*)?(?:\.\d{2})',
+    'invert_amount': True,
+    'summary': "\n共找到 {count} 条交易记录",
+}
+
+
+AMEX_CREDITCARD_PROFILE = {
+    'account_rules': [
+        [{
+            'marker': "ACCOUNT ENDING",
+            'var': 'account',
+            'capture': r'\d{5}',
+            'capture_mode': "findall",
+            'emit': "captured",
+            'once': True,
+            'header': "American Express Credit Card({value})",
+        }],
+    ],
+    'start_markers': [
+        "FEES", "TOTAL PAYMENTS AND CREDITS", "DETAIL", "DETAIL *INDICATES POSTING DATE", "DETAIL CONTINUED",
+        "TO RATE INTEREST RATE",
+    ],
+    'end_markers': ["ABOUT TRAILING INTEREST", "CONTINUED ON REVERSE", "CONTINUED ON NEXT PAGE"],
+    'detail_skip_markers': [
+        "DATE",
+        "DESCRIPTION",
+        "AMOUNT",
+        "BEGINNING BALANCE ON",
+        "DEPOSITS AND OTHER ADDITIONS",
+        "NEW CHARGES SUMMARY",
+        "NEW CHARGES",
+        "SUMMARY",
+        # 以下两项历来按字面子串比较，并不会作为正则生效
+        r'CARD\s+ENDING\s+\d+-\d+',
+        r'NEW CHARGES\s+$\d+,\d{3}\.\d{2}',
+    ],
+    'date_pattern': r'\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b',
+    'amount_pattern': r'[-+]?\$?\d+(?:,\d{3})*(?:\.\d{2})',
+    'invert_amount': True,
+    'row_rewrite': rewrite_amex_interest_row,
+    'summary': "\nAMEX信用卡交易记录数量: {count}",
+}
+
+# (银行类型, 账户类型) -> 清理配置；账户类型为 None 的条目匹配该银行的其他账户类型
+STATEMENT_PROFILES = {
+    ("CHASE", "CREDITCARD"): CHASE_CREDITCARD_PROFILE,
+    ("CHASE", None): CHASE_PROFILE,
+    ("BOFA", None): BOFA_PROFILE,
+    ("AMEX", "CREDITCARD"): AMEX_CREDITCARD_PROFILE,
+}
+
+
+NO_HITS = frozenset()
+
+
+def compile_profile(profile):
+    """把清理配置编译为 StatementCleaner"""
+    return StatementCleaner(profile)
+
+
+class StatementCleaner:
+    """由清理配置编译得到的逐行分类状态机
+
+    所有关键词被编译进同一个正则，每行只做一次规范化和一次搜索；
+    绝大多数行不含任何关键词，只有命中的行才进一步找出全部命中的类别。
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.case_sensitive = profile.get('case_sensitive', False)
+        self.continuation_min_words = profile.get('continuation_min_words')
+        self.flush_unmatched = profile.get('flush_unmatched', False)
+        self.invert_amount = profile.get('invert_amount', False)
+        self.row_rewrite = profile.get('row_rewrite')
+        self.balance_column = profile.get('balance_column', False)
+        self.summary = profile.get('summary', "\n共找到 {count} 条交易记录")
+        self.date_pattern = re.compile(profile['date_pattern'])
+        self.amount_pattern = re.compile(profile['amount_pattern'])
+
+        groups = {}
+        for name in ('skip_markers', 'stop_markers', 'start_markers', 'end_markers',
+                     'detail_stop_markers', 'detail_skip_markers'):
+            if profile.get(name):
+                groups[name] = profile[name]
+
+        # 账户规则：[(分组名, 规则, 编译后的账户号正则)]
+        self.account_rules = []
+        for group_index, rule_group in enumerate(profile.get('account_rules', [])):
+            compiled_group = []
+            for rule_index, rule in enumerate(rule_group):
+                name = f"rule_{group_index}_{rule_index}"
+                groups[name] = [rule['marker']]
+                capture = re.compile(rule['capture']) if rule.get('capture') else None
+                compiled_group.append((name, rule, capture))
+            self.account_rules.append(compiled_group)
+
+        self.transforms = []
+        for index, transform in enumerate(profile.get('transforms', [])):
+            name = f"transform_{index}"
+            groups[name] = [transform['marker']]
+            self.transforms.append((name, re.compile(transform['pattern'], re.IGNORECASE), transform['replace']))
+
+        # 关键词 -> 所属类别；同一位置较长的关键词会遮住它的前缀关键词，因此把前缀的类别并入
+        categories = {}
+        for name, keywords in groups.items():
+            for keyword in keywords:
+                categories.setdefault(self._normalize(keyword), set()).add(name)
+        for keyword, names in categories.items():
+            for other, other_names in categories.items():
+                if other != keyword and keyword.startswith(other):
+                    names |= other_names
+        self.categories = {keyword: frozenset(names) for keyword, names in categories.items()}
+        alternation = '|'.join(re.escape(k) for k in sorted(self.categories, key=len, reverse=True))
+        self.any_keyword = re.compile(alternation)
+        # 前瞻匹配在每个位置各尝试一次，关键词之间相互重叠时也不会漏掉
+        self.every_keyword = re.compile(f"(?=({alternation}))")
+
+    def _normalize(self, text):
+        """按配置的大小写规则规范化关键词或文本行"""
+        return text if self.case_sensitive else text.upper()
+
+    def classify(self, line):
+        """返回文本行命中的关键词类别集合"""
+        text = line if self.case_sensitive else line.upper()
+        if not self.any_keyword.search(text):
+            return NO_HITS
+        hits = set()
+        for match in self.every_keyword.finditer(text):
+            hits |= self.categories[match.group(1)]
+        return hits
+
+    def clean(self, lines):
+        """
+        清理账单文本行
+        :param lines: 文本行的可迭代对象
+        :return: tuple (transactions, transaction_count)，transactions 为 Transaction 记录列表
+        """
+        cleaned_lines = []
+        account = None
+        transaction_count = 0
+        account_vars = {}
+        emitted_once = set()
+        is_transaction_detail = False
+        current_transaction = None
+
+        classify = self.classify
+        date_search = self.date_pattern.search
+        amount_search = self.amount_pattern.search
+
+        for line in lines:
+            # 去除行首尾空白
+            line = line.strip()
+            if not line:
+                continue
+
+            hits = classify(line)
+
+            if hits:
+                # 账户规则：提取账户号、输出账户标题
+                consumed = False
+                for rule_group in self.account_rules:
+                    for name, rule, capture in rule_group:
+                        if name not in hits:
+                            continue
+                        consumed, label = self._apply_account_rule(
+                            name, rule, capture, line, account_vars, emitted_once
+                        )
+                        if label:
+                            account = label
+                        break
+                    if consumed:
+                        break
+                if consumed:
+                    continue
+
+                if 'skip_markers' in hits:
+                    continue
+
+                if 'stop_markers' in hits:
+                    print("遇到账单结束标记，停止处理")
+                    break
+
+                # 检测是否进入交易明细部分
+                if 'start_markers' in hits:
+                    is_transaction_detail = True
+                    continue
+
+                # 检测交易记录部分的结束
+                if 'end_markers' in hits:
+                    is_transaction_detail = False
+                    if current_transaction:
+                        cleaned_lines.append(current_transaction)
+                        transaction_count += 1
+                        current_transaction = None
+                    continue
+
+            if not is_transaction_detail:
+                continue
+
+            if hits:
+                if 'detail_stop_markers' in hits:
+                    print("遇到交易明细结束标记，停止处理")
+                    break
+
+                if 'detail_skip_markers' in hits:
+                    continue
+
+                for name, pattern, replace in self.transforms:
+                    if name in hits:
+                        line = pattern.sub(replace, line)
+
+            # 匹配日期和金额
+            date_match = date_search(line)
+            amount_match = amount_search(line) if date_match else None
+
+            # 如果找到日期和金额，说明是新的交易记录
+            if date_match and amount_match:
+                if current_transaction:
+                    cleaned_lines.append(current_transaction)
+                    transaction_count += 1
+                current_transaction = self._make_transaction(line, date_match, amount_match, account)
+                if self.invert_amount:
+                    line = self._invert_amount(line, amount_match)
+                    current_transaction.amount_cents = -current_transaction.amount_cents
+                    current_transaction.raw = line
+                if self.row_rewrite:
+                    row = self.row_rewrite(line)
+                    # 改写后的行重新解析日期和金额
+                    if row is not line:
+                        current_transaction = self._make_transaction(
+                            row, date_search(row), amount_search(row), account
+                        )
+            # 单词数足够的非交易行作为交易描述的补充
+            elif (current_transaction and self.continuation_min_words
+                  and len(line.split()) >= self.continuation_min_words):
+                current_transaction.append_description(line)
+            # 其他行结束当前交易
+            elif current_transaction and self.flush_unmatched:
+                cleaned_lines.append(current_transaction)
+                transaction_count += 1
+                current_transaction = None
+
+        # 处理最后一个未完成的交易记录
+        if current_transaction:
+            cleaned_lines.append(current_transaction)
+            transaction_count += 1
+
+        print(self.summary.format(count=transaction_count))
+        return cleaned_lines, transaction_count
+
+    def _apply_account_rule(self, name, rule, capture, line, account_vars, emitted_once):
+        """应用一条账户规则，返回 (是否消费了本行, 新的账户标签或 None)"""
+        if rule.get('once') and name in emitted_once:
+            return rule.get('consume', False), None
+
+        var = rule.get('var')
+        captured = None
+        if capture is not None:
+            if rule.get('capture_mode') == "search":
+                match = capture.search(line)
+                captured = match.group(1) if match else None
+            else:
+                numbers = capture.findall(line)
+                captured = numbers[-1] if numbers else None
+            if captured is not None:
+                account_vars[var] = captured
+
+        if rule.get('log'):
+            print(rule['log'].format(value=account_vars.get(var)))
+
+        emit = rule.get('emit')
+        header = None
+        if emit == "always":
+            header = rule['header'].format(value=account_vars.get(var))
+        elif emit == "captured" and captured is not None:
+            header = rule['header'].format(value=captured)
+        elif emit == "var":
+            value = account_vars.get(var)
+            header = rule['header'].format(value=value) if value else rule.get('header_without_value')
+
+        if header:
+            emitted_once.add(name)
+        return rule.get('consume', False), header
+
+    def _make_transaction(self, line, date_match, amount_match, account):
+        """根据交易行和匹配到的日期、金额创建交易记录，描述为去掉日期、金额和余额后的文本"""
+        if not (date_match and amount_match):
+            return Transaction(None, 0, ' '.join(line.split()), account=account, raw=line)
+        spans = [date_match.span(), amount_match.span()]
+        balance_cents = None
+        if self.balance_column:
+            balance_match = self.amount_pattern.search(line, amount_match.end())
+            if balance_match:
+                spans.append(balance_match.span())
+                balance_cents = parse_cents(balance_match.group())
+        pieces = []
+        position = 0
+        for start, end in sorted(spans):
+            pieces.append(line[position:start])
+            position = max(position, end)
+        pieces.append(line[position:])
+        return Transaction(
+            date_match.group(),
+            parse_cents(amount_match.group()),
+            ' '.join(' '.join(pieces).split()),
+            account=account,
+            balance_cents=balance_cents,
+            raw=line
+        )
+
+    def _invert_amount(self, line, amount_match):
+        """把行内匹配到的金额替换为其相反数"""
+        # 移除 $ 和 , 符号，转换为浮点数并取相反数
+        amount = -float(amount_match.group().replace('$', '').replace(',', ''))
+        return line[:amount_match.start()] + format_inverted_amount(amount) + line[amount_match.end():]
+
+
+STATEMENT_CLEANERS = {key: compile_profile(profile) for key, profile in STATEMENT_PROFILES.items()}
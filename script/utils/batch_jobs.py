@@ -0,0 +1,180 @@
+import json
+import os
+import time
+from openai.types.chat import ChatCompletion
+
+# 批量任务使用的接口和完成时限（OpenAI Batch API 目前只支持 24h）
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# 轮询批量任务状态的间隔（秒）
+DEFAULT_BATCH_POLL_SECONDS = 30
+# 一次最多等待批量任务的秒数；超时后任务记录保留在磁盘上，之后可以继续获取结果
+DEFAULT_BATCH_TIMEOUT_SECONDS = 10 * 60
+# 已提交、尚未取回结果的批量任务记录保存在输出目录下的该子目录中
+BATCH_RUNS_DIRNAME = "batch_jobs"
+# 批量任务的终止状态：之后不会再有新的结果
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJob:
+    """一次提交的批量任务
+
+    记录任务 ID、使用的模型和每个请求的提示词：结果返回后按 custom_id 分发回各个批次，
+    并以与逐个请求相同的缓存键写入响应缓存。
+    """
+    def __init__(self, model, temperature, prompts):
+        """
+        :param model: 模型别名，一个批量任务只能使用一个模型
+        :param temperature: 温度参数
+        :param prompts: {custom_id: (系统提示词, 用户消息)}
+        """
+        self.model = model
+        self.temperature = temperature
+        self.prompts = prompts
+        self.job_id = None
+        self.status = None
+        # 提交时的时间戳（time.time()），任务记录重新加载后仍可计算耗时
+        self.submitted_at = None
+        self.request_counts = None
+        # 响应缓存命中的请求不会提交，结果在提交时就已确定
+        self.results = {}
+
+    def __repr__(self):
+        return f"BatchJob({self.job_id!r}, {self.model!r}, status={self.status!r}, requests={len(self.prompts)})"
+
+    def to_dict(self):
+        """转换为可以写入 JSON 的字典，见 save_batch_run"""
+        return {
+            'job_id': self.job_id,
+            'model': self.model,
+            'temperature': self.temperature,
+            'prompts': self.prompts,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            # 提交时确定的结果都来自响应缓存，没有 token 用量
+            'results': {custom_id: content for custom_id, (content, _) in self.results.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 to_dict 的结果恢复任务"""
+        job = cls(data['model'], data['temperature'],
+                  {custom_id: tuple(prompt) for custom_id, prompt in data['prompts'].items()})
+        job.job_id = data['job_id']
+        job.status = data['status']
+        job.submitted_at = data['submitted_at']
+        job.results = {custom_id: (content, None) for custom_id, content in data['results'].items()}
+        return job
+
+
+def build_batch_jsonl(model, temperature, prompts):
+    """
+    把请求编成批量任务的 JSONL 输入文件，每行一个 chat completions 请求
+    :param model: 请求中使用的模型名（后端的模型名，不是别名）
+    :param prompts: {custom_id: (系统提示词, 用户消息)}
+    :return: bytes
+    """
+    lines = []
+    for custom_id, (system_prompt, user_prompt) in prompts.items():
+        lines.append(json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model,
+                "temperature": temperature,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ]
+            }
+        }, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def parse_batch_output(text):
+    """
+    解析批量任务的输出文件（或错误文件）
+    :return: tuple ({custom_id: ChatCompletion}, {custom_id: 错误说明})
+    """
+    completions = {}
+    errors = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            print(f"跳过无法解析的批量任务结果: {line[:200]}")
+            continue
+        custom_id = entry.get("custom_id")
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code") != 200:
+            errors[custom_id] = entry.get("error") or (response.get("body") or {}).get("error") or response.get("status_code")
+            continue
+        try:
+            completions[custom_id] = ChatCompletion.model_validate(response["body"])
+        except Exception as e:
+            errors[custom_id] = str(e)
+    return completions, errors
+
+
+def wait_for_batch_job(retrieve, job_id, poll_seconds=DEFAULT_BATCH_POLL_SECONDS, timeout_seconds=None, on_status=None):
+    """
+    轮询批量任务直到进入终止状态或超时
+    :param retrieve: retrieve(job_id) 返回任务的最新状态
+    :param timeout_seconds: 最多等待的秒数，None 表示一直等到服务商给出终止状态
+    :param on_status: 可选回调 (任务状态对象)，每次轮询后调用
+    :return: 最后一次得到的任务状态；超时时状态不是终止状态
+    """
+    started = time.monotonic()
+    while True:
+        job = retrieve(job_id)
+        if on_status:
+            on_status(job)
+        if job.status in BATCH_TERMINAL_STATUSES:
+            return job
+        if timeout_seconds is not None and time.monotonic() - started + poll_seconds > timeout_seconds:
+            return job
+        time.sleep(poll_seconds)
+
+
+def save_batch_run(directory, run):
+    """
+    把一次批量处理的任务记录写入 directory/<run_id>.json（先写临时文件再替换）
+    :param run: 可以写入 JSON 的字典，必须包含 'run_id'
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{run['run_id']}.json")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def load_batch_runs(directory):
+    """
+    读取 directory 下保存的全部任务记录，按保存时间从旧到新排列；无法解析的记录跳过
+    :return: list[dict]
+    """
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+    runs = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                runs.append((os.path.getmtime(path), json.load(f)))
+        except (OSError, ValueError) as e:
+            print(f"跳过无法读取的批量任务记录 {path}: {e}")
+    return [run for _, run in sorted(runs, key=lambda item: item[0])]
+
+
+def remove_batch_run(directory, run_id):
+    """删除已经取回结果的任务记录"""
+    try:
+        os.remove(os.path.join(directory, f"{run_id}.json"))
+    except FileNotFoundError:
+        pass
@@ -1,127 +1,153 @@
+from models.transaction import format_cents
+from .token_utils import estimate_tokens
+
+# 每批默认的 token 预算：输出上限留出余量，避免长批次被截断而丢失记录
+DEFAULT_MAX_INPUT_TOKENS = 12000
+DEFAULT_MAX_OUTPUT_TOKENS = 4000
+# 每条记录的预期输出 token：分类模式只有编号、类型、分类和标签；
+# 完整模式另有日期、金额、账户、货币等固定列，再加上写回备注的描述
+CLASSIFY_OUTPUT_TOKENS_PER_ROW = 20
+FULL_OUTPUT_TOKENS_PER_ROW = 40
+ROW_SEPARATOR_TOKENS = 1
+
+
 class Batch:
     """批次数据的封装类"""
     def __init__(self, content, header=None):
-        self.header = header          # 批次的标题（账户信息）
-        self.content = content        # 批次的内容（交易记录）
+        self.header = header          # 批次的标题（账户标签）
+        self.content = content        # 批次的内容（Transaction 记录）
         self.length = len(content)    # 批次的交易数量
         self.index = None            # 批次的序号
         self.processed = False       # 处理状态
         self.result = None          # 处理结果
+        self.input_tokens = None     # 预估输入 token（按 token 预算分批时）
+        self.output_tokens = None    # 预估输出 token（按 token 预算分批时）
+        self.known = {}              # 商户记忆中已有的分类 {编号: 分类}（分类模式）
         
     def get_text(self):
-        """获取批次的完整文本"""
+        """获取批次的紧凑文本：账户标题加每行一条 日期|金额|描述[|余额]"""
         text = []
         if self.header:
-            text.append(self.header)
-        text.extend(self.content)
+            text.append(f"=== {self.header} ===")
+        text.extend(record.to_compact() for record in self.content)
         return '\n'.join(text)
     
+    def get_classification_text(self):
+        """获取分类模式使用的文本：账户标题加每行一条 编号|日期|金额|描述，编号从 1 开始"""
+        text = []
+        if self.header:
+            text.append(f"=== {self.header} ===")
+        text.extend(
+            f"{row_id}|{record.date}|{format_cents(record.amount_cents)}|{record.description}"
+            for row_id, record in enumerate(self.content, 1)
+        )
+        return '\n'.join(text)
+
     def __str__(self):
         """字符串表示"""
         return f"Batch {self.index + 1 if self.index is not None else 'N/A'} ({self.length} records)"
 
-def process_batches(cleaned_lines, batch_size):
+def estimate_record_tokens(record, ai_mode="classify", model="gpt-4o"):
+    """
+    估算一条交易记录的输入和预期输出 token
+    :param record: Transaction 记录
+    :param ai_mode: AI处理模式，"classify" 或 "full"
+    :param model: 模型名称，用于选择 token 编码
+    :return: tuple (input_tokens, output_tokens)
+    """
+    input_tokens = estimate_tokens(record.to_compact(), model) + ROW_SEPARATOR_TOKENS
+    if ai_mode == "classify":
+        output_tokens = CLASSIFY_OUTPUT_TOKENS_PER_ROW
+    else:
+        # 完整模式会把描述原样写回备注列
+        output_tokens = FULL_OUTPUT_TOKENS_PER_ROW + estimate_tokens(record.description, model)
+    return input_tokens, output_tokens
+
+def process_batches(transactions, batch_size=None, max_input_tokens=None, max_output_tokens=None,
+                    ai_mode="classify", model="gpt-4o"):
     """
-    将清理后的文本分批处理
+    将清理后的交易记录按账户分批，同一批次只包含一个账户的记录
     
     Args:
-        cleaned_lines: 清理后的文本行列表
-        batch_size: 每批处理的行数
+        transactions: 清理得到的 Transaction 记录列表
+        batch_size: 每批最多处理的记录数，None 表示不限制
+        max_input_tokens: 每批交易文本的输入 token 上限，None 表示不限制
+        max_output_tokens: 每批预期输出 token 的上限，None 表示不限制
+        ai_mode: AI处理模式，决定每条记录的预期输出 token
+        model: 模型名称，用于估算 token
         
     Returns:
         batches: Batch对象的列表
     """
+    if batch_size is None and max_input_tokens is None and max_output_tokens is None:
+        raise ValueError("batch_size、max_input_tokens 和 max_output_tokens 至少需要指定一个")
+    count_tokens = max_input_tokens is not None or max_output_tokens is not None
+
     batches = []
     current_header = None
     current_batch = []
-    
-    for i, line in enumerate(cleaned_lines):
-        # 检查是否是新的账户部分标题
-        if "=== Chase Checking" in line:
-            # 如果存在当前批次，保存它
-            if current_batch:
-                batch = Batch(current_batch, current_header)
-                batch.index = len(batches)
-                batches.append(batch)
-                current_batch = []
-            current_header = line
-            continue
-            
-        # 检查是否是储蓄账户部分
-        if "=== Chase Savings" in line:
-            # 保存当前批次
-            if current_batch:
-                batch = Batch(current_batch, current_header)
-                batch.index = len(batches)
-                batches.append(batch)
-                current_batch = []
-            # 创建新的储蓄账户批次
-            current_header = line
-            continue
-        
-        if "=== Bank of America Savings" in line:
-            # 保存当前批次
-            if current_batch:
-                batch = Batch(current_batch, current_header)
-                batch.index = len(batches)
-                batches.append(batch)
-                current_batch = []
-            # 创建新的储蓄账户批次
-            current_header = line
-            continue
+    input_tokens = 0
+    output_tokens = 0
 
-        if "=== Chase Credit Card" in line:
-            if current_batch:
-                batch = Batch(current_batch, current_header)
-                batch.index = len(batches)
-                batches.append(batch)
-                current_batch = []
-            # 创建新的储蓄账户批次
-            current_header = line
-            continue
+    def flush():
+        nonlocal input_tokens, output_tokens
+        if current_batch:
+            batch = Batch(list(current_batch), current_header)
+            batch.index = len(batches)
+            batch.input_tokens = input_tokens
+            batch.output_tokens = output_tokens
+            batches.append(batch)
+            current_batch.clear()
+        input_tokens = output_tokens = 0
 
-        if "=== American Express Credit Card" in line:
-            if current_batch:
-                batch = Batch(current_batch, current_header)
-                batch.index = len(batches)
-                batches.append(batch)
-                current_batch = []
-            # 创建新的储蓄账户批次
-            current_header = line
-            continue
+    for record in transactions:
+        # 账户变化时开始新的批次
+        if record.account != current_header:
+            flush()
+            current_header = record.account
 
-        # 将行添加到当前批次
-        current_batch.append(line)
-        
-        # 检查批次是否已满或是最后一行
-        if len(current_batch) >= batch_size or i == len(cleaned_lines) - 1:
-            if current_batch:  # 确保批次不为空
-                batch = Batch(current_batch, current_header)
-                batch.index = len(batches)
-                batches.append(batch)
-                current_batch = []
+        if count_tokens:
+            record_input, record_output = estimate_record_tokens(record, ai_mode, model)
+            # 加入本条后超出预算时先结束当前批次；单条超出预算的记录独占一个批次
+            if current_batch and (
+                (max_input_tokens is not None and input_tokens + record_input > max_input_tokens)
+                or (max_output_tokens is not None and output_tokens + record_output > max_output_tokens)
+            ):
+                flush()
+            input_tokens += record_input
+            output_tokens += record_output
+
+        current_batch.append(record)
+
+        # 批次已满
+        if batch_size is not None and len(current_batch) >= batch_size:
+            flush()
+    flush()
     print(f"分割为 {len(batches)} 个批次")
+    if count_tokens and batches:
+        print(f"批次预估 token：输入最多 {max(batch.input_tokens for batch in batches)}，"
+              f"输出最多 {max(batch.output_tokens for batch in batches)}")
     
     
     return batches
 
 def merge_batch_results(batches):
     """
-    合并所有批次的处理结果
+    按批次顺序合并所有批次的处理结果
     
     Args:
         batches: 已处理的Batch对象列表
         
     Returns:
-        merged_text: 合并后的文本
+        merged_rows: 合并后的 iCost 行列表（每行为字段列表），没有结果的批次跳过
     """
-    merged_results = []
+    merged_rows = []
     
     for batch in batches:
         if batch.processed and batch.result:
-            merged_results.append(batch.result)
+            merged_rows.extend(batch.result)
     
-    return '\n'.join(merged_results)
+    return merged_rows
 
 def get_batch_status(batches):
     """
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+import time
+from openai import OpenAI
+from .shared_registry import get_or_create
+
+# 客户端闲置超过该时间（秒）后从池中移除
+DEFAULT_CLIENT_IDLE_SECONDS = 15 * 60
+
+def get_client_pool(idle_seconds=DEFAULT_CLIENT_IDLE_SECONDS):
+    """
+    获取进程内共享的 AI 客户端池，所有 Streamlit 会话和页面重跑共用
+    :param idle_seconds: 客户端闲置多久后移除，与已有的池不同时抛出 ValueError
+    """
+    return get_or_create("client_pool", None, ClientPool, idle_seconds=idle_seconds)
+
+
+def api_key_fingerprint(api_key):
+    """返回 API key 的摘要，用作池的键和日志，避免在内存索引和输出中保留明文"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class ClientPool:
+    """按 API key 和后端复用的 AI 客户端池
+
+    每个 OpenAI 客户端自带一个保持长连接的 HTTP 连接池。页面每次重跑都会重新创建控制器，
+    从池中取回同一个客户端即可复用已建立的 TLS 连接，不必每次重新握手。
+    闲置过久的客户端从池中移除；仍在使用它的请求不受影响，连接在客户端被回收时关闭。
+    """
+    def __init__(self, idle_seconds=DEFAULT_CLIENT_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def get(self, api_key, backend="openai", base_url=None, **options):
+        """
+        获取客户端，池中没有时创建
+        :param api_key: API key
+        :param backend: 后端名称，不同后端即使 key 相同也使用不同的客户端
+        :param base_url: 可选的 API 地址，None 表示后端默认地址
+        :param options: 传给 OpenAI 客户端的其他参数，如 max_retries、timeout
+        """
+        key = (api_key_fingerprint(api_key), backend, base_url, tuple(sorted(options.items())))
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                client = OpenAI(api_key=api_key, base_url=base_url, **options)
+                self._clients[key] = [client, now]
+                self.created += 1
+                print(f"创建 {backend} 客户端 (key {key[0][:8]}…)")
+                return client
+            entry[1] = now
+            self.reused += 1
+            return entry[0]
+
+    def _evict_idle(self, now):
+        """移除闲置超时的客户端（调用方持有锁）"""
+        if self.idle_seconds is None:
+            return
+        for key in [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_seconds]:
+            del self._clients[key]
+            self.evicted += 1
+
+    def stats(self):
+        """返回客户端池统计：reuse_rate 即取客户端时复用已有连接池的比例"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            clients = len(self._clients)
+            backends = sorted({key[1] for key in self._clients})
+        requests = self.created + self.reused
+        return {
+            'clients': clients,
+            'backends': backends,
+            'created': self.created,
+            'reused': self.reused,
+            'reuse_rate': self.reused / requests if requests else 0.0,
+            'evicted': self.evicted,
+        }
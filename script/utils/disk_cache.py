@@ -0,0 +1,110 @@
+import os
+import threading
+
+
+class DiskLRUCache:
+    """基于目录的 LRU 磁盘缓存
+
+    每个条目是缓存目录下的一个文件，文件修改时间即最近使用时间。
+    写入先落到临时文件再原子替换，超过容量上限时按最久未使用的顺序淘汰。
+    """
+    def __init__(self, cache_dir, max_bytes, suffix=".cache"):
+        """
+        初始化缓存目录
+        :param cache_dir: 缓存文件所在目录
+        :param max_bytes: 缓存总大小上限（字节）
+        :param suffix: 缓存文件后缀，用于区分同一目录下的其他文件
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, key):
+        """返回缓存条目的文件路径"""
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def temp_path_for(self, key):
+        """返回写入缓存条目时使用的临时文件路径（进程、线程内唯一）"""
+        return f"{self.path_for(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def lookup(self, key):
+        """
+        查找缓存条目并刷新其最近使用时间
+        :return: 命中时返回文件路径，否则返回 None
+        """
+        path = self.path_for(key)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return path
+
+    def commit(self, key, temp_path):
+        """把写好的临时文件提交为缓存条目，并按容量上限淘汰旧条目"""
+        os.replace(temp_path, self.path_for(key))
+        self.evict()
+
+    def discard(self, temp_path):
+        """丢弃未提交的临时文件"""
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def remove(self, key):
+        """删除指定缓存条目"""
+        self.discard(self.path_for(key))
+
+    def evict(self):
+        """按最近使用时间从旧到新删除条目，直到总大小不超过上限"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self._count("evictions")
+
+    def stats(self):
+        """返回缓存命中统计和当前占用"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def _entries(self):
+        """列出缓存目录中的条目：(路径, 大小, 修改时间)"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _count(self, counter, amount=1):
+        """线程安全地累加计数器"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
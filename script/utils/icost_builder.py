@@ -0,0 +1,137 @@
+import os
+import re
+from datetime import date
+from models.transaction import format_cents
+
+# iCost 导入模板的列
+ICOST_HEADERS = ["日期", "类型", "金额", "一级分类", "二级分类", "账户1", "账户2", "备注", "货币", "标签"]
+
+TRANSACTION_TYPES = ("收入", "支出", "转账")
+
+# 各银行账单的货币
+BANK_CURRENCIES = {
+    "CHASE": "USD",
+    "BOFA": "USD",
+    "AMEX": "USD",
+}
+
+_YEAR_PATTERN = re.compile(r'(?<!\d)(19\d{2}|20\d{2})(?!\d)')
+
+
+def statement_year(file_name):
+    """
+    从文件名中提取账单年份
+    :param file_name: 账单文件名，如 "chase_2023_01.pdf"
+    :return: 年份，找不到时返回当前年份
+    """
+    match = _YEAR_PATTERN.search(os.path.basename(file_name))
+    if match:
+        return int(match.group(1))
+    year = date.today().year
+    print(f"无法从文件名 {file_name} 中提取年份，使用 {year}")
+    return year
+
+
+def format_icost_date(date_text, year):
+    """
+    把账单日期转换为 YYYY-MM-DD；日期本身带年份时使用日期中的年份
+    例如 ("01/02", 2023) -> "2023-01-02"，("10/18/23", 2024) -> "2023-10-18"
+    """
+    if not date_text:
+        return ""
+    parts = date_text.split('/')
+    month, day = int(parts[0]), int(parts[1])
+    if len(parts) > 2 and parts[2]:
+        year = int(parts[2])
+        if year < 100:
+            year += 2000
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def account_display_name(account_tag):
+    """把账户标签转换为 iCost 账户名，如 "Chase Checking Account(1234)" -> "Chase Checking(1234)" """
+    if not account_tag:
+        return ""
+    return account_tag.replace(" Account", "")
+
+
+def default_transaction_type(amount_cents):
+    """根据金额正负推断交易类型：负数为支出，其余为收入"""
+    return "支出" if amount_cents < 0 else "收入"
+
+
+def build_icost_row(record, year, currency, transaction_type=None, category1="", category2="", tags=""):
+    """
+    用本地解析的交易记录和模型给出的分类组装一行 iCost 数据
+    :param record: Transaction 记录
+    :param year: 账单年份
+    :param currency: 货币
+    :param transaction_type: 交易类型，不合法或缺失时按金额正负推断
+    :return: 与 ICOST_HEADERS 对应的字段列表
+    """
+    if transaction_type not in TRANSACTION_TYPES:
+        transaction_type = default_transaction_type(record.amount_cents)
+    account = account_display_name(record.account)
+    account1, account2 = account, ""
+    if transaction_type == "转账":
+        # 转账不分类；转入时当前账户填入账户2，转出时填入账户1
+        category1 = category2 = ""
+        if record.amount_cents > 0:
+            account1, account2 = "", account
+    return [
+        format_icost_date(record.date, year),
+        transaction_type,
+        format_cents(record.amount_cents),
+        category1,
+        category2,
+        account1,
+        account2,
+        record.description,
+        currency,
+        tags,
+    ]
+
+
+def iter_classification_lines(response_text):
+    """
+    按出现顺序逐行解析分类模式的模型输出，跳过格式不正确的行；同一编号可能出现多次
+    :param response_text: 每行 "编号|类型|一级分类|二级分类|标签" 的文本
+    :return: 生成 (编号, (类型, 一级分类, 二级分类, 标签))
+    """
+    for line in (response_text or "").split("\n"):
+        parts = [part.strip() for part in line.strip().split("|")]
+        if len(parts) < 2 or not parts[0].isdigit():
+            continue
+        parts += [""] * (5 - len(parts))
+        yield int(parts[0]), tuple(parts[1:5])
+
+
+def parse_classification_response(response_text):
+    """
+    解析分类模式的模型输出，同一编号出现多次时保留第一次的结果
+    :param response_text: 每行 "编号|类型|一级分类|二级分类|标签" 的文本
+    :return: {编号: (类型, 一级分类, 二级分类, 标签)}
+    """
+    classifications = {}
+    for row_id, classification in iter_classification_lines(response_text):
+        classifications.setdefault(row_id, classification)
+    return classifications
+
+
+def assemble_icost_rows(records, classifications, year, currency):
+    """
+    把分类结果按编号合并到本地组装的 iCost 行，模型漏掉的记录按金额正负推断类型
+    :param records: Transaction 记录列表，编号从 1 开始
+    :param classifications: parse_classification_response 的结果
+    :return: tuple (rows, missing_ids)
+    """
+    rows = []
+    missing_ids = []
+    for row_id, record in enumerate(records, 1):
+        classification = classifications.get(row_id)
+        if classification is None:
+            missing_ids.append(row_id)
+            rows.append(build_icost_row(record, year, currency))
+        else:
+            rows.append(build_icost_row(record, year, currency, *classification))
+    return rows, missing_ids
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import time
+from .disk_cache import DiskLRUCache
+from .shared_registry import get_or_create
+
+# 缓存格式版本，条目结构变化时需要递增，使旧条目自然失效
+LLM_CACHE_VERSION = 1
+DEFAULT_LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+def get_llm_response_cache(cache_dir, max_bytes=DEFAULT_LLM_CACHE_MAX_BYTES, ttl_seconds=DEFAULT_LLM_CACHE_TTL_SECONDS):
+    """
+    获取进程内共享的模型响应缓存实例，同一目录只创建一次，命中统计在多次页面重跑间累计
+    :param cache_dir: 缓存目录
+    :param max_bytes: 缓存总大小上限（字节）
+    :param ttl_seconds: 条目有效期（秒），None 表示不过期
+    与同一目录已有实例的容量上限或有效期不同时抛出 ValueError
+    """
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    return get_or_create(
+        "llm_response_cache", cache_dir, LLMResponseCache,
+        cache_dir=cache_dir, max_bytes=max_bytes, ttl_seconds=ttl_seconds
+    )
+
+
+class LLMResponseCache(DiskLRUCache):
+    """按模型、温度和提示词内容寻址的模型响应缓存
+
+    相同的批次输入在同一模型和温度下的输出可以互换，重复处理同一份账单时直接返回缓存的响应。
+    每个条目是一个 JSON 文件，记录写入时间用于判断是否过期；文件修改时间仍用作 LRU 的最近使用时间。
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_LLM_CACHE_MAX_BYTES, ttl_seconds=DEFAULT_LLM_CACHE_TTL_SECONDS):
+        super().__init__(cache_dir, max_bytes, suffix=".response.json")
+        self.ttl_seconds = ttl_seconds
+        self.expired = 0
+
+    def make_key(self, model, temperature, system_prompt, user_prompt):
+        """根据模型、温度和完整提示词计算缓存键"""
+        hasher = hashlib.sha256()
+        hasher.update(f"v{LLM_CACHE_VERSION}\0{model}\0{temperature!r}\0".encode())
+        hasher.update(system_prompt.encode())
+        hasher.update(b"\0")
+        hasher.update(user_prompt.encode())
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """
+        读取缓存的响应
+        :return: 命中且未过期时返回响应文本，否则返回 None
+        """
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or (
+            self.ttl_seconds is not None and time.time() - entry.get('created', 0) > self.ttl_seconds
+        ):
+            # 过期或损坏的条目按未命中处理
+            self.remove(key)
+            self._count("hits", -1)
+            self._count("misses")
+            self._count("expired")
+            return None
+        return entry['content']
+
+    def put(self, key, content, model=None):
+        """写入响应"""
+        temp_path = self.temp_path_for(key)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': model, 'created': time.time(), 'content': content}, f, ensure_ascii=False)
+        self.commit(key, temp_path)
+
+    def stats(self):
+        """返回缓存统计，额外包含过期条目数"""
+        stats = super().stats()
+        stats['expired'] = self.expired
+        stats['ttl_seconds'] = self.ttl_seconds
+        return stats
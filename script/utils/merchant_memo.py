@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from .shared_registry import get_or_create
+
+# 描述中不代表商户的部分：交易方式前缀，以及纯数字、日期、门店号、参考号等不含字母的片段
+_PREFIX_PATTERN = re.compile(
+    r'^(?:RECURRING CARD PURCHASE|CARD PURCHASE(?: WITH PIN)?|DEBIT CARD PURCHASE|POS PURCHASE|PURCHASE AUTHORIZED ON)\s+'
+)
+_NUMERIC_TOKEN = re.compile(r'^[#*]?[\d\-/.,:]+$')
+# 记忆的有效期（秒）：超过该时间没有再被模型确认的分类不再使用，并在写入时清除
+DEFAULT_MERCHANT_MEMO_TTL_SECONDS = 90 * 24 * 3600
+
+
+def get_merchant_memo(db_path, ttl_seconds=DEFAULT_MERCHANT_MEMO_TTL_SECONDS):
+    """
+    获取进程内共享的商户分类记忆实例，同一数据库文件只打开一次
+    :param db_path: sqlite 数据库文件路径
+    :param ttl_seconds: 记忆的有效期，与已有实例不同时抛出 ValueError
+    """
+    db_path = os.path.abspath(os.path.expanduser(db_path))
+    return get_or_create("merchant_memo", db_path, MerchantMemo, db_path=db_path, ttl_seconds=ttl_seconds)
+
+
+def merchant_memo_scope(api_key_fingerprint, bank_type):
+    """
+    记忆的作用域：同一用户（API key 摘要）同一银行的账单之间共享，不同用户、不同银行互不可见
+    :param api_key_fingerprint: 见 client_pool.api_key_fingerprint
+    """
+    return f"{api_key_fingerprint}:{bank_type}"
+
+
+def normalize_merchant(description):
+    """
+    把交易描述规范化为商户键：转大写，去掉交易方式前缀和不含字母的片段
+    例如 "Card Purchase 01/02 TRADER JOE S #123 NEW YORK NY" -> "TRADER JOE S NEW YORK NY"
+    """
+    text = _PREFIX_PATTERN.sub('', ' '.join(description.upper().split()))
+    return ' '.join(token for token in text.split() if not _NUMERIC_TOKEN.match(token))
+
+
+class MerchantMemo:
+    """商户 -> 分类的持久化记忆
+
+    以 (作用域, 规范化商户, 金额方向) 为键保存模型已给出的分类，
+    已知商户的交易直接在本地分类，只有未知商户才发送给模型。
+    作用域区分用户和银行（见 merchant_memo_scope）；商户名只保存摘要，超过有效期的记忆不再使用。
+    """
+    def __init__(self, db_path, ttl_seconds=DEFAULT_MERCHANT_MEMO_TTL_SECONDS):
+        self.db_path = os.path.expanduser(db_path)
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self._lock = threading.Lock()
+        # 批次在多个线程中并发处理，共用一个连接并由锁串行化访问
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._conn:
+            # 早期版本不区分作用域、以明文保存商户名，这些记录不再使用
+            self._conn.execute("DROP TABLE IF EXISTS merchants")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS scoped_merchants (
+                    scope TEXT NOT NULL,
+                    merchant TEXT NOT NULL,
+                    direction TEXT NOT NULL,
+                    txn_type TEXT NOT NULL,
+                    category1 TEXT NOT NULL,
+                    category2 TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    uses INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (scope, merchant, direction)
+                )"""
+            )
+
+    @staticmethod
+    def key_for(record):
+        """返回交易记录的记忆键 (商户摘要, 金额方向)，描述中没有可用商户名时返回 None"""
+        merchant = normalize_merchant(record.description)
+        if not merchant:
+            return None
+        return hashlib.sha256(merchant.encode()).hexdigest(), "+" if record.amount_cents > 0 else "-"
+
+    def _cutoff(self):
+        """仍然有效的记忆的最早写入时间"""
+        return time.time() - self.ttl_seconds if self.ttl_seconds else 0.0
+
+    def lookup(self, records, scope):
+        """
+        查找已知商户的分类
+        :param records: Transaction 记录列表
+        :param scope: 作用域，见 merchant_memo_scope
+        :return: {记录序号(从 1 开始): (类型, 一级分类, 二级分类, 标签)}
+        """
+        found = {}
+        cutoff = self._cutoff()
+        with self._lock:
+            for row_id, record in enumerate(records, 1):
+                key = self.key_for(record)
+                row = None
+                if key is not None:
+                    row = self._conn.execute(
+                        "SELECT txn_type, category1, category2, tags FROM scoped_merchants "
+                        "WHERE scope = ? AND merchant = ? AND direction = ? AND updated >= ?",
+                        (scope, *key, cutoff)
+                    ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                found[row_id] = tuple(row)
+                self._conn.execute(
+                    "UPDATE scoped_merchants SET uses = uses + 1 WHERE scope = ? AND merchant = ? AND direction = ?",
+                    (scope, *key)
+                )
+            self._conn.commit()
+        return found
+
+    def remember(self, entries, scope):
+        """
+        记录模型给出的分类，同时清除过期的记忆
+        :param entries: (Transaction 记录, (类型, 一级分类, 二级分类, 标签)) 的可迭代对象
+        :param scope: 作用域，见 merchant_memo_scope
+        """
+        rows = []
+        now = time.time()
+        for record, classification in entries:
+            key = self.key_for(record)
+            if key is not None:
+                rows.append((scope, *key, *classification, now))
+        if not rows:
+            return
+        with self._lock:
+            if self.ttl_seconds:
+                self._conn.execute("DELETE FROM scoped_merchants WHERE updated < ?", (self._cutoff(),))
+            self._conn.executemany(
+                """INSERT INTO scoped_merchants (scope, merchant, direction, txn_type, category1, category2, tags, updated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (scope, merchant, direction) DO UPDATE SET
+                       txn_type = excluded.txn_type, category1 = excluded.category1,
+                       category2 = excluded.category2, tags = excluded.tags, updated = excluded.updated""",
+                rows
+            )
+            self._conn.commit()
+            self.learned += len(rows)
+
+    def stats(self):
+        """返回命中统计：hit_rate 即免于发送给模型的记录比例"""
+        with self._lock:
+            merchants = self._conn.execute("SELECT COUNT(*) FROM scoped_merchants").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'learned': self.learned,
+            'merchants': merchants,
+        }
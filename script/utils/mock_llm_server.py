@@ -0,0 +1,509 @@
+"""
+本地 OpenAI 兼容替身服务器，用于离线压测和基准测试
+
+按请求中的交易记录返回确定的 iCost 行（完整模式）或分类结果（分类模式），
+可以配置首个 token 延迟、输出速度、错误率、漏行率和错误分类率。
+同时支持批量任务接口（/v1/files 和 /v1/batches），任务在 batch_seconds 秒后完成。
+
+启动（在 script 目录下）：
+    python -m utils.mock_llm_server --port 8765 --latency 0.5 --tokens-per-second 80 --error-rate 0.05
+然后在页面或控制器中选择模型 "local"（地址可用环境变量 LOCAL_LLM_BASE_URL 修改）。
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from models.transaction import Transaction, parse_cents
+from .icost_builder import build_icost_row, statement_year
+from .token_utils import estimate_tokens
+
+DEFAULT_PORT = 8765
+# 与 OpenAI 一致：前缀至少 1024 token 才会缓存，缓存长度按 128 token 取整
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+
+_CLASSIFY_LINE = re.compile(r'^(\d+)\|(\d{2}/\d{2}(?:/\d{2,4})?)\|([^|]*)\|(.*)$')
+_FULL_LINE = re.compile(r'^(\d{2}/\d{2}(?:/\d{2,4})?)\|([^|]*)\|([^|]*)(?:\|.*)?$')
+_HEADER_LINE = re.compile(r'^=== (.*) ===$')
+_FILE_NAME_LINE = re.compile(r'^文件名：(.*)$')
+_BATCH_PATH = re.compile(r'^/v1/batches/([^/]+)(/cancel)?$')
+_FILE_PATH = re.compile(r'^/v1/files/([^/]+)(/content)?$')
+
+# 按描述关键词确定的分类：(关键词, 类型, 一级分类)；类型与金额正负矛盾时忽略该规则
+_CATEGORY_RULES = (
+    (("PAYROLL", "SALARY", "DIRECT DEP"), "收入", "工资"),
+    (("INTEREST",), "收入", "利息"),
+    (("REFUND", "RETURN"), "收入", "退款"),
+    (("TRANSFER", "XFER", "AUTOPAY", "PAYMENT THANK YOU"), "转账", ""),
+    (("ZELLE", "VENMO"), "支出", "P2P"),
+    (("UBER", "LYFT", "SHELL", "CHEVRON", "PARKING"), "支出", "交通"),
+    (("STARBUCKS", "RESTAURANT", "CAFE", "PIZZA", "DOORDASH"), "支出", "餐饮"),
+    (("AMAZON", "TARGET", "WALMART", "COSTCO"), "支出", "购物"),
+    (("NETFLIX", "SPOTIFY", "APPLE.COM"), "支出", "订阅"),
+    (("TRADER JOE", "WHOLE FOODS", "SAFEWAY"), "支出", "杂货"),
+)
+_DEFAULT_EXPENSE_CATEGORIES = ("购物", "餐饮", "日用", "交通")
+# 模拟错误分类时使用的分类，不在任何分类选项中
+UNKNOWN_CATEGORY = "未知分类"
+
+
+def classify_description(description, amount_cents):
+    """
+    按描述关键词确定地给出分类，同样的输入总是得到同样的结果
+    :return: tuple (类型, 一级分类, 二级分类, 标签)
+    """
+    upper = description.upper()
+    for keywords, transaction_type, category1 in _CATEGORY_RULES:
+        if transaction_type == "收入" and amount_cents < 0 or transaction_type == "支出" and amount_cents > 0:
+            continue
+        if any(keyword in upper for keyword in keywords):
+            category2 = description.split()[0] if category1 == "订阅" and description.split() else ""
+            return transaction_type, category1, category2, ""
+    if amount_cents > 0:
+        return "收入", "其他", "", ""
+    index = zlib.crc32(upper.encode()) % len(_DEFAULT_EXPENSE_CATEGORIES)
+    return "支出", _DEFAULT_EXPENSE_CATEGORIES[index], "", ""
+
+
+def build_response_lines(user_prompt, keep_row=None, corrupt_row=None):
+    """
+    根据用户消息中的交易记录生成模型输出的各行
+    分类模式的输入行为 编号|日期|金额|描述，完整模式的输入行为 日期|金额|描述[|余额]
+    :param keep_row: 可选的函数，返回 False 时省略该行（模拟模型漏行）
+    :param corrupt_row: 可选的函数，返回 True 时把该行的一级分类换成不存在的分类（模拟较弱的模型）
+    """
+    lines = []
+    year = None
+    account = None
+    for line in user_prompt.split("\n"):
+        line = line.strip()
+        match = _FILE_NAME_LINE.match(line)
+        if match:
+            year = statement_year(match.group(1))
+            continue
+        match = _HEADER_LINE.match(line)
+        if match:
+            account = match.group(1)
+            continue
+        match = _CLASSIFY_LINE.match(line)
+        if match:
+            row_id, _, amount, description = match.groups()
+            classification = classify_description(description, parse_cents(amount))
+            if corrupt_row is not None and classification[0] != "转账" and corrupt_row():
+                classification = (classification[0], UNKNOWN_CATEGORY) + classification[2:]
+            row = f"{row_id}|{'|'.join(classification)}"
+        else:
+            match = _FULL_LINE.match(line)
+            if not match:
+                continue
+            date, amount, description = match.groups()
+            record = Transaction(date, parse_cents(amount), description, account=account)
+            classification = classify_description(description, record.amount_cents)
+            if corrupt_row is not None and classification[0] != "转账" and corrupt_row():
+                classification = (classification[0], UNKNOWN_CATEGORY) + classification[2:]
+            fields = build_icost_row(record, year or time.localtime().tm_year, "USD", *classification)
+            row = " | ".join(fields)
+        if keep_row is None or keep_row():
+            lines.append(row)
+    return lines
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """OpenAI 兼容的本地替身服务器"""
+    daemon_threads = True
+
+    def __init__(self, address, latency_seconds=0.0, tokens_per_second=None, error_rate=0.0,
+                 drop_rate=0.0, invalid_rate=0.0, batch_seconds=1.0, seed=0):
+        """
+        :param latency_seconds: 返回第一个 token 前的延迟（秒）
+        :param tokens_per_second: 输出速度，None 表示不限速
+        :param error_rate: 返回 429 或 500 错误的概率
+        :param drop_rate: 每行结果被省略的概率，用于测试对账补发
+        :param invalid_rate: 每行结果的一级分类被换成未知分类的概率，用于测试模型升级
+        :param batch_seconds: 批量任务从创建到完成的秒数
+        :param seed: 随机种子，相同种子得到相同的错误和漏行序列
+        """
+        super().__init__(address, MockLLMHandler)
+        self.latency_seconds = latency_seconds
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.invalid_rate = invalid_rate
+        self.batch_seconds = batch_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._prompt_prefixes = set()
+        self._ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+        self.stats = {'requests': 0, 'errors': 0, 'streamed': 0, 'prompt_tokens': 0,
+                      'cached_tokens': 0, 'completion_tokens': 0, 'dropped_rows': 0, 'invalid_rows': 0,
+                      'batch_jobs': 0, 'batch_requests': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def chance(self, probability):
+        """以给定概率返回 True（线程安全，按种子确定）"""
+        if probability <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < probability
+
+    def count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+    def cached_prefix_tokens(self, system_prompt):
+        """模拟服务商的提示缓存：相同的系统提示词第二次出现时，其长度按块取整计为缓存命中"""
+        digest = hashlib.sha256(system_prompt.encode()).digest()
+        with self._lock:
+            seen = digest in self._prompt_prefixes
+            self._prompt_prefixes.add(digest)
+        tokens = estimate_tokens(system_prompt)
+        if not seen or tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return tokens // PROMPT_CACHE_BLOCK_TOKENS * PROMPT_CACHE_BLOCK_TOKENS
+
+    def complete(self, request):
+        """
+        按 chat completions 请求生成结果（普通请求和批量任务共用），按配置漏行和使用未知分类
+        :return: tuple (结果各行, chat.completion 响应体)
+        """
+        messages = request.get("messages", [])
+        system_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") != "system")
+
+        def keep_row():
+            if self.chance(self.drop_rate):
+                self.count(dropped_rows=1)
+                return False
+            return True
+
+        def corrupt_row():
+            if self.chance(self.invalid_rate):
+                self.count(invalid_rows=1)
+                return True
+            return False
+
+        lines = build_response_lines(user_prompt, keep_row, corrupt_row)
+        content = "\n".join(lines)
+        prompt_tokens = estimate_tokens(system_prompt + user_prompt)
+        completion_tokens = estimate_tokens(content)
+        cached_tokens = self.cached_prefix_tokens(system_prompt)
+        self.count(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens, completion_tokens=completion_tokens)
+        return lines, {
+            "id": f"chatcmpl-mock-{zlib.crc32(user_prompt.encode()):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock-icost"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-mock-{next(self._ids)}"
+
+    def add_file(self, filename, purpose, content):
+        """保存上传或生成的文件，返回文件对象"""
+        file_object = {
+            "id": self.new_id("file"),
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self._lock:
+            self.files[file_object["id"]] = (file_object, content)
+        return file_object
+
+    def create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        """
+        创建批量任务：立即按输入文件逐行生成结果，任务在 batch_seconds 秒后才显示为完成
+        :return: 任务对象，输入文件不存在时返回 None
+        """
+        with self._lock:
+            entry = self.files.get(input_file_id)
+        if entry is None:
+            return None
+        outputs, errors = [], []
+        for index, line in enumerate(entry[1].decode().splitlines()):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            result = {"id": f"batch_req_{index}", "custom_id": item.get("custom_id"), "error": None}
+            self.count(batch_requests=1)
+            if self.chance(self.error_rate):
+                self.count(errors=1)
+                result["response"] = {"status_code": 500, "request_id": "",
+                                      "body": {"error": {"message": "Internal server error", "type": "server_error"}}}
+                errors.append(result)
+                continue
+            _, body = self.complete(item.get("body") or {})
+            result["response"] = {"status_code": 200, "request_id": "", "body": body}
+            outputs.append(result)
+        now = int(time.time())
+        batch = {
+            "id": self.new_id("batch"),
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": now,
+            "expires_at": now + 24 * 3600,
+            "completed_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": len(outputs) + len(errors), "completed": 0, "failed": 0},
+            "metadata": metadata,
+        }
+        self.count(batch_jobs=1)
+        with self._lock:
+            self.batches[batch["id"]] = {"batch": batch, "outputs": outputs, "errors": errors,
+                                         "ready_at": time.monotonic() + self.batch_seconds}
+        return dict(batch)
+
+    def batch_state(self, batch_id, cancel=False):
+        """返回任务的当前状态，到达完成时间时生成输出文件和错误文件；cancel 为 True 时取消未完成的任务"""
+        with self._lock:
+            job = self.batches.get(batch_id)
+        if job is None:
+            return None
+        batch = job["batch"]
+        if batch["status"] == "in_progress" and cancel:
+            batch.update(status="cancelled", cancelled_at=int(time.time()))
+        elif batch["status"] == "in_progress" and time.monotonic() >= job["ready_at"]:
+            for key, results in (("output_file_id", job["outputs"]), ("error_file_id", job["errors"])):
+                if results:
+                    content = "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+                    batch[key] = self.add_file(f"{batch_id}_{key}.jsonl", "batch_output", content.encode())["id"]
+            batch["request_counts"].update(completed=len(job["outputs"]), failed=len(job["errors"]))
+            batch.update(status="completed", completed_at=int(time.time()))
+        return dict(batch)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """处理 /v1/chat/completions、/v1/models、/v1/files、/v1/batches 和 /stats 请求"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _read_multipart(self):
+        """读取 multipart/form-data 请求体，返回 {字段名: (文件名, 内容)}"""
+        length = int(self.headers.get("Content-Length") or 0)
+        head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode()
+        message = BytesParser(policy=policy.HTTP).parsebytes(head + self.rfile.read(length))
+        return {
+            part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+            for part in message.iter_parts()
+        }
+
+    def _not_found(self, message=None):
+        self._send_json(404, {"error": {"message": message or f"Unknown path {self.path}",
+                                        "type": "invalid_request_error"}})
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        batch_match = _BATCH_PATH.match(path)
+        file_match = _FILE_PATH.match(path)
+        if batch_match and not batch_match.group(2):
+            batch = self.server.batch_state(batch_match.group(1))
+            if batch is None:
+                self._not_found(f"No batch with id {batch_match.group(1)}")
+            else:
+                self._send_json(200, batch)
+        elif file_match:
+            with self.server._lock:
+                entry = self.server.files.get(file_match.group(1))
+            if entry is None:
+                self._not_found(f"No file with id {file_match.group(1)}")
+            elif file_match.group(2):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(entry[1])))
+                self.end_headers()
+                self.wfile.write(entry[1])
+            else:
+                self._send_json(200, entry[0])
+        elif self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "mock-icost", "object": "model"}]})
+        elif self.path.rstrip("/") == "/stats":
+            with self.server._lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/v1/files":
+            fields = self._read_multipart()
+            filename, content = fields.get("file", (None, None))
+            if content is None:
+                self._send_json(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+                return
+            purpose = (fields.get("purpose") or (None, b""))[1].decode()
+            self._send_json(200, self.server.add_file(filename or "upload.jsonl", purpose, content))
+            return
+        if path == "/v1/batches":
+            request = self._read_json()
+            batch = self.server.create_batch(
+                request.get("input_file_id"), request.get("endpoint"),
+                request.get("completion_window"), request.get("metadata")
+            )
+            if batch is None:
+                self._not_found(f"No file with id {request.get('input_file_id')}")
+            else:
+                self._send_json(200, batch)
+            return
+        batch_match = _BATCH_PATH.match(path)
+        if batch_match and batch_match.group(2):
+            self._read_json()
+            batch = self.server.batch_state(batch_match.group(1), cancel=True)
+            if batch is None:
+                self._not_found(f"No batch with id {batch_match.group(1)}")
+            else:
+                self._send_json(200, batch)
+            return
+        if path != "/v1/chat/completions":
+            self._not_found()
+            return
+        server = self.server
+        request = self._read_json()
+        server.count(requests=1)
+        if server.chance(server.error_rate):
+            server.count(errors=1)
+            if server.chance(0.5):
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                                headers={"Retry-After": "0.1"})
+            else:
+                self._send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+            return
+
+        lines, body = server.complete(request)
+        usage = body["usage"]
+        completion_id = body["id"]
+        model = body["model"]
+        time.sleep(server.latency_seconds)
+
+        if not request.get("stream"):
+            if server.tokens_per_second:
+                time.sleep(usage["completion_tokens"] / server.tokens_per_second)
+            self._send_json(200, body)
+            return
+
+        # 流式响应：每行一个 chunk，按输出速度发送
+        server.count(streamed=1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(choices, chunk_usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices}
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            self.wfile.flush()
+
+        for index, line in enumerate(lines):
+            delta = line + ("\n" if index < len(lines) - 1 else "")
+            if server.tokens_per_second:
+                time.sleep(estimate_tokens(delta) / server.tokens_per_second)
+            send_chunk([{"index": 0, "delta": {"content": delta}, "finish_reason": None}])
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_chunk([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    """
+    在后台线程中启动替身服务器
+    :param port: 端口，0 表示自动分配
+    :param options: MockLLMServer 的配置参数
+    :return: MockLLMServer，base_url 属性为 API 地址，用完调用 shutdown()
+    """
+    server = MockLLMServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="返回第一个 token 前的延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="输出速度，默认不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 429/500 错误的概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="每行结果被省略的概率")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="每行结果使用未知分类的概率")
+    parser.add_argument("--batch-seconds", type=float, default=1.0, help="批量任务从创建到完成的秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    server = MockLLMServer(
+        (args.host, args.port),
+        latency_seconds=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        invalid_rate=args.invalid_rate,
+        batch_seconds=args.batch_seconds,
+        seed=args.seed,
+    )
+    print(f"本地替身服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+
+# 本地替身服务器的默认地址，见 utils/mock_llm_server.py
+DEFAULT_LOCAL_BASE_URL = "http://127.0.0.1:8765/v1"
+
+_backends = {}
+
+
+class ModelBackend:
+    """一个 OpenAI 兼容的模型后端
+
+    只要服务商兼容 OpenAI 的 chat completions 接口，指定 base_url 即可接入，
+    不需要为每个服务商单独编写调用代码。
+    """
+    def __init__(self, name, model, base_url=None, api_key=None, api_key_env=None,
+                 requests_per_minute=None, tokens_per_minute=None):
+        """
+        :param name: 后端名称，客户端池和请求调度器按名称区分后端
+        :param model: 请求中使用的模型名，如 "gpt-4o"、"deepseek-chat"
+        :param base_url: API 地址，None 表示 OpenAI 官方地址
+        :param api_key: 固定的 API key（如本地服务器），None 时使用页面输入的 key 或 api_key_env 环境变量
+        :param api_key_env: 读取 API key 的环境变量名
+        :param requests_per_minute: 该后端每分钟请求数上限，None 表示不限制
+        :param tokens_per_minute: 该后端每分钟 token 上限，None 表示不限制
+        """
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.api_key_env = api_key_env
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def __repr__(self):
+        return f"ModelBackend({self.name!r}, {self.model!r}, base_url={self.base_url!r})"
+
+
+def register_model_backend(alias, backend):
+    """
+    注册模型后端，页面和控制器通过别名（不区分大小写）选择后端
+    :param alias: 模型别名，如 "gpt-4o"
+    :param backend: ModelBackend
+    """
+    _backends[alias.lower()] = backend
+    return backend
+
+
+def get_model_backend(model):
+    """
+    按模型别名查找后端
+    :raises ValueError: 未注册的模型
+    """
+    backend = _backends.get(model.lower())
+    if backend is None:
+        raise ValueError(f"Unsupported model: {model}")
+    return backend
+
+
+def model_aliases():
+    """返回已注册的模型别名"""
+    return list(_backends)
+
+
+register_model_backend("gpt-4o", ModelBackend("openai", "gpt-4o"))
+register_model_backend("gpt-4o-mini", ModelBackend("openai", "gpt-4o-mini"))
+register_model_backend("deepseek-v3", ModelBackend(
+    "deepseek", "deepseek-chat", base_url="https://api.deepseek.com", api_key_env="DEEPSEEK_API_KEY"
+))
+register_model_backend("local", ModelBackend(
+    "local", "mock-icost", base_url=os.environ.get("LOCAL_LLM_BASE_URL", DEFAULT_LOCAL_BASE_URL), api_key="local"
+))
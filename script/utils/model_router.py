@@ -0,0 +1,176 @@
+import contextlib
+import threading
+from .ai_processor import EXPENSE_CATEGORIES, INCOME_CATEGORIES
+from .icost_builder import TRANSACTION_TYPES
+
+# 各银行类型的模型路由：按顺序尝试，未通过校验的记录升级到下一个模型。
+# "default" 用于没有单独配置的银行；路由只在选择的模型位于链中时生效，并截止到选择的模型。
+# 默认不路由，只使用选择的模型；需要时通过 AI_ROUTES 配置，例如 "default=gpt-4o-mini>gpt-4o"
+DEFAULT_MODEL_ROUTES = {}
+
+# 提示词中另外要求使用、但不在分类选项中的一级分类
+EXTRA_CATEGORIES = ("订阅", "信用卡还款")
+_KNOWN_CATEGORIES = {
+    "支出": set(EXPENSE_CATEGORIES) | set(EXTRA_CATEGORIES),
+    "收入": set(INCOME_CATEGORIES) | set(EXTRA_CATEGORIES),
+}
+
+
+def parse_model_routes(text):
+    """
+    解析模型路由配置
+    :param text: 如 "default=gpt-4o-mini>gpt-4o;AMEX=gpt-4o"；"off" 表示不路由，空值表示使用默认路由（不路由）
+    :return: {银行类型: (模型, ...)}，空值时返回 None
+    """
+    if not text or not text.strip():
+        return None
+    if text.strip().lower() == "off":
+        return {}
+    routes = {}
+    for entry in text.split(";"):
+        if not entry.strip():
+            continue
+        bank_type, _, chain = entry.partition("=")
+        bank_type = bank_type.strip()
+        models = tuple(model.strip().lower() for model in chain.split(">") if model.strip())
+        if not bank_type or not models:
+            raise ValueError(f"模型路由配置格式错误: {entry}")
+        routes["default" if bank_type.lower() == "default" else bank_type.upper()] = models
+    return routes
+
+
+def is_valid_classification(classification):
+    """
+    校验一条分类结果：类型必须合法，收入和支出的一级分类必须是已知分类
+    :param classification: (类型, 一级分类, 二级分类, 标签)
+    """
+    transaction_type, category1 = classification[0], classification[1]
+    if transaction_type not in TRANSACTION_TYPES:
+        return False
+    return transaction_type == "转账" or category1 in _KNOWN_CATEGORIES[transaction_type]
+
+
+def is_valid_icost_row(row):
+    """校验完整模式输出的一行 iCost 数据的类型和一级分类"""
+    return is_valid_classification((row[1], row[3]))
+
+
+class ModelStats:
+    """按模型累计的调用统计：请求数、延迟、token 用量、通过校验的比例和升级情况"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self.escalations = 0
+
+    def _stats_for(self, model):
+        stats = self._models.get(model)
+        if stats is None:
+            stats = {
+                'requests': 0,
+                'failures': 0,
+                'seconds': 0.0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'rows_sent': 0,
+                'rows_accepted': 0,
+                'escalated_rows': 0,
+            }
+            self._models[model] = stats
+        return stats
+
+    def record_call(self, model, seconds, usage, ok):
+        """记录一次模型调用的耗时和 token 用量"""
+        with self._lock:
+            stats = self._stats_for(model.lower())
+            stats['requests'] += 1
+            stats['failures'] += 0 if ok else 1
+            stats['seconds'] += seconds
+            stats['input_tokens'] += getattr(usage, 'prompt_tokens', None) or 0
+            stats['output_tokens'] += getattr(usage, 'completion_tokens', None) or 0
+
+    def record_rows(self, model, sent, accepted):
+        """记录发送给模型的记录数和其中通过校验的记录数"""
+        with self._lock:
+            stats = self._stats_for(model.lower())
+            stats['rows_sent'] += sent
+            stats['rows_accepted'] += accepted
+
+    def record_escalation(self, from_model, to_model, rows):
+        """记录一次升级：from_model 未通过校验的 rows 条记录交给 to_model 重新处理"""
+        with self._lock:
+            self._stats_for(from_model.lower())['escalated_rows'] += rows
+            self._stats_for(to_model.lower())
+            self.escalations += 1
+
+    def snapshot(self):
+        """返回各模型的统计：平均延迟、token 用量、通过校验比例和升级的记录数"""
+        with self._lock:
+            models = {model: dict(stats) for model, stats in self._models.items()}
+            escalations = self.escalations
+        for stats in models.values():
+            stats['avg_latency_seconds'] = stats['seconds'] / stats['requests'] if stats['requests'] else 0.0
+            stats['acceptance_rate'] = stats['rows_accepted'] / stats['rows_sent'] if stats['rows_sent'] else 0.0
+        return {'models': models, 'escalations': escalations}
+
+
+class ModelRouter:
+    """按成本和速度选择模型的路由器
+
+    配置了路由的银行，批次先交给便宜、快速的模型处理，格式错误、缺失、类型或分类未知的记录才升级到更强的模型。
+    统计在控制器的整个生命周期内累计；用 collecting 可以把当前线程的调用同时记录到单个文件的统计中。
+    """
+    def __init__(self, routes=None):
+        """
+        :param routes: {银行类型: (模型, ...)}，None 使用 DEFAULT_MODEL_ROUTES（不路由）
+        """
+        self.routes = DEFAULT_MODEL_ROUTES if routes is None else routes
+        self.totals = ModelStats()
+        self._local = threading.local()
+
+    def route_for(self, bank_type, model):
+        """
+        返回处理该银行账单时依次使用的模型
+        :param bank_type: 银行类型
+        :param model: 页面选择的模型，路由截止到该模型；不在路由中时只使用该模型
+        """
+        model = model.lower()
+        chain = self.routes.get(bank_type) or self.routes.get("default")
+        if not chain or model not in chain:
+            return (model,)
+        return tuple(chain[:chain.index(model) + 1])
+
+    @contextlib.contextmanager
+    def collecting(self, stats):
+        """
+        在 with 块内把当前线程记录的调用同时计入 stats（ModelStats），用于按文件统计
+        :param stats: ModelStats，None 时只计入累计统计
+        """
+        previous = getattr(self._local, 'stats', None)
+        self._local.stats = stats
+        try:
+            yield stats
+        finally:
+            self._local.stats = previous
+
+    def _targets(self):
+        stats = getattr(self._local, 'stats', None)
+        return (self.totals,) if stats is None else (self.totals, stats)
+
+    def record_call(self, model, seconds, usage, ok):
+        """记录一次模型调用的耗时和 token 用量（由 AIProcessor 调用）"""
+        for target in self._targets():
+            target.record_call(model, seconds, usage, ok)
+
+    def record_rows(self, model, sent, accepted):
+        """记录发送给模型的记录数和其中通过校验的记录数"""
+        for target in self._targets():
+            target.record_rows(model, sent, accepted)
+
+    def record_escalation(self, from_model, to_model, rows):
+        """记录一次升级：from_model 未通过校验的 rows 条记录交给 to_model 重新处理"""
+        for target in self._targets():
+            target.record_escalation(from_model, to_model, rows)
+
+    def stats(self):
+        """返回控制器生命周期内累计的各模型统计，见 ModelStats.snapshot"""
+        return self.totals.snapshot()
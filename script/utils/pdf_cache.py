@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import os
+from .disk_cache import DiskLRUCache
+from .shared_registry import get_or_create
+
+# 缓存格式版本，提取逻辑变化导致输出不同时需要递增，使旧条目自然失效
+PDF_CACHE_VERSION = 1
+DEFAULT_PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+def get_pdf_text_cache(cache_dir, max_bytes=DEFAULT_PDF_CACHE_MAX_BYTES):
+    """
+    获取进程内共享的 PDF 文本缓存实例，同一目录只创建一次，命中统计在多次页面重跑间累计
+    :param cache_dir: 缓存目录
+    :param max_bytes: 缓存总大小上限（字节），与已有实例不同时抛出 ValueError
+    """
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    return get_or_create("pdf_text_cache", cache_dir, PDFTextCache, cache_dir=cache_dir, max_bytes=max_bytes)
+
+
+class PDFTextCache(DiskLRUCache):
+    """按 PDF 内容和提取参数寻址的提取文本缓存
+
+    每个条目是 gzip 压缩的 JSON Lines 文件，每行是一页的提取结果。
+    提前停止读取的提取（例如清理阶段遇到结束标记）会保存为部分条目，
+    下次命中时先回放已缓存的页面，再从断点继续提取。
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_PDF_CACHE_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes, suffix=".pages.gz")
+        self.partial_hits = 0
+
+    def make_key(self, source, settings, backend):
+        """
+        根据 PDF 字节内容、提取参数和后端计算缓存键
+        :param source: PDF 文件路径或字节内容
+        :param settings: 完整的文本提取参数字典
+        :param backend: 提取后端名称
+        """
+        hasher = hashlib.sha256()
+        hasher.update(f"v{PDF_CACHE_VERSION}\0{backend}\0".encode())
+        hasher.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        hasher.update(b"\0")
+        if isinstance(source, bytes):
+            hasher.update(source)
+        else:
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+        return hasher.hexdigest()
+
+    def partial_key(self, key):
+        """返回部分条目的缓存键"""
+        return key + "-partial"
+
+    def find_partial(self, key):
+        """查找部分条目并刷新其最近使用时间，命中时计入 partial_hits"""
+        path = self.path_for(self.partial_key(key))
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            return None
+        self._count("partial_hits")
+        return path
+
+    def stats(self):
+        """返回缓存统计，额外包含部分条目命中次数"""
+        stats = super().stats()
+        stats['partial_hits'] = self.partial_hits
+        return stats
+
+    def read_pages(self, path):
+        """逐页读取缓存条目"""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def open_writer(self, key):
+        """创建写入新条目的写入器"""
+        return PageCacheWriter(self, key)
+
+
+class PageCacheWriter:
+    """逐页写入缓存条目，完成后提交为完整条目或部分条目"""
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.pages = 0
+        self.temp_path = cache.temp_path_for(key)
+        self._file = gzip.open(self.temp_path, 'wt', encoding='utf-8')
+
+    def write(self, page_text):
+        """写入一页提取结果"""
+        self._file.write(json.dumps(page_text, ensure_ascii=False) + "\n")
+        self.pages += 1
+
+    def finish(self, complete, min_pages=0):
+        """
+        提交条目
+        :param complete: 是否已提取全部页面；否则保存为部分条目
+        :param min_pages: 部分条目至少要超过的页数，避免用更短的进度覆盖已有条目
+        """
+        self._file.close()
+        if complete:
+            self.cache.commit(self.key, self.temp_path)
+            self.cache.remove(self.cache.partial_key(self.key))
+        elif self.pages > min_pages:
+            self.cache.commit(self.cache.partial_key(self.key), self.temp_path)
+        else:
+            self.cache.discard(self.temp_path)
+
+    def abort(self):
+        """放弃写入"""
+        self._file.close()
+        self.cache.discard(self.temp_path)
@@ -1,561 +1,600 @@
+import contextlib
+import gc
+import io
+import multiprocessing
+import os
 import pdfplumber
-import re
+import pypdfium2 as pdfium
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from pdfplumber.table import TableFinder, TableSettings
+from pdfplumber.utils import chars_to_textmap
+from .bank_detector import detect_bank, DETECTION_WINDOW_CHARS
+from .bank_profiles import STATEMENT_CLEANERS, STATEMENT_PROFILES
+from .shared_registry import get_or_create
+
+try:
+    import psutil
+except ImportError:  # 可选依赖，只在没有 /proc 的平台上用于读取当前常驻内存
+    psutil = None
+
+# 页数少于该值时不启用进程池，进程启动和重复打开 PDF 的开销会超过并行收益
+PARALLEL_MIN_PAGES = 8
+# 并行提取时每个进程任务处理的最大页数，限制在途结果占用的内存
+PARALLEL_CHUNK_PAGES = 8
+# 可选的文本提取后端：pdfium 为原生文本层快速路径，pdfplumber 保留表格/列对齐启发式
+PDF_BACKENDS = ("pdfplumber", "pdfium")
+
+# backend="auto" 时各银行使用的提取后端；清理规则是按 pdfplumber 的输出调校的，
+# 只有确认 pdfium 输出能得到相同清理结果的银行才应切换到 pdfium。
+# 目前没有银行通过这项核对：pdfium 不输出表格行，样例 Chase 信用卡账单还会少一条交易，
+# 所以应用不使用 pdfium，它只在显式传入 backend="pdfium"（或在这里登记银行）时启用
+BANK_PDF_BACKENDS = {
+    "CHASE": "pdfplumber",
+    "BOFA": "pdfplumber",
+    "AMEX": "pdfplumber",
+}
+
+# pdfium 单页文本中不可识别字符的最大占比，超过时该页回退到 pdfplumber
+PDFIUM_MAX_BAD_CHAR_RATIO = 0.01
+
+# 各银行/账户类型账单正文结束后的标记（小写），取自清理配置的 stop_markers：
+# 清理遇到后直接停止，提取也在该页之后停止，不再解析后面的披露和法律条款页面。
+# 只收录无条件终止清理的标记，只在特定段落内生效的标记（如 Chase 的 overdraft 标记）
+# 由清理停止消费来结束提取
+STATEMENT_STOP_MARKERS = {
+    key: tuple(marker.lower() for marker in profile.get('stop_markers', ()))
+    for key, profile in STATEMENT_PROFILES.items()
+}
+
+DEFAULT_EXTRACTION_SETTINGS = {
+    # 水平和垂直文本合并的容差值
+    'x_tolerance': 1,     # 减小水平容差，避免错误合并相邻列
+    'y_tolerance': 3,     # 保持垂直容差，以正确识别行间距
+
+    # 文本流参数
+    'use_text_flow': False,  # 关闭文本流模式，因为账单有固定的列结构
+    'horizontal_ltr': True,   # 保持从左到右的阅读顺序
+    'vertical_ttb': True,     # 保持从上到下的阅读顺序
+
+    # 文本处理参数
+    'keep_blank_chars': True,  # 保留空白字符，避免丢失格式
+    'strip_text': False,       # 不去除首尾空白，保持原始格式
+
+    # 表格参数
+    'snap_tolerance': 3,       # 表格对齐容差
+    'join_tolerance': 3,       # 表格单元格合并容差
+    'edge_min_length': 3,      # 最小边缘长度
+    'min_words_vertical': 3    # 垂直文本最小字数
+}
+
+# 表格检测沿用 page.extract_tables() 的默认参数，settings 只作用于文本流
+TABLE_SETTINGS = TableSettings.resolve(None)
+
+def get_extraction_pool(workers):
+    """
+    获取进程内共享的 PDF 提取进程池，所有文件、会话和页面重跑共用，不必每个文件重新启动进程
+    子进程以 spawn 方式启动：Streamlit 进程中有多个线程，fork 可能复制其他线程持有的锁导致子进程死锁
+    :param workers: 进程数
+    """
+    return get_or_create("pdf_extraction_pool", workers, _create_extraction_pool, workers=workers)
+
+def _create_extraction_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
 
-def extract_text_from_pdf(file_path, settings=None):
+def extract_text_from_pdf(file_path, settings=None, workers=1, min_parallel_pages=PARALLEL_MIN_PAGES,
+                          backend="pdfplumber", cache=None, stop_markers=None, max_rss_mb=None, stats=None,
+                          pool=None):
     """从 PDF 文件中提取文本内容
     
     Args:
-        file_path: PDF 文件路径
+        file_path: PDF 文件路径或上传的文件对象
         settings: 文本提取参数字典
+        workers: 并行提取的进程数，1 表示串行，None 表示使用全部 CPU
+        min_parallel_pages: 启用并行提取的最少页数，页数更少时回退到串行
+        backend: 提取后端，"pdfplumber"、"pdfium" 或按银行选择的 "auto"
+        cache: 可选的 PDFTextCache，命中时跳过 PDF 解析
+        stop_markers: 可选的 {(银行类型, 账户类型): 结束标记} 字典，如 STATEMENT_STOP_MARKERS
+        max_rss_mb: 可选的常驻内存上限（MB），按整个进程计算而不是单个文件
+        stats: 可选的字典，提取结束后写入页数和峰值内存
+        pool: 可选的共享进程池（见 get_extraction_pool），并行提取时使用
     """
-    extracted_text = ""
+    return "".join(iter_pdf_pages(file_path, settings, workers=workers, min_parallel_pages=min_parallel_pages,
+                                  backend=backend, cache=cache, stop_markers=stop_markers,
+                                  max_rss_mb=max_rss_mb, stats=stats, pool=pool))
+
+def iter_pdf_pages(file_path, settings=None, workers=1, min_parallel_pages=PARALLEL_MIN_PAGES,
+                   backend="pdfplumber", cache=None, stop_markers=None, max_rss_mb=None, stats=None,
+                   pool=None):
+    """逐页生成 PDF 提取结果（页面文本加表格行），峰值内存只与单页相关
     
-    default_settings = {
-        # 水平和垂直文本合并的容差值
-        'x_tolerance': 1,     # 减小水平容差，避免错误合并相邻列
-        'y_tolerance': 3,     # 保持垂直容差，以正确识别行间距
-        
-        # 文本流参数
-        'use_text_flow': False,  # 关闭文本流模式，因为账单有固定的列结构
-        'horizontal_ltr': True,   # 保持从左到右的阅读顺序
-        'vertical_ttb': True,     # 保持从上到下的阅读顺序
-        
-        # 文本处理参数
-        'keep_blank_chars': True,  # 保留空白字符，避免丢失格式
-        'strip_text': False,       # 不去除首尾空白，保持原始格式
+    Args:
+        file_path: PDF 文件路径或上传的文件对象
+        settings: 文本提取参数字典
+        workers: 并行提取的进程数，1 表示串行，None 表示使用全部 CPU（仅 pdfplumber 后端）
+        min_parallel_pages: 启用并行提取的最少页数，页数更少时回退到串行
+        backend: 提取后端，"pdfplumber"、"pdfium" 或按银行选择的 "auto"
+        cache: 可选的 PDFTextCache，按 PDF 内容和提取参数缓存每页结果
+        stop_markers: 可选的 {(银行类型, 账户类型): 结束标记} 字典，如 STATEMENT_STOP_MARKERS。
+            根据首页识别银行后，产出包含结束标记的页面即停止提取
+        max_rss_mb: 可选的常驻内存上限（MB）。每页处理后检查，
+            回收后仍超过上限时抛出 MemoryError；并行提取时同样约束每个子进程。
+            上限针对整个进程（在 Streamlit 中即整个服务进程，包括其他会话），不是单个文件的增量；
+            无法读取当前常驻内存的平台上只提示一次，不做限制
+        stats: 可选的字典，提取结束后写入 'pages' 和 'peak_rss_mb'（含子进程，无法读取时为 None）
+        pool: 可选的共享进程池（见 get_extraction_pool），并行提取时使用且不关闭；
+            不提供时每次并行提取临时创建一个进程池
         
-        # 表格参数
-        'snap_tolerance': 3,       # 表格对齐容差
-        'join_tolerance': 3,       # 表格单元格合并容差
-        'edge_min_length': 3,      # 最小边缘长度
-        'min_words_vertical': 3    # 垂直文本最小字数
-    }
+    Yields:
+        str: 每页的文本块，以换行符结尾
+    """
+    extraction_settings = dict(DEFAULT_EXTRACTION_SETTINGS)
     
     # 如果提供了自定义设置，更新默认值
     if settings:
-        default_settings.update(settings)
-    
+        extraction_settings.update(settings)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    guard = MemoryGuard(max_rss_mb)
+    page_total = 0
     try:
-        with pdfplumber.open(file_path) as pdf:
-            print(f"\n总页数: {len(pdf.pages)}")
-            
-            for i, page in enumerate(pdf.pages, 1):
-                print(f"\n处理第 {i} 页...")
-                
-                # 使用设置参数提取文本
-                page_text = page.extract_text(**default_settings) or ""
-                print(f"提取到 {len(page_text)} 个字符")
-                
-                # 提取表格
-                tables = page.extract_tables()
-                print(f"发现 {len(tables)} 个表格")
-                
-                # 合并页面文本
-                extracted_text += page_text + "\n"
-                
-                # 处理表格内容
-                for table in tables:
-                    for row in table:
-                        # 过滤掉空值并合并行数据
-                        row_text = ', '.join(str(cell).strip() for cell in row if cell is not None)
-                        if row_text:
-                            extracted_text += row_text + '\n'
-                
+        if cache is None:
+            pages = _iter_pdf_pages(file_path, extraction_settings, workers, min_parallel_pages, backend,
+                                    guard=guard, pool=pool)
+        else:
+            pages = _iter_pdf_pages_cached(cache, file_path, extraction_settings, workers,
+                                           min_parallel_pages, backend, guard, pool)
+        if stop_markers is not None:
+            pages = _stop_at_markers(pages, stop_markers)
+        try:
+            for page_text in pages:
+                page_total += 1
+                guard.check()
+                yield page_text
+        finally:
+            pages.close()
     except Exception as e:
         print(f"处理 PDF 时出错: {str(e)}")
         raise
+    finally:
+        guard.check(enforce=False)
+        if guard.peak_mb is None:
+            print(f"提取 {page_total} 页")
+        else:
+            print(f"提取 {page_total} 页，峰值内存 {guard.peak_mb:.1f} MB")
+        if stats is not None:
+            stats['pages'] = page_total
+            stats['peak_rss_mb'] = guard.peak_mb
+
+def iter_pdf_lines(file_path, settings=None, workers=1, min_parallel_pages=PARALLEL_MIN_PAGES,
+                   backend="pdfplumber", cache=None, stop_markers=None, max_rss_mb=None, stats=None):
+    """逐行生成 PDF 文本，结果与 extract_text_from_pdf(...).split('\\n') 一致"""
+    return iter_text_lines(iter_pdf_pages(file_path, settings, workers=workers, min_parallel_pages=min_parallel_pages,
+                                          backend=backend, cache=cache, stop_markers=stop_markers,
+                                          max_rss_mb=max_rss_mb, stats=stats))
+
+def iter_text_lines(chunks):
+    """把文本块流拆分为行，跨文本块的行会被正确拼接"""
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        yield from lines
+    yield pending
+
+def _stop_at_markers(pages, stop_markers):
+    """产出页面直到出现当前银行的结束标记，随后关闭底层提取（取消未完成的解析任务）"""
+    markers = None
+    try:
+        for page_number, page_text in enumerate(pages, 1):
+            yield page_text
+            if markers is None and page_text.strip():
+                bank_type, account_type, _ = detect_bank(page_text)
+                markers = _lookup_by_account(stop_markers, bank_type, account_type) or ()
+            if markers and any(marker in page_text.lower() for marker in markers):
+                print(f"第 {page_number} 页出现账单结束标记，停止提取后续页面")
+                return
+    finally:
+        pages.close()
+
+class MemoryGuard:
+    """记录进程常驻内存峰值，并在超过上限时先回收再报错
+
+    采样的是整个进程的常驻内存：在 Streamlit 中包含服务进程里其他会话和缓存占用的内存。
+    无法读取当前常驻内存时（没有 /proc 且未安装 psutil）不做限制，只提示一次；
+    不使用 ru_maxrss 代替，它是进程生命周期内的历史峰值，超过上限后每次提取都会失败。
+    """
+    def __init__(self, max_rss_mb=None):
+        self.max_rss_mb = max_rss_mb
+        self.peak_mb = None
+
+    def check(self, enforce=True):
+        """采样当前常驻内存；超过上限且回收后仍超过时抛出 MemoryError"""
+        rss_mb = current_rss_mb()
+        self.record(rss_mb)
+        if not enforce or not self.max_rss_mb:
+            return
+        if rss_mb is None:
+            _warn_rss_unavailable(self.max_rss_mb)
+            return
+        if rss_mb <= self.max_rss_mb:
+            return
+        gc.collect()
+        rss_mb = current_rss_mb()
+        if rss_mb > self.max_rss_mb:
+            raise MemoryError(f"进程常驻内存 {rss_mb:.1f} MB 超过 PDF 提取上限 {self.max_rss_mb} MB")
+
+    def record(self, rss_mb):
+        """合并一个外部采样（例如子进程报告的峰值），None 表示没有读数"""
+        if rss_mb is not None:
+            self.peak_mb = rss_mb if self.peak_mb is None else max(self.peak_mb, rss_mb)
+
+_rss_warning_shown = False
+
+def _warn_rss_unavailable(max_rss_mb):
+    """无法读取当前常驻内存时每个进程只提示一次"""
+    global _rss_warning_shown
+    if not _rss_warning_shown:
+        _rss_warning_shown = True
+        print(f"无法读取当前进程的常驻内存（需要 /proc 或安装 psutil），内存上限 {max_rss_mb} MB 不生效")
+
+def current_rss_mb():
+    """返回当前进程的常驻内存（MB），无法获取时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def _iter_pdf_pages(file_path, settings, workers, min_parallel_pages, backend, start_page=0, guard=None, pool=None):
+    """按后端和并行设置逐页提取，从 start_page（从 0 开始）开始"""
+    if backend == "auto" and "pdfium" not in BANK_PDF_BACKENDS.values():
+        # 没有银行切换到 pdfium 时不需要为选择后端单独解析首页
+        backend = "pdfplumber"
+    if backend == "auto":
+        bank_type = _detect_first_page_bank(file_path)
+        backend = BANK_PDF_BACKENDS.get(bank_type, "pdfplumber")
+        print(f"识别为 {bank_type} 账单，使用 {backend} 提取文本")
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"Unsupported PDF backend: {backend}")
+
+    if backend == "pdfium":
+        yield from _iter_pages_pdfium(file_path, settings, start_page)
+        return
+
+    with _open_pdf(file_path) as pdf:
+        page_count = len(pdf.pages)
+        print(f"\n总页数: {page_count}")
+
+        parallel = workers > 1 and page_count - start_page >= min_parallel_pages
+        if not parallel:
+            for i in range(start_page, page_count):
+                yield _extract_page_text(pdf.pages[i], i + 1, settings)
+
+    if parallel:
+        yield from _iter_pages_parallel(file_path, page_count, settings, workers, start_page, guard, pool)
+
+def _iter_pdf_pages_cached(cache, file_path, settings, workers, min_parallel_pages, backend, guard=None, pool=None):
+    """带缓存的逐页提取：完整命中时直接回放，部分命中时回放后从断点继续提取"""
+    source = _read_pdf_source(file_path)
+    key = cache.make_key(source, settings, backend)
+
+    path = cache.lookup(key)
+    if path is not None:
+        print("命中 PDF 文本缓存，跳过 PDF 解析")
+        yield from cache.read_pages(path)
+        return
+
+    writer = cache.open_writer(key)
+    replayed = 0
+    try:
+        partial_path = cache.find_partial(key)
+        if partial_path is not None:
+            for page_text in cache.read_pages(partial_path):
+                writer.write(page_text)
+                replayed += 1
+                yield page_text
+            print(f"PDF 文本缓存中已有前 {replayed} 页，继续提取剩余页面")
+
+        for page_text in _iter_pdf_pages(source, settings, workers, min_parallel_pages, backend, replayed,
+                                         guard, pool):
+            writer.write(page_text)
+            yield page_text
+    except GeneratorExit:
+        # 消费者提前停止读取（例如遇到账单结束标记），保留已提取的页面供下次续用
+        writer.finish(complete=False, min_pages=replayed)
+        raise
+    except BaseException:
+        writer.abort()
+        raise
+    writer.finish(complete=True)
+
+def benchmark_pdf_backends(file_path, backends=PDF_BACKENDS, settings=None):
+    """对同一份 PDF 依次运行各提取后端，并排输出吞吐量
+    
+    Args:
+        file_path: PDF 文件路径或上传的文件对象
+        backends: 需要对比的后端名称
+        settings: 文本提取参数字典
         
-    return extracted_text
+    Returns:
+        dict: 后端名称 -> {'pages', 'chars', 'seconds', 'pages_per_second'}
+    """
+    source = _read_pdf_source(file_path)
+    results = {}
+    for backend in backends:
+        start = time.perf_counter()
+        pages = 0
+        chars = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for page_text in iter_pdf_pages(source, settings, backend=backend):
+                pages += 1
+                chars += len(page_text)
+        seconds = time.perf_counter() - start
+        results[backend] = {
+            'pages': pages,
+            'chars': chars,
+            'seconds': seconds,
+            'pages_per_second': pages / seconds if seconds else float('inf'),
+        }
+
+    print(f"\n{'后端':<12}{'页数':>8}{'字符数':>10}{'耗时(s)':>10}{'页/秒':>10}")
+    for backend, result in results.items():
+        print(f"{backend:<12}{result['pages']:>8}{result['chars']:>10}"
+              f"{result['seconds']:>10.3f}{result['pages_per_second']:>10.1f}")
+    return results
+
+def _detect_first_page_bank(file_path):
+    """用 pdfium 快速读取首页文本层识别银行类型"""
+    pdf = pdfium.PdfDocument(_read_pdf_source(file_path))
+    try:
+        first_page_text = _pdfium_page_text(pdf, 0) if len(pdf) else ""
+    finally:
+        pdf.close()
+    bank_type, _, _ = detect_bank(first_page_text)
+    return bank_type
+
+def _pdfium_page_text(pdf, index):
+    """读取 pdfium 文档单页的文本层，统一为 \\n 换行"""
+    page = pdf[index]
+    try:
+        textpage = page.get_textpage()
+        try:
+            text = textpage.get_text_bounded()
+        finally:
+            textpage.close()
+    finally:
+        page.close()
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def _pdfium_text_ok(text):
+    """检查 pdfium 文本质量：必须有内容，且不可识别字符占比足够低"""
+    if not text.strip():
+        return False
+    bad_chars = sum(1 for char in text if char == '\ufffd' or (char < ' ' and char not in '\n\t'))
+    return bad_chars / len(text) <= PDFIUM_MAX_BAD_CHAR_RATIO
+
+def _iter_pages_pdfium(file_path, settings, start_page=0):
+    """使用 pdfium 原生文本层逐页提取，质量检查未通过的页面回退到 pdfplumber"""
+    source = _read_pdf_source(file_path)
+    pdf = pdfium.PdfDocument(source)
+    fallback_pdf = None
+    try:
+        page_count = len(pdf)
+        print(f"\n总页数: {page_count} (pdfium)")
+        for index in range(start_page, page_count):
+            page_text = _pdfium_page_text(pdf, index)
+            if _pdfium_text_ok(page_text):
+                print(f"\n处理第 {index + 1} 页...")
+                print(f"提取到 {len(page_text)} 个字符")
+                yield page_text + "\n"
+                continue
 
-def replace_transaction_detail_markers(text):
-    '''处理CHASE SAVING 和 CHASE CHECKING 中交易明细标记'''
+            print(f"第 {index + 1} 页 pdfium 文本质量检查未通过，回退到 pdfplumber")
+            if fallback_pdf is None:
+                fallback_pdf = _open_pdf(source)
+            yield _extract_page_text(fallback_pdf.pages[index], index + 1, settings)
+    finally:
+        pdf.close()
+        if fallback_pdf is not None:
+            fallback_pdf.close()
 
-    """替换文本中的 *end*transacXtion detail 标记为其中包含的数字"""
-    # 找到所有匹配的模式
-    matches = re.finditer(r'\*end\*transac(\d)tion detail', text.lower())
+def _extract_page_text(page, page_number, settings):
+    """提取单页的文本和表格内容，串行与并行路径共用以保证输出一致"""
+    print(f"\n处理第 {page_number} 页...")
+
+    try:
+        # 文本和表格来自同一次版面解析
+        page_text, tables = _extract_page_layout(page, settings)
+    finally:
+        # 释放本页的版面对象和字符缓存，长账单的内存不会随页数增长
+        page.close()
+    print(f"提取到 {len(page_text)} 个字符")
+    print(f"发现 {len(tables)} 个表格")
     
-    # 创建一个列表存储位置和数字
-    replacements = [(match.start(), match.end(), match.group(1)) for match in matches]
+    # 合并页面文本
+    parts = [page_text, "\n"]
     
-    # 从后向前替换每个匹配项
-    for start, end, digit in reversed(replacements):
-        text = text[:start] + digit + text[end:]
+    # 处理表格内容
+    for table in tables:
+        for row in table:
+            # 过滤掉空值并合并行数据
+            row_text = ', '.join(str(cell).strip() for cell in row if cell is not None)
+            if row_text:
+                parts.append(row_text + '\n')
+
+    return "".join(parts)
+
+def _extract_page_layout(page, settings):
+    """对单页只构建一次字符/线条层，并从中同时推导文本流和表格行
     
-    return text
+    文本参数与 page.extract_text(**settings) 的含义一致，
+    表格与 page.extract_tables() 的结果一致。
+    """
+    # 字符和线条都来自同一份 page.objects，pdfminer 只解析一次
+    chars = page.chars
+    edges = page.edges
+
+    textmap_settings = {'layout_bbox': page.bbox}
+    if 'layout_width_chars' not in settings:
+        textmap_settings['layout_width'] = page.width
+    if 'layout_height_chars' not in settings:
+        textmap_settings['layout_height'] = page.height
+    textmap_settings.update(settings)
+    page_text = chars_to_textmap(chars, **textmap_settings).as_string
+
+    # 默认的 lines 策略只依赖线条边缘，没有边缘的页面不会有表格，跳过表格检测
+    if not edges:
+        return page_text, []
+
+    finder = TableFinder(page, TABLE_SETTINGS)
+    tables = [table.extract(**(TABLE_SETTINGS.text_settings or {})) for table in finder.tables]
+    return page_text, tables
+
+def _read_pdf_source(file_path):
+    """将文件路径或上传的文件对象转换为子进程可以独立打开的数据源"""
+    if isinstance(file_path, (str, os.PathLike)):
+        return os.fspath(file_path)
+    if isinstance(file_path, bytes):
+        return file_path
+    if hasattr(file_path, 'getvalue'):
+        return file_path.getvalue()
+    file_path.seek(0)
+    data = file_path.read()
+    file_path.seek(0)
+    return data
+
+def _open_pdf(source):
+    """用 pdfplumber 打开路径、文件对象或字节形式的 PDF"""
+    if isinstance(source, bytes):
+        return pdfplumber.open(io.BytesIO(source))
+    return pdfplumber.open(source)
+
+def _extract_page_range(source, start, end, settings, max_rss_mb=None):
+    """子进程入口：独立打开 PDF 并提取 [start, end) 范围内的页面
+    
+    Returns:
+        tuple: (各页文本列表, 子进程峰值内存 MB)
+    """
+    guard = MemoryGuard(max_rss_mb)
+    page_texts = []
+    with _open_pdf(source) as pdf:
+        for i in range(start, end):
+            page_texts.append(_extract_page_text(pdf.pages[i], i + 1, settings))
+            guard.check()
+    return page_texts, guard.peak_mb
+
+def _iter_pages_parallel(file_path, page_count, settings, workers, start_page=0, guard=None, pool=None):
+    """把页面范围分发到进程池，并按页码顺序逐页产出结果
+    
+    同时在途的任务数受限，消费者停止读取时未开始的任务会被取消。
+    使用共享进程池时不关闭进程池，只取消本次提交的任务。
+    """
+    source = _read_pdf_source(file_path)
+    max_rss_mb = guard.max_rss_mb if guard is not None else None
+    remaining = page_count - start_page
+    workers = min(workers, remaining)
+    chunk_size = max(1, min(-(-remaining // workers), PARALLEL_CHUNK_PAGES))
+    ranges = iter([(start, min(start + chunk_size, page_count)) for start in range(start_page, page_count, chunk_size)])
+    print(f"使用 {workers} 个进程并行提取，每个任务 {chunk_size} 页")
+
+    executor = pool if pool is not None else _create_extraction_pool(workers)
+    wait = True
+    pending = deque()
+    try:
+        pending.extend(
+            executor.submit(_extract_page_range, source, start, end, settings, max_rss_mb)
+            for start, end in islice(ranges, workers * 2)
+        )
+        while pending:
+            # 按提交顺序取结果，保证与串行路径的页序一致
+            chunk, worker_peak_mb = pending.popleft().result()
+            if guard is not None:
+                guard.record(worker_peak_mb)
+            for start, end in islice(ranges, 1):
+                pending.append(executor.submit(_extract_page_range, source, start, end, settings, max_rss_mb))
+            yield from chunk
+    except GeneratorExit:
+        # 消费者提前停止时取消排队的任务，不等待正在运行的任务
+        wait = False
+        raise
+    finally:
+        if pool is None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        else:
+            for future in pending:
+                future.cancel()
 
 def clean_bank_statement_text(text):
-    """根据银行类型清理账单文本"""
-    lines = text.split('\n')
-    # 检测银行类型
-    bank_type = "UNKNOWN"
-    account_type = "UNKNOWN"
+    """根据银行类型清理账单文本
     
-    if "BANK OF AMERICA" in text.upper():
-        bank_type = "BOFA"
-        if "SAVINGS" in text.upper():
-            account_type = "SAVINGS" 
-        elif "CHECKING" in text.upper():
-            account_type = "CHECKING"
-        elif "CREDIT CARD" in text.upper():
-            account_type = "CREDITCARD"
-
-    elif "CHASE.COM" in text.upper():
-        bank_type = "CHASE"
-        if "CREDIT CARD" in text.upper():
-            account_type = "CREDITCARD"
-        elif "CHASE SAVINGS" in text.upper():
-            account_type = "SAVINGS"
-        elif "CHASE TOTAL CHECKING" in text.upper():
-            account_type = "CHECKING"
-
-
-    elif "AMERICAN EXPRESS" in text.upper():
-        bank_type = "AMEX"
-        if "CREDIT CARD" in text.upper():
-            account_type = "CREDITCARD"
-        elif "SAVINGS" in text.upper():
-            account_type = "SAVINGS"
-        elif "CHECKING" in text.upper():
-            account_type = "CHECKING"
+    Args:
+        text: 完整的账单文本，或逐行产生文本的可迭代对象（如 iter_pdf_lines 的结果）
+
+    Returns:
+        tuple: (Transaction 记录列表, 交易数量, 银行类型, 账户类型)
+    """
+    if isinstance(text, str):
+        lines = text.split('\n')
+        head = text
+    else:
+        # 流式输入只缓存开头部分用于识别银行类型，其余行交给清理函数逐行消费
+        lines = iter(text)
+        head_lines = _read_detection_head(lines)
+        lines = chain(head_lines, lines)
+        head = '\n'.join(head_lines)
+
+    # 检测银行类型（只看开头窗口）
+    bank_type, account_type, confidence = detect_bank(head)
     
-    print(f"\n处理 {bank_type} - {account_type} 类型的账单")
+    print(f"\n处理 {bank_type} - {account_type} 类型的账单 (置信度 {confidence:.1f})")
 
-    if bank_type == "CHASE" and account_type != "CREDITCARD":
-        cleaned_lines, transaction_count = clean_chase_statement(lines)
-    if bank_type == "CHASE" and account_type == "CREDITCARD":
-        cleaned_lines, transaction_count = clean_chase_creditcard_statement(lines)
-    if bank_type == "BOFA":
-        cleaned_lines, transaction_count = clean_bofa_statement(lines)
-    if bank_type == "AMEX" and account_type == "CREDITCARD":
-        cleaned_lines, transaction_count = clean_amex_creditcard_statement(lines)
+    cleaner = _lookup_by_account(STATEMENT_CLEANERS, bank_type, account_type)
+    if cleaner is None:
+        print(f"暂不支持 {bank_type} - {account_type} 类型的账单")
+        return [], 0, bank_type, account_type
 
+    cleaned_lines, transaction_count = cleaner.clean(lines)
     return cleaned_lines, transaction_count, bank_type, account_type
 
-def clean_bofa_statement(lines):
-    """处理BOFA账单"""
-    cleaned_lines = []
-    transaction_count = 0
-    
-    # 初始化交易明细标记和当前交易变量
-    is_transaction_detail = False
-    current_transaction = None
-    
-    # 初始化账户后四位变量
-    account_last_four = None
-
-    remove_keywords = [
-        "Date",
-        "Description",
-        "Amount",
-        "Beginning balance on",
-        "Deposits and other additions",
-        "ATM and debit card subtractions",
-        "Other subtractions",
-        "Service fees",
-        "Ending balance on",
-        "Total deposits and other additions",
-        "Total ATM and debit card subtractions",
-        "Total other subtractions",
-        "Total service fees"
-    ]
-
-
-    # 遍历每一行文本
+def _lookup_by_account(registry, bank_type, account_type):
+    """按 (银行类型, 账户类型) 查找登记项，没有精确匹配时回退到该银行的 (银行类型, None) 条目"""
+    entry = registry.get((bank_type, account_type))
+    if entry is None:
+        entry = registry.get((bank_type, None))
+    return entry
+
+def _read_detection_head(lines):
+    """读取流式文本的开头若干行，直到累计长度达到 DETECTION_WINDOW_CHARS"""
+    head = []
+    size = 0
     for line in lines:
-        # 去除行首尾空白
-        line = line.strip()
-        if not line:
-            continue
-
-        # 提取账户后四位
-        if "BANK OF AMERICA ADVANTAGE SAVINGS" in line.upper():
-           pass
-
-        if "Account number:" in line:
-            # 找到所有4位数字组合
-            numbers = re.findall(r'\d{4}', line)
-            # 取最后一个4位数字作为账号后四位
-            if numbers:
-                account_last_four = numbers[-1]    
-            print(f"找到账户后四位: {account_last_four}")
-            cleaned_lines.append(f"\n=== Bank of America Savings Account({account_last_four}) ===")
+        head.append(line)
+        size += len(line) + 1
+        if size >= DETECTION_WINDOW_CHARS:
+            break
+    return head
 
-        
-                
-        # 检测是否进入交易明细部分
-        if "Deposits and other additions" in line or "ATM and debit card subtractions" in line or "Other subtractions" in line:
-            is_transaction_detail = True
-            continue
-            
-        # 检测交易记录部分的结束
-        if "Total " in line or "Braille and Large Print Request" in line:
-            is_transaction_detail = False
-            if current_transaction:
-                cleaned_lines.append(current_transaction)
-                transaction_count += 1
-                current_transaction = None
-            continue
-            
-        # 处理交易记录
-        if is_transaction_detail:
-
-            # 匹配日期和金额
-            date_match = re.search(r'\d{2}/\d{2}/\d{2}', line)
-            amount_match = re.search(r'[-]?\$?\d+,?\d*\.\d{2}', line)
-            
-            # 如果找到日期和金额，说明是新的交易记录
-            if date_match and amount_match:
-                if current_transaction:
-                    cleaned_lines.append(current_transaction)
-                    transaction_count += 1
-                current_transaction = line
-            # 如果当前行包含超过2个单词，作为交易描述的补充
-            elif current_transaction and len(line.split()) > 3:
-                current_transaction += " " + line
-            # 如果有未处理的交易记录，添加到结果中
-            elif current_transaction:
-                cleaned_lines.append(current_transaction)
-                transaction_count += 1
-                current_transaction = None
-    
-    # 处理最后一个未完成的交易记录
-    if current_transaction:
-        cleaned_lines.append(current_transaction)
-        transaction_count += 1
-    
-    print(f"\n共找到 {transaction_count} 条交易记录")
-    print(cleaned_lines)
-    return cleaned_lines, transaction_count
+def clean_bofa_statement(lines):
+    """处理BOFA账单"""
+    return STATEMENT_CLEANERS[("BOFA", None)].clean(lines)
 
 def clean_chase_statement(lines):
-
-    cleaned_lines = []
-    transaction_count = 0
-    
-    """处理CHASE账单"""
-        # 初始化交易明细标记和当前交易变量
-    is_transaction_detail = False
-    current_transaction = None
-    
-    # 初始化账户后四位变量
-    checking_account_last_four = None
-    savings_account_last_four = None
-
-
-    # 遍历每一行文本
-    for line in lines:
-        # 去除行首尾空白
-        line = line.strip()
-        if not line:
-            continue
-
-        # 提取支票账户后四位
-        if "CHASE TOTAL CHECKING" in line.upper():
-            match = re.search(r'(\d{4})\b', line)
-            if match:
-                checking_account_last_four = match.group(1)
-        # 提取储蓄账户后四位
-        elif "CHASE SAVINGS" in line.upper():
-            match = re.search(r'(\d{4})\b', line)
-            if match:
-                savings_account_last_four = match.group(1)
-
-        # 检测账户类型并添加账户标记
-        if "CHECKING SUMMARY" in line.upper():
-            if checking_account_last_four:
-                cleaned_lines.append(f"\n=== Chase Checking Account({checking_account_last_four}) ===")
-            else:
-                cleaned_lines.append(f"\n=== Chase Checking Account ===")
-            continue
-        elif "SAVINGS SUMMARY" in line.upper():
-            if savings_account_last_four:
-                cleaned_lines.append(f"\n=== Chase Savings Account({savings_account_last_four}) ===")
-            else:
-                cleaned_lines.append(f"\n=== Chase Savings Account ===")
-            continue
-
-        # 跳过包含 "Beginning Balance" 和 "Ending Balance" 的行
-        if "BEGINNING BALANCE" in line.upper() or "ENDING BALANCE" in line.upper():
-            continue
-
-        
-        # 检查是否遇到停止处理的标记
-        if "*start*dre portrait disclosure message area" in line.lower():
-            print("遇到 dre portrait disclosure 标记，停止处理")
-            break
-            
-
-        # 检测是否进入交易明细部分
-        if any(detail in line.upper() for detail in ["TRANSACTION DETAIL"]):
-            is_transaction_detail = True
-            continue
-            
-        # 处理交易记录
-        if is_transaction_detail:
-            # 遇到透支标记时停止处理
-            if "*start*post overdraft and returned" in line.lower():
-                print("遇到 overdraft 标记，停止处理")
-                break
-            
-            # 处理特殊的交易标记
-            if "*end*transac" in line.lower():
-                line = replace_transaction_detail_markers(line)
-            
-            # 匹配日期和金额
-            date_match = re.search(r'\d{2}/\d{2}', line)
-            amount_match = re.search(r'[-]?\$?\d+,?\d*\.\d{2}', line)
-            
-            # 如果找到日期和金额，说明是新的交易记录
-            if date_match and amount_match:
-                if current_transaction:
-                    cleaned_lines.append(current_transaction)
-                    transaction_count += 1
-                    #print(f"找到第 {transaction_count} 条交易: {current_transaction}")
-                
-                current_transaction = line
-            # 如果当前行包含超过2个单词，作为交易描述的补充
-            elif current_transaction and len(line.split()) > 2:
-                current_transaction += " " + line
-            # 如果有未处理的交易记录，添加到结果中
-            elif current_transaction:
-                cleaned_lines.append(current_transaction)
-                transaction_count += 1
-                #print(f"找到第 {transaction_count} 条交易: {current_transaction}")
-                current_transaction = None
-    
-    # 处理最后一个未完成的交易记录
-    if current_transaction:
-        cleaned_lines.append(current_transaction)
-        transaction_count += 1
-        #print(f"找到第 {transaction_count} 条交易: {current_transaction}")
-    
-    print(f"\n共找到 {transaction_count} 条交易记录")
-    
-    return cleaned_lines, transaction_count
+    """处理CHASE储蓄和支票账单"""
+    return STATEMENT_CLEANERS[("CHASE", None)].clean(lines)
 
 def clean_chase_creditcard_statement(lines):
     """处理CHASE信用卡账单"""
-    cleaned_lines = []
-    transaction_count = 0
-    
-    # 初始化交易明细标记和当前交易变量
-    is_transaction_detail = False
-    current_transaction = None
-    account_last_four = None
-
-    # 定义需要删除的关键词
-    remove_keywords = [
-        "Date of",
-        "Transaction Merchant Name or Transaction Description",
-        "$ Amount",
-        "PAYMENTS AND OTHER CREDITS",
-        "PURCHASE",
-        "FEES CHARGED",
-        "ACCOUNT ACTIVITY",
-        "ACCOUNT ACTIVITY (CONTINUED)"
-    ]
-
-    for line in lines:
-        # 去除行首尾空白
-        line = line.strip()
-        if not line:
-            continue
-
-        # 提取账户后四位
-        if "ACCOUNT NUMBER:" in line.upper():
-            numbers = re.findall(r'\d{4}', line)
-            if numbers:
-                account_last_four = numbers[-1][-4:]
-                cleaned_lines.append(f"\n=== Chase Credit Card({account_last_four}) ===")
-
-            print(f"找到账户后四位: {account_last_four}")
-                
-        # 检测是否进入交易明细部分
-        if "PAYMENTS AND OTHER CREDITS" in line.upper() or "PURCHASE" in line.upper() or "ACCOUNT ACTIVITY  (CONTINUED)" in line.upper():
-            is_transaction_detail = True
-            continue
-            
-        # 检测交易记录部分的结束
-        if "ACCOUNT SUMMARY" in line.upper() or "IMPORTANT NOTICES" in line.upper() or "PAGE" in line.upper():
-            is_transaction_detail = False
-            if current_transaction:
-                cleaned_lines.append(current_transaction)
-                transaction_count += 1
-                current_transaction = None
-            continue
-        
-        # Interest Charged
-        if "INTEREST CHARGED" in line.upper():
-            # 这里需要单独设计一个逻辑，将利息也算入账目中
-            pass
-
-        # 处理交易记录
-        if is_transaction_detail:
-            # 跳过关键词行
-            if any(keyword in line.upper() for keyword in remove_keywords):
-                continue
-
-            # 匹配日期和金额
-            date_match = re.search(r'\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b', line)
-            amount_match = re.search(r'[-]?\$?(?:\d{1,3}(?:,\d{3})*)?(?:\.\d{2})', line)
-            
-            if date_match and amount_match:
-                if current_transaction:
-                    cleaned_lines.append(current_transaction)
-                    transaction_count += 1
-                # 将金额转换为相反数
-                amount_str = amount_match.group()
-                # 移除$和,符号
-                amount_str = amount_str.replace('$', '').replace(',', '')
-                # 转换为浮点数并取相反数
-                amount = -float(amount_str)
-                # 如果金额为正数，添加+号
-                amount_str = f"+{amount:.2f}" if amount > 0 else f"{amount:.2f}"
-                # 替换原始金额
-                line = line[:amount_match.start()] + amount_str + line[amount_match.end():]
-                current_transaction = line
-                
-            # 如果当前行是交易描述的补充
-            #elif current_transaction and len(line.split()) > 3:
-            #    current_transaction += " " + line
-    
-    # 处理最后一个未完成的交易记录
-    if current_transaction:
-        cleaned_lines.append(current_transaction)
-        transaction_count += 1
-    
-    print(f"\n共找到 {transaction_count} 条交易记录")
-    return cleaned_lines, transaction_count
+    return STATEMENT_CLEANERS[("CHASE", "CREDITCARD")].clean(lines)
 
 def clean_amex_creditcard_statement(lines):
     """处理AMEX信用卡账单"""
-    cleaned_lines = []
-    transaction_count = 0
-
-    current_transaction = None
-    account_last_five = None
-    is_transaction_detail = False   
-
-    # 定义需要删除的关键词
-    remove_keywords = [
-        "DATE",
-        "DESCRIPTION",
-        "AMOUNT",
-        "BEGINNING BALANCE ON",
-        "DEPOSITS AND OTHER ADDITIONS",
-        "NEW CHARGES SUMMARY",
-        "NEW CHARGES",
-        "SUMMARY",
-        r'CARD\s+ENDING\s+\d+-\d+',
-        r'NEW CHARGES\s+$\d+,\d{3}\.\d{2}',
-    ]
-
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-
-        if "ACCOUNT ENDING" in line.upper():
-            # 只在第一次出现时添加账户后五位信息
-            if not any("=== American Express Credit Card(" in existing_line for existing_line in cleaned_lines):
-                numbers = re.findall(r'\d{5}', line)
-                if numbers:
-                    account_last_five = numbers[-1]
-                    cleaned_lines.append(f"\n=== American Express Credit Card({account_last_five}) ===")
-
-         # 检测是否进入交易明细部分
-        if any(keyword in line.upper() for keyword in ("FEES","TOTAL PAYMENTS AND CREDITS","DETAIL","DETAIL *INDICATES POSTING DATE", "DETAIL CONTINUED")):
-            is_transaction_detail = True
-            #print(line)
-            continue
-
-        if "TO RATE INTEREST RATE" in line.upper():
-            is_transaction_detail = True
-            #if not any("=== INTEREST(" in existing_line for existing_line in cleaned_lines):
-                #cleaned_lines.append(f"\n=== INTEREST({account_last_five}) ===")
-            continue
-        
-        # 检测交易记录部分的结束
-        #if is_transaction_detail:
-        if any(keyword in line.upper() for keyword in ("ABOUT TRAILING INTEREST", "CONTINUED ON REVERSE", "CONTINUED ON NEXT PAGE")):
-            is_transaction_detail = False
-            #print(line)
-            if current_transaction:
-                cleaned_lines.append(current_transaction)
-                transaction_count += 1
-                current_transaction = None
-            continue
-        
-
-        # 处理交易记录
-        if is_transaction_detail:
-            #跳过关键词行
-            if any(keyword in line.upper() for keyword in remove_keywords):
-                continue
-
-            # 使用灵活的正则匹配日期和金额（支持 MM/DD/YY 或 MM/DD/YYYY 的日期格式，金额支持正负符号）
-            date_match = re.search(r'\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b', line)
-            amount_match = re.search(r'[-+]?\$?\d+(?:,\d{3})*(?:\.\d{2})', line)
-
-            if date_match and amount_match:
-
-                if current_transaction:
-                    cleaned_lines.append(current_transaction)
-                    transaction_count += 1
-                  
-                # 将金额转换为相反数
-                amount_str = amount_match.group()
-                # 移除 $ 和 , 符号
-                clean_amount_str = amount_str.replace('$', '').replace(',', '')
-                # 转换为浮点数，并取相反数
-                inverted_amount = -float(clean_amount_str)
-                # 如果金额为正数，添加 + 号
-                formatted_amount = f"+{inverted_amount:.2f}" if inverted_amount > 0 else f"{inverted_amount:.2f}"
-                # 替换原始金额部分
-                line = line[:amount_match.start()] + formatted_amount + line[amount_match.end():]
-                current_transaction = line
-                
-                if current_transaction and re.match(r'^(Purchases|Cash Advances)\b', line.strip()):
-                        # Reformat a transaction line like: "Purchases 10/18/2023 29.99% (v) $0.00 $0.00"
-                        # into the new format: "10/18/2023 | Purchases Interest Rate 29.99% | +/-0.00"
-                        pattern = re.compile(
-                            r'^(Purchases|Cash Advances)\s+'
-                            r'(\d{1,2}/\d{1,2}(?:/\d{2,4})?)\s+'
-                            r'([-+]?\d+(?:\.\d+)?%)\s+'
-                            r'(?:\([^)]+\)\s+)?'
-                            r'\$?([\d,]+\.\d{2})\s+'
-                            r'\$?([\d,]+\.\d{2})'
-                        )
-                        match = pattern.match(current_transaction.strip())
-                        if match:
-                            txn_type = match.group(1)
-                            date_str = match.group(2)
-                            percent_val = match.group(3)
-                            # Use the second monetary value (group 5) for the final amount.
-                            raw_amount = match.group(5).replace(',', '')
-                            try:
-                                amount_value = float(raw_amount)
-                            except ValueError:
-                                amount_value = 0.00
-                            inverted_amount = -amount_value
-                            formatted_amount = f"+{inverted_amount:.2f}" if inverted_amount > 0 else f"{inverted_amount:.2f}"
-                            current_transaction = f"{date_str}  {txn_type} Interest Rate  {formatted_amount}"
-
-            # 如果当前行包含超过2个单词，作为交易描述的补充
-            # elif current_transaction and len(line.split()) > 1:
-            #     current_transaction += " " + line
-            # else:
-            #     if current_transaction:
-            #         current_transaction += " " + line
-            #     else:
-            #         current_transaction = line
-        #print(current_transaction)
-
-    if current_transaction:
-        cleaned_lines.append(current_transaction)
-        transaction_count += 1
-        
-    print(f"\nAMEX信用卡交易记录数量: {transaction_count}")
-    return cleaned_lines, transaction_count
\ No newline at end of file
+    return STATEMENT_CLEANERS[("AMEX", "CREDITCARD")].clean(lines)
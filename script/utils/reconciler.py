@@ -0,0 +1,74 @@
+import re
+from models.transaction import parse_cents
+
+# 模型漏掉记录时，只把缺失的记录重新发送的最多次数
+DEFAULT_RECONCILE_RETRIES = 1
+
+_ROW_DATE_PATTERN = re.compile(r'^(?:\d{4}-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})(?:/\d{2,4})?)$')
+
+
+def record_match_key(record):
+    """
+    返回交易记录的对账键 (月, 日, 金额分)，如 ("01/02", -1234) -> (1, 2, -1234)
+    :return: 记录没有日期或日期无法解析时返回 None（改写后无法重新解析的行会生成没有日期的记录）
+    """
+    if not record.date:
+        return None
+    parts = record.date.split('/')
+    try:
+        return int(parts[0]), int(parts[1]), record.amount_cents
+    except (IndexError, ValueError):
+        return None
+
+
+def icost_row_match_key(row):
+    """
+    返回模型输出的 iCost 行的对账键 (月, 日, 金额分)
+    :param row: 与 ICOST_HEADERS 对应的字段列表，日期为 YYYY-MM-DD 或 MM/DD
+    :return: 日期或金额无法解析时返回 None
+    """
+    match = _ROW_DATE_PATTERN.match(row[0].strip())
+    if not match:
+        return None
+    month, day = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+    try:
+        amount_cents = parse_cents(row[2])
+    except ValueError:
+        return None
+    return int(month), int(day), amount_cents
+
+
+def match_icost_rows(records, rows):
+    """
+    按日期和金额把模型输出的行对应回输入的交易记录
+    同一天同金额的多条记录按出现顺序依次对应；对应不上任何剩余记录的行视为重复或无法识别。
+    没有对账键（没有日期）的记录不参与对应，总是出现在 missing 中
+    :param records: Transaction 记录列表
+    :param rows: 模型输出的 iCost 行
+    :return: tuple (matched, missing, duplicates, unmatched)
+        matched: {记录下标: 行}
+        missing: 没有对应行的记录下标列表
+        duplicates: 对应的记录已被前面的行占用的行
+        unmatched: 日期金额与任何记录都不符的行
+    """
+    pending = {}
+    for index, record in enumerate(records):
+        key = record_match_key(record)
+        if key is not None:
+            pending.setdefault(key, []).append(index)
+    known_keys = set(pending)
+
+    matched = {}
+    duplicates = []
+    unmatched = []
+    for row in rows:
+        key = icost_row_match_key(row)
+        indexes = pending.get(key)
+        if indexes:
+            matched[indexes.pop(0)] = row
+        elif key in known_keys:
+            duplicates.append(row)
+        else:
+            unmatched.append(row)
+    missing = [index for index in range(len(records)) if index not in matched]
+    return matched, missing, duplicates, unmatched
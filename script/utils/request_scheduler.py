@@ -0,0 +1,247 @@
+import random
+import threading
+import time
+from openai import APIConnectionError
+from .shared_registry import get_or_create
+
+# 默认限额参照 OpenAI gpt-4o 第一档账户：每分钟 500 次请求、30000 token
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+DEFAULT_MAX_RETRIES = 4
+# 退避时间：第 n 次重试在 [0, min(上限, 基数 * 2^n)] 中随机取值，避免并发请求同时重试
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# 连续失败达到阈值后熔断，冷却期内的请求直接失败，冷却期后放行一个探测请求
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30.0
+# 可以重试的 HTTP 状态码：超时、冲突、限流和服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+def get_request_scheduler(provider, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                          tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    获取进程内共享的请求调度器，同一服务商和限额只创建一个，所有批次和页面重跑共用限额与熔断状态
+    :param provider: 服务商名称，如 "openai"
+    :param requests_per_minute: 每分钟请求数上限，None 表示不限制
+    :param tokens_per_minute: 每分钟 token 上限，None 表示不限制
+    :param max_retries: 可重试错误的最多重试次数
+    """
+    return get_or_create(
+        "request_scheduler", (provider, requests_per_minute, tokens_per_minute, max_retries), RequestScheduler,
+        provider=provider, requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute, max_retries=max_retries
+    )
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断期间拒绝请求时抛出"""
+
+
+def is_retryable_error(error):
+    """判断模型调用的错误是否值得重试：网络错误、超时、限流和服务端错误"""
+    if isinstance(error, (APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+def retry_after_seconds(error):
+    """读取错误响应中的 Retry-After 头（秒），没有时返回 None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """令牌桶限流器
+
+    容量为每分钟的限额，按限额匀速补充。取令牌时允许余额变为负数（预约），
+    调用方根据返回的等待时间休眠，这样并发请求按到达顺序排队，不会互相饿死。
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """
+        预约 amount 个令牌，超过容量的请求按容量计算
+        :return: 需要等待的秒数
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= min(float(amount), self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount):
+        """按实际用量修正余额，amount 为实际用量与预约量之差"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却期后半开放行一个探测请求，成功即关闭"""
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing else "open"
+
+    def before_request(self):
+        """请求前检查，熔断期间抛出 CircuitOpenError"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError(
+                    f"服务暂时不可用，熔断中（剩余 {max(remaining, 0):.0f} 秒）"
+                )
+            self.probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                print(f"连续失败 {self.failures} 次，熔断 {self.reset_seconds:.0f} 秒")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class RequestScheduler:
+    """模型请求调度器
+
+    所有模型调用都经过调度器：先按每分钟请求数和 token 数限流，
+    遇到可重试的错误时按带随机抖动的指数退避重试（优先遵循 Retry-After），
+    服务商持续出错时熔断，快速失败而不是继续加重服务端压力。
+    """
+    def __init__(self, provider, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, max_retries=DEFAULT_MAX_RETRIES):
+        self.provider = provider
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'retries': 0,
+            'rejected': 0,
+            'queue_depth': 0,
+            'max_queue_depth': 0,
+            'in_flight': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'backoff_seconds': 0.0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _wait(self, estimated_tokens):
+        """按限额等待，等待期间计入队列深度"""
+        wait = self.request_bucket.reserve(1) if self.request_bucket else 0.0
+        if self.token_bucket and estimated_tokens:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+        if wait <= 0:
+            return
+        with self._lock:
+            self._stats['queue_depth'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._stats['queue_depth'])
+        try:
+            time.sleep(wait)
+        finally:
+            with self._lock:
+                self._stats['queue_depth'] -= 1
+                self._stats['wait_seconds'] += wait
+                self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait)
+
+    def run(self, request, estimated_tokens=0):
+        """
+        在限额内执行一次模型调用，可重试的错误自动重试
+        :param request: 无参数的可调用对象，执行实际的 API 调用
+        :param estimated_tokens: 本次请求预估消耗的 token（输入加输出），用于按分钟 token 限流
+        :return: request 的返回值
+        :raises CircuitOpenError: 熔断期间
+        :raises Exception: 不可重试的错误，或重试次数用尽后的最后一个错误
+        """
+        self._count('requests')
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.breaker.before_request()
+            except CircuitOpenError:
+                self._count('rejected')
+                self._count('failed')
+                raise
+            self._wait(estimated_tokens)
+            self._count('in_flight')
+            error = None
+            try:
+                result = request()
+            except Exception as e:
+                error = e
+            finally:
+                self._count('in_flight', -1)
+            if error is None:
+                self.breaker.record_success()
+                self._count('succeeded')
+                return result
+
+            retryable = is_retryable_error(error)
+            if retryable:
+                self.breaker.record_failure()
+            else:
+                # 请求本身的错误（如参数、鉴权）与服务商是否可用无关，不计入熔断
+                self.breaker.record_success()
+            if not retryable or attempt == self.max_retries:
+                self._count('failed')
+                raise error
+            delay = retry_after_seconds(error)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            print(f"{self.provider} 请求失败（{error}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+            self._count('retries')
+            self._count('backoff_seconds', delay)
+            time.sleep(delay)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """请求完成后按实际 token 用量修正限流余额"""
+        if self.token_bucket and actual_tokens is not None:
+            self.token_bucket.adjust(actual_tokens - estimated_tokens)
+
+    def stats(self):
+        """返回调度统计：排队深度、限流等待时间、重试退避时间和熔断状态"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['avg_wait_seconds'] = stats['wait_seconds'] / stats['requests'] if stats['requests'] else 0.0
+        stats['circuit'] = self.breaker.state
+        return stats
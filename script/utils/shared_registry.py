@@ -0,0 +1,23 @@
+import threading
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def get_or_create(kind, key, factory, **config):
+    """
+    获取进程内共享的实例（缓存、调度器、客户端池等），同一 (kind, key) 只创建一次，
+    统计和状态在多次页面重跑间累计
+    :param kind: 实例类别，如 "pdf_text_cache"
+    :param key: 类别内区分实例的键，如缓存目录
+    :param factory: 创建实例的函数，以 config 为关键字参数调用
+    :param config: 创建参数；已有实例的创建参数不同时抛出 ValueError，不会静默沿用第一次的配置
+    """
+    with _shared_lock:
+        entry = _shared.get((kind, key))
+        if entry is None:
+            entry = (config, factory(**config))
+            _shared[(kind, key)] = entry
+        elif entry[0] != config:
+            raise ValueError(f"{kind} {key!r} 已按 {entry[0]} 创建，不能再按 {config} 获取")
+        return entry[1]
@@ -0,0 +1,38 @@
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # 未安装 tiktoken 时使用字符数估算
+    tiktoken = None
+
+# 中日韩字符大约每个字 1 个 token，其他字符大约每 4 个字符 1 个 token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding_for(model):
+    """获取模型对应的 tiktoken 编码，未知模型使用 o200k_base"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def estimate_tokens(text, model="gpt-4o"):
+    """
+    估算文本的 token 数量
+    :param text: 文本
+    :param model: 模型名称，用于选择 tiktoken 编码
+    :return: token 数量；安装了 tiktoken 时为精确值，否则为估算值
+    """
+    if not text:
+        return 0
+    if tiktoken is not None:
+        try:
+            return len(_encoding_for(model).encode(text))
+        except Exception as e:
+            print(f"tiktoken 计数失败，改用估算: {e}")
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + -(-(len(text) - cjk) // CHARS_PER_TOKEN)
@@ -36,11 +36,16 @@ class ConversionToiCostPage:
             with col1:
                 model = st.selectbox(
                     "选择模型",
-                    options=["GPT-4o"],#,"GPT-4o-mini", "DeepSeek-V3"],
+                    # 设置了本地替身服务器地址时可以选择 Local，用于离线压测
+                    options=["GPT-4o"] + (["Local"] if os.environ.get("LOCAL_LLM_BASE_URL") else []),#,"GPT-4o-mini", "DeepSeek-V3"],
                     help="选择用于处理文件的AI模型-web"
                 )
-                temperature = 0.3
-                batch_size = 150
+                # 批量任务模式：所有文件编入一个批量任务，费用更低但要等任务完成
+                bulk_mode = st.checkbox(
+                    "批量任务模式",
+                    help="所有文件编入一个批量任务提交，适合月末集中处理大量账单；任务最长需要 24 小时，"
+                         "页面最多等待 10 分钟，未完成时上传相同文件再次点击开始处理即可继续获取结果"
+                )
             with col2:
                 # API key 输入框
                 api_key = st.text_input(
@@ -141,34 +146,78 @@ class ConversionToiCostPage:
                 # 显示进度信息
                 status_text = st.empty()
                 processed_files = []  # 存储处理完成的文件信息
-                
-                # 逐个处理文件
-                for i, file in enumerate(files_to_process, 1):
-                    status_text.text(f"正在处理: {file.name} ({i}/{len(files_to_process)})")
-                    
+
+                if bulk_mode:
+                    def update_job_status(job):
+                        counts = job.request_counts
+                        progress = f" ({counts.completed}/{counts.total})" if counts else ""
+                        status_text.text(f"批量任务 {job.job_id} {job.status}{progress}")
+
                     try:
-                        result = self.controller.process_files(
-                            file=file,
+                        # 同一组文件以同一模型提交、未取回结果的任务继续等待，不重复提交
+                        run = self.controller.find_bulk_run(files_to_process, model.lower())
+                        if run is None:
+                            status_text.text(f"正在提交批量任务: {len(files_to_process)} 个文件")
+                            run = self.controller.submit_files_bulk(
+                                files=files_to_process,
+                                model=model.lower(),
+                                callback=self.update_progress
+                            )
+                        else:
+                            status_text.text(f"继续获取已提交的批量任务结果: {len(files_to_process)} 个文件")
+                        results = self.controller.collect_files_bulk(
+                            files=files_to_process,
+                            run=run,
                             model=model.lower(),
-                            temperature=temperature,
-                            batch_size=batch_size,
-                            callback=self.update_progress
+                            callback=self.update_progress,
+                            on_status=update_job_status
                         )
-                        
+                        if results is None:
+                            st.info("批量任务仍在运行，任务记录已保存。稍后上传相同文件并再次点击开始处理即可获取结果")
+                            results = []
+                    except Exception as e:
+                        st.toast(f"❌ 批量任务处理失败: {str(e)}，请检查API Key或网络连接", icon="🚨")
+                        results = []
+                    for file, result in zip(files_to_process, results):
+                        if result is None:
+                            st.error(f"文件 {file.name} 处理失败，请检查错误信息。")
+                            continue
+                        processed_files.append({
+                            'filename': file.name,
+                            'excel_data': result['excel_data'],
+                            'output_file': result['output_file']
+                        })
+                else:
+                    # 多个文件以流水线方式处理：后面文件的PDF解析与前面文件的模型调用同时进行
+                    status_text.text(f"正在处理: {len(files_to_process)} 个文件")
+                    pipeline_stats = {}
+                    try:
+                        results = self.controller.process_many(
+                            files=files_to_process,
+                            model=model.lower(),
+                            callback=self.update_progress,
+                            stats=pipeline_stats
+                        )
+                    except Exception as e:
+                        st.toast(f"❌ 处理文件时发生错误: {str(e)}，请检查API Key或网络连接", icon="🚨")
+                        results = []
+                    for file, result in zip(files_to_process, results):
                         if result is None:  # 处理失败
                             st.error(f"文件 {file.name} 处理失败，请检查错误信息。")
                             continue
-                            
+
                         # 存储处理成功的文件信息
                         processed_files.append({
                             'filename': file.name,
                             'excel_data': result['excel_data'],
                             'output_file': result['output_file']
                         })
-                            
-                    except Exception as e:
-                        st.toast(f"❌ 处理文件 {file.name} 时发生错误: {str(e)}，请检查API Key或网络连接", icon="🚨")
-                        continue
+                    if pipeline_stats:
+                        status_text.text(
+                            f"处理完成: {pipeline_stats['succeeded']}/{pipeline_stats['files']} 个文件，"
+                            f"{pipeline_stats['transactions']} 条记录，耗时 {pipeline_stats['seconds']:.1f} 秒"
+                            f"（{pipeline_stats['transactions_per_second']:.1f} 条/秒）"
+                        )
                 
                 #status_text.text("所有文件处理完成！")
                 
@@ -240,7 +289,7 @@ class ConversionToiCostPage:
 
     def update_progress(self, filename, total_transactions=None, total_processed_count=None, 
                        bank_type=None, account_type=None, output_file=None, excel_data=None,
-                       error_message=None):
+                       error_message=None, warning_message=None):
         """更新处理进度的回调函数"""
         for item in st.session_state.file_data:
             if item["文件名"] == filename:
@@ -262,5 +311,7 @@ class ConversionToiCostPage:
         # 如果有错误信息，显示错误提示
         if error_message:
             self.status_placeholder.error(f"❌ 处理文件 {filename} 失败: {error_message}，请检查API Key或网络连接", icon="🚨")
+        elif warning_message:
+            self.status_placeholder.warning(f"⚠️ 文件 {filename}: {warning_message}")
         
 
@@ -0,0 +1,44 @@
+import io
+import os
+import sys
+
+import pytest
+
+# 应用代码以 script/ 为根目录导入（from utils ...），测试使用相同的导入方式
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "script"))
+
+from utils.mock_llm_server import start_mock_server  # noqa: E402
+from utils.model_backends import ModelBackend, register_model_backend  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class UploadedStatement(io.BytesIO):
+    """页面上传文件（streamlit UploadedFile）的替身：带文件名的字节流"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+
+
+@pytest.fixture
+def statement_file():
+    """按样例账单名（tests/fixtures 下的 PDF）返回新的上传文件替身"""
+    return lambda name: UploadedStatement(os.path.join(FIXTURE_DIR, f"{name}.pdf"))
+
+
+@pytest.fixture
+def mock_server():
+    """本地替身模型服务器，按输入记录返回确定的结果"""
+    server = start_mock_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def local_model(mock_server):
+    """指向替身服务器的模型别名，使用固定的 API key"""
+    register_model_backend("test-local", ModelBackend(
+        "test-local", "mock-icost", base_url=mock_server.base_url, api_key="local"
+    ))
+    return "test-local"
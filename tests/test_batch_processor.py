@@ -0,0 +1,69 @@
+"""批次的组装与合并，以及按 token 预算装箱"""
+import contextlib
+import io
+
+import pytest
+
+from models.transaction import Transaction
+from utils.batch_processor import Batch, estimate_record_tokens, merge_batch_results
+from utils.batch_processor import process_batches as _process_batches
+
+
+def _batch(rows, processed=True):
+    batch = Batch([Transaction("01/02", -100, "A")] * len(rows))
+    batch.processed = processed
+    batch.result = rows
+    return batch
+
+
+def test_merge_batch_results_concatenates_rows_in_batch_order():
+    first = [["2023-01-02", "支出", "-1.00"]]
+    second = [["2023-01-03", "收入", "2.00"], ["2023-01-04", "支出", "-3.00"]]
+    batches = [_batch(first), _batch([]), _batch([["skipped"]], processed=False), _batch(second)]
+    assert merge_batch_results(batches) == first + second
+
+
+def process_batches(*args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _process_batches(*args, **kwargs)
+
+
+def _records(count, account="Chase Checking Account(1234)", description="Card Purchase TRADER JOE S NEW YORK NY"):
+    return [Transaction(f"01/{day % 28 + 1:02d}", -100 * day, description, account) for day in range(count)]
+
+
+def test_token_budget_packing_stays_within_budget():
+    records = _records(120)
+    budget = 400
+    batches = process_batches(records, max_input_tokens=budget)
+    assert [record for batch in batches for record in batch.content] == records
+    assert len(batches) > 1
+    for batch in batches:
+        assert batch.input_tokens == sum(estimate_record_tokens(record)[0] for record in batch.content)
+        assert batch.input_tokens <= budget
+    # 每个批次都装到加入下一条就会超出预算为止
+    for batch, following in zip(batches, batches[1:]):
+        assert batch.input_tokens + estimate_record_tokens(following.content[0])[0] > budget
+
+
+def test_output_budget_depends_on_mode():
+    records = _records(60)
+    classify = process_batches(records, max_output_tokens=200, ai_mode="classify")
+    full = process_batches(records, max_output_tokens=200, ai_mode="full")
+    assert len(full) > len(classify)
+    assert all(batch.output_tokens <= 200 for batch in classify + full)
+
+
+def test_batches_never_mix_accounts_and_oversized_records_stand_alone():
+    records = _records(3, "Checking") + [_records(1, "Savings", "X" * 4000)[0]] + _records(3, "Savings")
+    batches = process_batches(records, max_input_tokens=300)
+    assert [(batch.header, batch.length) for batch in batches] == [("Checking", 3), ("Savings", 1), ("Savings", 3)]
+    assert [batch.index for batch in batches] == [0, 1, 2]
+
+
+def test_fixed_batch_size_without_budget():
+    batches = process_batches(_records(25), batch_size=10)
+    assert [batch.length for batch in batches] == [10, 10, 5]
+    assert all(batch.input_tokens == 0 for batch in batches)
+    with pytest.raises(ValueError):
+        process_batches(_records(1))
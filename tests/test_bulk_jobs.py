@@ -0,0 +1,56 @@
+"""批量任务模式：结果与逐个请求一致、任务记录的保存、找回与核对"""
+import contextlib
+import io
+
+import pytest
+
+from controllers.bank_controller import BankStatementController
+from utils.model_backends import ModelBackend, register_model_backend
+
+SAMPLES = ("chase_small_2023", "amex_2023", "bofa_2023")
+
+
+def _controller(output_dir):
+    return BankStatementController(output_dir=str(output_dir), pdf_cache_max_mb=0, model_routes={})
+
+
+def _files(statement_file):
+    return [statement_file(name) for name in SAMPLES]
+
+
+def test_bulk_results_match_individual_requests(tmp_path, local_model, mock_server, statement_file):
+    mock_server.batch_seconds = 0.2
+    controller = _controller(tmp_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [controller.process_files(file, model=local_model) for file in _files(statement_file)]
+        results = controller.process_files_bulk(_files(statement_file), model=local_model, poll_seconds=0.05)
+    for result, reference in zip(results, expected):
+        assert result['excel_data'].equals(reference['excel_data'])
+    assert controller.find_bulk_run(_files(statement_file), local_model) is None
+
+
+def test_saved_run_is_resumed_only_with_same_files_and_model(tmp_path, local_model, mock_server, statement_file):
+    mock_server.batch_seconds = 0.5
+    register_model_backend("test-local-2", ModelBackend(
+        "test-local-2", "mock-icost", base_url=mock_server.base_url, api_key="local"
+    ))
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = _controller(tmp_path).submit_files_bulk(_files(statement_file), model=local_model)
+        # 页面等待超时：任务保留，记录留在输出目录
+        assert _controller(tmp_path).collect_files_bulk(
+            _files(statement_file), run, model=local_model, poll_seconds=0.05, timeout_seconds=0
+        ) is None
+
+    # 页面重跑后新建的控制器按文件内容和模型找回同一个任务
+    controller = _controller(tmp_path)
+    assert controller.find_bulk_run(_files(statement_file), local_model)['run_id'] == run['run_id']
+    assert run['model'] == local_model
+    assert controller.find_bulk_run(_files(statement_file), "test-local-2") is None
+    assert controller.find_bulk_run(_files(statement_file)[:2], local_model) is None
+    with pytest.raises(ValueError):
+        controller.collect_files_bulk(_files(statement_file), run, model="test-local-2")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = controller.collect_files_bulk(_files(statement_file), run, model=local_model, poll_seconds=0.05)
+    assert all(result is not None for result in results)
+    assert controller.find_bulk_run(_files(statement_file), local_model) is None
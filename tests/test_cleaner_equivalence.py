@@ -0,0 +1,79 @@
+"""按配置编译的账单清理器与原来手写清理函数的等价性检查
+
+对每种账单，用样例账单文本比较两者的交易行、所属账户和交易条数；
+再用从样例行和边界行中随机抽取、打乱的行组合（共 12000 组）比较交易行和交易条数。
+随机组合中账户标题可能出现在一条交易的续行之前：旧函数把这条交易归到新的账户标题下，
+交易记录则保留交易开始时的账户，所以随机组合不比较所属账户。
+"""
+import contextlib
+import io
+import os
+import random
+
+import pytest
+
+import legacy_cleaners
+from utils.bank_profiles import STATEMENT_CLEANERS
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+SAMPLE_STATEMENTS = ("chase_small_2023", "amex_2023", "bofa_2023", "chasecc_2023")
+LEGACY_CLEANERS = {
+    ("CHASE", "CREDITCARD"): legacy_cleaners.clean_chase_creditcard_statement,
+    ("CHASE", None): legacy_cleaners.clean_chase_statement,
+    ("BOFA", None): legacy_cleaners.clean_bofa_statement,
+    ("AMEX", "CREDITCARD"): legacy_cleaners.clean_amex_creditcard_statement,
+}
+# 各清理规则的边界：账户标题、段落标记、交易明细标记、续行、汇总行等
+EDGE_LINES = [
+    "Account number: 1234 5678", "Account number:", "CHASE TOTAL CHECKING 000000001234", "CHECKING SUMMARY",
+    "SAVINGS SUMMARY", "*end*transac3tion detail 01/02 FOO 12.00", "ACCOUNT ENDING 1-23456",
+    "Purchases 10/18/2023 29.99% (v) $1,000.00 $2.50", "Cash Advances 10/18/2023 29.99% $0.00 $0.00",
+    "*start*post overdraft and returned", "*start*dre portrait disclosure message area", "Total deposits 12.00",
+    "a b c d e", "a b c", "01/02 thing -$1,234.56", "PAGE 2 of 3", "Purchases only words",
+]
+MIXES_PER_CLEANER = 3000
+
+
+def _sample_lines(name):
+    with open(os.path.join(FIXTURE_DIR, f"{name}.txt"), encoding="utf-8") as f:
+        return f.read().split("\n")
+
+
+def _legacy_records(lines, cleaner):
+    """把旧清理函数的输出（账户标题行加交易行）转换为 (交易行, 账户标题) 列表和交易条数"""
+    cleaned_lines, count = cleaner(lines)
+    records, header = [], None
+    for line in cleaned_lines:
+        if line.startswith("\n==="):
+            header = line.strip()[4:-4]
+            continue
+        records.append((line, header))
+    return records, count
+
+
+def _profile_records(lines, key):
+    transactions, count = STATEMENT_CLEANERS[key].clean(iter(lines))
+    return [(record.raw, record.account) for record in transactions], count
+
+
+def _clean_both(lines, key):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _legacy_records(list(lines), LEGACY_CLEANERS[key]), _profile_records(lines, key)
+
+
+@pytest.mark.parametrize("key", list(LEGACY_CLEANERS), ids=str)
+@pytest.mark.parametrize("name", SAMPLE_STATEMENTS)
+def test_sample_statements_match_legacy(name, key):
+    expected, actual = _clean_both(_sample_lines(name), key)
+    assert actual == expected
+
+
+@pytest.mark.parametrize("key", list(LEGACY_CLEANERS), ids=str)
+def test_random_line_mixes_match_legacy(key):
+    pool = [line for name in SAMPLE_STATEMENTS for line in _sample_lines(name)] + EDGE_LINES * 20
+    rng = random.Random(1)
+    for _ in range(MIXES_PER_CLEANER):
+        lines = rng.sample(pool, rng.randint(5, 200))
+        (expected, expected_count), (actual, actual_count) = _clean_both(lines, key)
+        assert [line for line, _ in actual] == [line for line, _ in expected], lines
+        assert actual_count == expected_count, lines
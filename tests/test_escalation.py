@@ -0,0 +1,111 @@
+"""按模型路由升级和补发记录（BankStatementController._request_with_escalation）"""
+import contextlib
+import io
+
+import pytest
+
+from controllers.bank_controller import BankStatementController
+from utils.batch_processor import Batch
+
+MODELS = ("cheap", "strong")
+
+
+@pytest.fixture
+def controller(tmp_path):
+    return BankStatementController(output_dir=str(tmp_path), pdf_cache_max_mb=0, model_routes={},
+                                   reconcile_retries=1)
+
+
+def _batch(length=4):
+    batch = Batch(list(range(length)))
+    batch.index = 0
+    return batch
+
+
+def _stats():
+    return {'escalated_rows': 0, 'rerequested_rows': 0, 'invalid_rows': 0}
+
+
+class FakeModels:
+    """按 {模型: 函数(键) -> "ok" / "bad" / None} 回答请求，记录每次请求的模型和键"""
+    def __init__(self, answers, failing=()):
+        self.answers = answers
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, model, keys):
+        self.calls.append((model, list(keys)))
+        if model in self.failing:
+            return None
+        valid, invalid = {}, {}
+        for key in keys:
+            answer = self.answers[model](key)
+            if answer == "ok":
+                valid[key] = f"{model}:{key}"
+            elif answer == "bad":
+                invalid[key] = f"{model}:{key}?"
+        return valid, invalid
+
+
+def _run(controller, ask, models=MODELS, keys=(0, 1, 2, 3)):
+    stats = _stats()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = controller._request_with_escalation(_batch(), models, list(keys), ask, stats)
+    return result, stats
+
+
+def test_all_valid_uses_first_model_only(controller):
+    ask = FakeModels({"cheap": lambda key: "ok"})
+    (accepted, fallback, pending), stats = _run(controller, ask)
+    assert accepted == {key: f"cheap:{key}" for key in range(4)}
+    assert (fallback, pending) == ({}, [])
+    assert ask.calls == [("cheap", [0, 1, 2, 3])]
+    assert stats == _stats()
+
+
+def test_only_failing_rows_escalate(controller):
+    ask = FakeModels({"cheap": lambda key: "ok" if key < 2 else "bad", "strong": lambda key: "ok"})
+    (accepted, _, pending), stats = _run(controller, ask)
+    assert ask.calls == [("cheap", [0, 1, 2, 3]), ("strong", [2, 3])]
+    assert accepted == {0: "cheap:0", 1: "cheap:1", 2: "strong:2", 3: "strong:3"}
+    assert pending == []
+    assert stats == {'escalated_rows': 2, 'rerequested_rows': 0, 'invalid_rows': 0}
+
+
+def test_missing_rows_are_rerequested_from_final_model(controller):
+    answers = {"cheap": lambda key: None if key == 3 else "ok", "strong": lambda key: None}
+    ask = FakeModels(answers)
+    (accepted, _, pending), stats = _run(controller, ask)
+    assert ask.calls == [("cheap", [0, 1, 2, 3]), ("strong", [3]), ("strong", [3])]
+    assert sorted(accepted) == [0, 1, 2]
+    assert pending == [3]
+    assert stats == {'escalated_rows': 1, 'rerequested_rows': 1, 'invalid_rows': 0}
+
+
+def test_final_invalid_rows_are_retried_then_flagged(controller):
+    ask = FakeModels({"cheap": lambda key: "bad", "strong": lambda key: "ok" if key == 0 else "bad"})
+    (accepted, fallback, pending), stats = _run(controller, ask)
+    assert ask.calls == [("cheap", [0, 1, 2, 3]), ("strong", [0, 1, 2, 3]), ("strong", [1, 2, 3])]
+    assert accepted == {0: "strong:0"}
+    assert pending == [1, 2, 3]
+    assert {key: fallback[key] for key in pending} == {key: f"strong:{key}?" for key in pending}
+    assert stats == {'escalated_rows': 4, 'rerequested_rows': 3, 'invalid_rows': 3}
+
+
+def test_failed_request_before_final_tier_continues(controller):
+    ask = FakeModels({"strong": lambda key: "ok"}, failing={"cheap"})
+    (accepted, _, pending), stats = _run(controller, ask)
+    assert ask.calls == [("cheap", [0, 1, 2, 3]), ("strong", [0, 1, 2, 3])]
+    assert sorted(accepted) == [0, 1, 2, 3]
+    assert pending == []
+    assert stats['escalated_rows'] == 4
+
+
+def test_failed_request_at_final_tier_stops(controller):
+    ask = FakeModels({"cheap": lambda key: "bad"}, failing={"strong"})
+    (accepted, fallback, pending), stats = _run(controller, ask)
+    assert ask.calls == [("cheap", [0, 1, 2, 3]), ("strong", [0, 1, 2, 3])]
+    assert accepted == {}
+    assert pending == [0, 1, 2, 3]
+    assert stats == {'escalated_rows': 4, 'rerequested_rows': 0, 'invalid_rows': 4}
+    assert fallback == {key: f"cheap:{key}?" for key in range(4)}
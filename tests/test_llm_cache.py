@@ -0,0 +1,72 @@
+"""模型响应缓存：按提示词寻址、有效期、损坏条目，以及重复处理同一账单时不再请求模型"""
+import contextlib
+import io
+
+import pytest
+
+from controllers.bank_controller import BankStatementController
+from utils import llm_cache
+from utils.llm_cache import LLMResponseCache, get_llm_response_cache
+from utils.shared_registry import get_or_create
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMResponseCache(str(tmp_path / "llm_cache"), ttl_seconds=60)
+
+
+def test_responses_are_keyed_by_model_temperature_and_prompts(cache):
+    key = cache.make_key("gpt-4o", 0.3, "system", "rows")
+    assert cache.get(key) is None
+    cache.put(key, "1|支出|餐饮||日常", model="gpt-4o")
+    assert cache.get(key) == "1|支出|餐饮||日常"
+    other_keys = {
+        cache.make_key("gpt-4o-mini", 0.3, "system", "rows"),
+        cache.make_key("gpt-4o", 0.0, "system", "rows"),
+        cache.make_key("gpt-4o", 0.3, "system v2", "rows"),
+        cache.make_key("gpt-4o", 0.3, "system", "other rows"),
+    }
+    assert key not in other_keys and len(other_keys) == 4
+    assert all(cache.get(other) is None for other in other_keys)
+
+
+def test_expired_and_corrupt_entries_are_misses(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    key = cache.make_key("gpt-4o", 0.3, "system", "rows")
+    cache.put(key, "content")
+    now[0] += 61
+    assert cache.get(key) is None
+    assert cache.stats()['expired'] == 1 and cache.stats()['entries'] == 0
+
+    corrupt = cache.make_key("gpt-4o", 0.3, "system", "corrupt")
+    with open(cache.path_for(corrupt), "w") as f:
+        f.write("{not json")
+    assert cache.get(corrupt) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (0, 2)
+
+
+def test_shared_instances_reject_conflicting_settings(tmp_path):
+    cache_dir = str(tmp_path / "shared_llm_cache")
+    first = get_llm_response_cache(cache_dir, max_bytes=1000, ttl_seconds=60)
+    assert get_llm_response_cache(cache_dir, max_bytes=1000, ttl_seconds=60) is first
+    with pytest.raises(ValueError):
+        get_llm_response_cache(cache_dir, max_bytes=1000, ttl_seconds=120)
+    created = []
+    assert get_or_create("test_kind", "key", lambda **config: created.append(config) or config, a=1) == {'a': 1}
+    get_or_create("test_kind", "key", lambda **config: created.append(config), a=1)
+    assert created == [{'a': 1}]
+
+
+def test_repeated_statement_is_answered_from_cache(tmp_path, local_model, mock_server, statement_file):
+    controller = BankStatementController(output_dir=str(tmp_path), pdf_cache_max_mb=0, model_routes={},
+                                         ai_cache_ttl_hours=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = controller.process_files(statement_file("chase_small_2023"), model=local_model)
+        requests = mock_server.stats['requests']
+        second = controller.process_files(statement_file("chase_small_2023"), model=local_model)
+    assert requests > 0
+    assert mock_server.stats['requests'] == requests
+    assert second['excel_data'].equals(first['excel_data'])
+    assert controller.ai_cache.stats()['hits'] >= requests
@@ -0,0 +1,89 @@
+"""商户分类记忆：作用域隔离、有效期，以及经 process_many 工作线程处理时的作用域"""
+import contextlib
+import io
+import threading
+
+import pytest
+import streamlit as st
+
+from controllers.bank_controller import BankStatementController
+from models.transaction import Transaction
+from utils.client_pool import api_key_fingerprint
+from utils import merchant_memo
+from utils.merchant_memo import MerchantMemo, merchant_memo_scope
+from utils.model_backends import ModelBackend, register_model_backend
+
+GROCERIES = ("支出", "杂货", "", "日常")
+
+
+def _record(description, amount_cents=-1234):
+    return Transaction("01/02", amount_cents, description)
+
+
+@pytest.fixture
+def memo(tmp_path):
+    return MerchantMemo(str(tmp_path / "memo.sqlite3"))
+
+
+def test_remembered_merchant_is_found_in_same_scope_only(memo):
+    memo.remember([(_record("Card Purchase 01/02 TRADER JOE S #123 NEW YORK NY"), GROCERIES)], "user-a:CHASE")
+    records = [_record("Card Purchase 01/09 TRADER JOE S #456 NEW YORK NY"), _record("SHELL OIL 1234")]
+    assert memo.lookup(records, "user-a:CHASE") == {1: GROCERIES}
+    assert memo.lookup(records, "user-b:CHASE") == {}
+    assert memo.lookup(records, "user-a:BOFA") == {}
+    # 金额方向不同（退款）不使用支出的分类
+    assert memo.lookup([_record("TRADER JOE S NEW YORK NY", 1234)], "user-a:CHASE") == {}
+
+
+def test_merchant_names_are_not_stored_in_clear(memo):
+    memo.remember([(_record("TRADER JOE S NEW YORK NY"), GROCERIES)], "user-a:CHASE")
+    stored = memo._conn.execute("SELECT merchant FROM scoped_merchants").fetchone()[0]
+    assert "TRADER" not in stored
+
+
+def test_expired_entries_are_ignored_and_purged(tmp_path, monkeypatch):
+    memo = MerchantMemo(str(tmp_path / "memo.sqlite3"), ttl_seconds=60)
+    now = [1000.0]
+    monkeypatch.setattr(merchant_memo.time, "time", lambda: now[0])
+    memo.remember([(_record("TRADER JOE S"), GROCERIES)], "scope")
+    assert memo.lookup([_record("TRADER JOE S")], "scope") == {1: GROCERIES}
+    now[0] += 61
+    assert memo.lookup([_record("TRADER JOE S")], "scope") == {}
+    memo.remember([(_record("SHELL OIL"), ("支出", "交通", "", "日常"))], "scope")
+    assert memo.stats()['merchants'] == 1
+
+
+class ScriptThreadSessionState:
+    """st.session_state 的替身：与 Streamlit 相同，只有页面脚本线程能读到页面输入的值"""
+    def __init__(self, **values):
+        self._values = values
+        self._thread = threading.get_ident()
+
+    def __getattr__(self, name):
+        if threading.get_ident() != self._thread or name not in self._values:
+            raise AttributeError(name)
+        return self._values[name]
+
+
+def test_process_many_learns_and_reuses_memo_from_worker_threads(tmp_path, monkeypatch, mock_server,
+                                                                 statement_file):
+    monkeypatch.setattr(st, "session_state", ScriptThreadSessionState(api_key="page-key"))
+    # 没有固定 key 的后端使用页面输入的 key
+    register_model_backend("memo-local", ModelBackend("memo-local", "mock-icost", base_url=mock_server.base_url))
+    controller = BankStatementController(output_dir=str(tmp_path), pdf_cache_max_mb=0, merchant_memo=True,
+                                         model_routes={})
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = controller.process_many([statement_file("chase_small_2023")], model="memo-local")
+    learned = controller.merchant_memo.stats()['learned']
+    assert first[0] is not None and learned > 0
+    scope = merchant_memo_scope(api_key_fingerprint("page-key"), "CHASE")
+    assert controller.merchant_memo._conn.execute(
+        "SELECT COUNT(*) FROM scoped_merchants WHERE scope = ?", (scope,)
+    ).fetchone()[0] == controller.merchant_memo.stats()['merchants']
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        second = controller.process_many(
+            [statement_file("chase_small_2023"), statement_file("chase_small_2023")], model="memo-local"
+        )
+    assert [result['total_processed_count'] for result in second] == [first[0]['total_processed_count']] * 2
+    assert controller.merchant_memo.stats()['hits'] > 0
@@ -0,0 +1,35 @@
+"""PDF 文本提取后端：auto 按银行选择，pdfium 只在显式指定时使用"""
+import contextlib
+import io
+
+import pytest
+
+from utils import pdf_processor
+from utils.pdf_processor import BANK_PDF_BACKENDS, iter_pdf_pages
+
+SAMPLES = ("chase_small_2023", "amex_2023", "bofa_2023", "chasecc_2023")
+
+
+def _pages(path, backend):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return list(iter_pdf_pages(path, backend=backend))
+
+
+def test_no_bank_is_switched_to_pdfium():
+    assert "pdfium" not in BANK_PDF_BACKENDS.values()
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_auto_extracts_like_pdfplumber_without_probing(name, monkeypatch, statement_file):
+    path = statement_file(name)
+    monkeypatch.setattr(pdf_processor, "_detect_first_page_bank",
+                        lambda file_path: pytest.fail("auto 不应为选择后端单独解析首页"))
+    assert _pages(path, "auto") == _pages(path, "pdfplumber")
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_explicit_pdfium_reads_every_page(name, statement_file):
+    path = statement_file(name)
+    pages = _pages(path, "pdfium")
+    assert len(pages) == len(_pages(path, "pdfplumber"))
+    assert all(page.endswith("\n") for page in pages)
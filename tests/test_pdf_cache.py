@@ -0,0 +1,69 @@
+"""PDF 提取文本缓存：完整命中、部分条目续提取、按设置区分条目和容量淘汰"""
+import contextlib
+import io
+
+import pytest
+
+from utils.pdf_cache import PDFTextCache, get_pdf_text_cache
+from utils.pdf_processor import iter_pdf_pages
+
+
+def _pages(source, cache=None, limit=None, **options):
+    with contextlib.redirect_stdout(io.StringIO()):
+        pages = iter_pdf_pages(source, cache=cache, **options)
+        try:
+            return [page for _, page in zip(range(limit or 10 ** 6), pages)]
+        finally:
+            pages.close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PDFTextCache(str(tmp_path / "pdf_cache"))
+
+
+def test_second_extraction_is_served_from_cache(cache, statement_file):
+    uncached = _pages(statement_file("chase_small_2023"))
+    assert _pages(statement_file("chase_small_2023"), cache) == uncached
+    assert _pages(statement_file("chase_small_2023"), cache) == uncached
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_early_stop_saves_a_partial_entry_that_is_resumed(cache, statement_file):
+    uncached = _pages(statement_file("chase_small_2023"))
+    assert len(uncached) > 1
+    assert _pages(statement_file("chase_small_2023"), cache, limit=1) == uncached[:1]
+    assert cache.stats()['entries'] == 1
+
+    assert _pages(statement_file("chase_small_2023"), cache) == uncached
+    stats = cache.stats()
+    assert stats['partial_hits'] == 1
+    # 完整条目提交后部分条目被删除
+    assert stats['entries'] == 1
+    assert _pages(statement_file("chase_small_2023"), cache) == uncached
+    assert cache.stats()['hits'] == 1
+
+
+def test_different_settings_or_files_do_not_share_entries(cache, statement_file):
+    _pages(statement_file("amex_2023"), cache)
+    _pages(statement_file("amex_2023"), cache, settings={'x_tolerance': 2})
+    _pages(statement_file("bofa_2023"), cache)
+    assert cache.stats()['hits'] == 0
+    assert cache.stats()['entries'] == 3
+
+
+def test_entries_beyond_the_size_limit_are_evicted(tmp_path, statement_file):
+    cache = PDFTextCache(str(tmp_path / "pdf_cache"), max_bytes=1)
+    _pages(statement_file("amex_2023"), cache)
+    _pages(statement_file("bofa_2023"), cache)
+    stats = cache.stats()
+    assert stats['entries'] == 0
+    assert stats['evictions'] == 2
+
+
+def test_shared_cache_rejects_a_conflicting_size_limit(tmp_path):
+    cache_dir = str(tmp_path / "shared_pdf_cache")
+    assert get_pdf_text_cache(cache_dir, max_bytes=1000) is get_pdf_text_cache(cache_dir + "/", max_bytes=1000)
+    with pytest.raises(ValueError):
+        get_pdf_text_cache(cache_dir, max_bytes=2000)
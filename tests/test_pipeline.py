@@ -0,0 +1,57 @@
+"""多文件流水线 process_many：结果与逐个处理一致、失败文件互不影响、模型线程总数受限"""
+import contextlib
+import io
+import threading
+
+import pytest
+
+from controllers.bank_controller import BankStatementController, MAX_AI_THREADS
+
+SAMPLES = ("chase_small_2023", "amex_2023", "bofa_2023", "chasecc_2023")
+
+
+@pytest.fixture
+def controller(tmp_path):
+    return BankStatementController(output_dir=str(tmp_path), pdf_cache_max_mb=0, model_routes={})
+
+
+def test_process_many_matches_process_files(controller, local_model, statement_file):
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [controller.process_files(statement_file(name), model=local_model) for name in SAMPLES]
+        stats = {}
+        results = controller.process_many([statement_file(name) for name in SAMPLES], model=local_model,
+                                          stats=stats)
+    assert [result['output_file'] for result in results] == [result['output_file'] for result in expected]
+    for result, reference in zip(results, expected):
+        assert result['excel_data'].equals(reference['excel_data'])
+    assert stats['succeeded'] == len(SAMPLES)
+    assert stats['transactions'] == sum(result['total_processed_count'] for result in expected)
+
+
+def test_failed_file_does_not_stop_the_others(controller, local_model, statement_file):
+    broken = io.BytesIO(b"not a pdf")
+    broken.name = "broken_2023.pdf"
+    reported = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = controller.process_many(
+            [statement_file("amex_2023"), broken, statement_file("bofa_2023")], model=local_model,
+            callback=lambda **kwargs: reported.append(kwargs)
+        )
+    assert results[1] is None
+    assert results[0] is not None and results[2] is not None
+    assert any(report.get('filename') == "broken_2023.pdf" for report in reported)
+
+
+def test_file_concurrency_is_capped_by_ai_concurrency(tmp_path, local_model, statement_file):
+    controller = BankStatementController(output_dir=str(tmp_path), pdf_cache_max_mb=0, model_routes={},
+                                         ai_concurrency=8, file_concurrency=10)
+    converting = []
+
+    def callback(**kwargs):
+        converting.append(sum(thread.name.startswith("ai-file-") for thread in threading.enumerate()))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = controller.process_many([statement_file(name) for name in SAMPLES], model=local_model,
+                                          callback=callback)
+    assert all(result is not None for result in results)
+    assert 0 < max(converting) <= MAX_AI_THREADS // 8
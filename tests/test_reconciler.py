@@ -0,0 +1,59 @@
+"""模型输出的 iCost 行与输入交易记录的对账"""
+from models.transaction import Transaction
+from utils.reconciler import icost_row_match_key, match_icost_rows, record_match_key
+
+
+def _record(date, amount_cents, description="COFFEE"):
+    return Transaction(date, amount_cents, description)
+
+
+def _row(date, amount, note="COFFEE"):
+    return [date, "支出", amount, "餐饮", "", "Chase Checking Account(1234)", "", "USD", note, ""]
+
+
+def test_record_match_key():
+    assert record_match_key(_record("01/02", -1234)) == (1, 2, -1234)
+    assert record_match_key(_record(None, -1234)) is None
+    assert record_match_key(_record("Jan 2", -1234)) is None
+
+
+def test_row_match_key_accepts_both_date_formats():
+    assert icost_row_match_key(_row("2023-01-02", "-12.34")) == (1, 2, -1234)
+    assert icost_row_match_key(_row("01/02", "-12.34")) == (1, 2, -1234)
+    assert icost_row_match_key(_row("01/02/2023", "-12.34")) == (1, 2, -1234)
+    assert icost_row_match_key(_row("yesterday", "-12.34")) is None
+    assert icost_row_match_key(_row("01/02", "n/a")) is None
+
+
+def test_rows_match_out_of_order():
+    records = [_record("01/02", -1234), _record("01/03", 5000)]
+    rows = [_row("2023-01-03", "50.00"), _row("2023-01-02", "-12.34")]
+    matched, missing, duplicates, unmatched = match_icost_rows(records, rows)
+    assert matched == {0: rows[1], 1: rows[0]}
+    assert (missing, duplicates, unmatched) == ([], [], [])
+
+
+def test_same_day_same_amount_match_in_order():
+    records = [_record("01/02", -500, "A"), _record("01/02", -500, "B")]
+    rows = [_row("01/02", "-5.00", "first"), _row("01/02", "-5.00", "second")]
+    matched, missing, _, _ = match_icost_rows(records, rows)
+    assert matched == {0: rows[0], 1: rows[1]}
+    assert missing == []
+
+
+def test_duplicate_unmatched_and_missing_rows():
+    records = [_record("01/02", -1234), _record("01/03", 5000)]
+    rows = [_row("01/02", "-12.34"), _row("01/02", "-12.34"), _row("01/09", "-1.00")]
+    matched, missing, duplicates, unmatched = match_icost_rows(records, rows)
+    assert matched == {0: rows[0]}
+    assert missing == [1]
+    assert duplicates == [rows[1]]
+    assert unmatched == [rows[2]]
+
+
+def test_dateless_record_is_always_missing():
+    records = [_record(None, -1234), _record("01/02", -1234)]
+    matched, missing, duplicates, unmatched = match_icost_rows(records, [_row("01/02", "-12.34")])
+    assert list(matched) == [1]
+    assert missing == [0]
+    assert (duplicates, unmatched) == ([], [])
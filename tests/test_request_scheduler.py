@@ -0,0 +1,124 @@
+"""请求调度器：限流、退避重试和熔断（用假时钟，不真正等待）"""
+import pytest
+
+from utils import request_scheduler
+from utils.request_scheduler import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_SECONDS,
+    CircuitOpenError,
+    RequestScheduler,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    """替代调度器模块中的 time：sleep 只推进时钟并记录等待时间"""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {'headers': {'retry-after': retry_after} if retry_after else {}})()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(request_scheduler, "time", clock)
+    monkeypatch.setattr(request_scheduler.random, "uniform", lambda low, high: high)
+    return clock
+
+
+def _failing(*errors, result="ok"):
+    remaining = list(errors)
+
+    def request():
+        if remaining:
+            raise remaining.pop(0)
+        return result
+    return request
+
+
+def test_retryable_errors_back_off_and_honour_retry_after(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=None, tokens_per_minute=None)
+    assert scheduler.run(_failing(StatusError(500), StatusError(429, retry_after="7"))) == "ok"
+    assert clock.sleeps == [request_scheduler.BACKOFF_BASE_SECONDS, 7.0]
+    stats = scheduler.stats()
+    assert (stats['requests'], stats['succeeded'], stats['retries']) == (1, 1, 2)
+
+
+def test_non_retryable_error_fails_at_once_without_opening_the_circuit(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=None, tokens_per_minute=None)
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(StatusError):
+            scheduler.run(_failing(StatusError(401)))
+    assert clock.sleeps == []
+    assert scheduler.stats()['circuit'] == "closed"
+
+
+def test_retries_are_bounded(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=None, tokens_per_minute=None, max_retries=2)
+    with pytest.raises(StatusError):
+        scheduler.run(_failing(*[StatusError(503)] * 5))
+    assert len(clock.sleeps) == 2
+    assert scheduler.stats()['failed'] == 1
+
+
+def test_circuit_opens_rejects_then_recovers_after_a_probe(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=None, tokens_per_minute=None, max_retries=0)
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(StatusError):
+            scheduler.run(_failing(StatusError(503)))
+    assert scheduler.stats()['circuit'] == "open"
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        scheduler.run(lambda: calls.append(1))
+    assert calls == [] and scheduler.stats()['rejected'] == 1
+
+    # 冷却期后放行一个探测请求，失败则重新熔断
+    clock.now += CIRCUIT_RESET_SECONDS
+    with pytest.raises(StatusError):
+        scheduler.run(_failing(StatusError(503)))
+    assert scheduler.stats()['circuit'] == "open"
+    clock.now += CIRCUIT_RESET_SECONDS
+    assert scheduler.run(lambda: "ok") == "ok"
+    assert scheduler.stats()['circuit'] == "closed"
+
+
+def test_token_bucket_reserves_ahead_and_refills(clock):
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0.0
+    # 余额为 0 后每个令牌需要等待 1 秒；超过容量的请求按容量计算
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1000) == pytest.approx(61.0)
+    clock.now += 61.0
+    assert bucket.reserve(0) == 0.0
+
+
+def test_requests_per_minute_limit_queues_requests(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=2, tokens_per_minute=None)
+    for _ in range(3):
+        scheduler.run(lambda: "ok")
+    assert clock.sleeps == [pytest.approx(30.0)]
+    stats = scheduler.stats()
+    assert stats['max_queue_depth'] == 1
+    assert stats['wait_seconds'] == pytest.approx(30.0)
+
+
+def test_token_limit_is_corrected_by_actual_usage(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=None, tokens_per_minute=600)
+    scheduler.run(lambda: "ok", estimated_tokens=600)
+    scheduler.record_usage(600, 300)
+    scheduler.run(lambda: "ok", estimated_tokens=300)
+    assert clock.sleeps == []
@@ -0,0 +1,22 @@
+"""流式响应的进度统计：重试和升级再次收到同一记录时不重复计数"""
+from controllers.bank_controller import BankStatementController
+from models.transaction import Transaction
+
+
+def _line(date, amount):
+    return f"{date}|支出|{amount}|餐饮||Chase Checking Account(1234)||USD|COFFEE|"
+
+
+def test_row_counter_counts_each_record_once():
+    records = [Transaction("01/02", -500, "A"), Transaction("01/02", -500, "B"), Transaction("01/03", 100, "C")]
+    counted = []
+    on_line = BankStatementController._row_counter(records, counted.append)
+    for line in [_line("2023-01-02", "-5.00"), _line("01/02", "-5.00"), "not a row",
+                 _line("2023-01-09", "-1.00"), _line("2023-01-02", "-5.00"), _line("2023-01-03", "1.00")]:
+        on_line(line)
+    # 重试时再次收到的第三条 01/02 行和对不上的行都不计数
+    assert sum(counted) == len(records)
+
+
+def test_row_counter_without_callback():
+    assert BankStatementController._row_counter([Transaction("01/02", -500, "A")], None) is None